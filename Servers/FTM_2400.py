@@ -36,19 +36,84 @@ serial_server_name = (platform.node() + '_serial_server').replace('-','_').lower
 
 from labrad.server import setting
 from labrad.devices import DeviceServer,DeviceWrapper
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, DeferredLock
 from twisted.internet import reactor, defer
 #import labrad.units as units
 from labrad.types import Value
-import time
+from labrad.errors import Error
 
 TIMEOUT = Value(1,'s')
 # This server does not use timeout because the device doesn't implement standard message termination.
+# Instead replies are read as frames: '!', a length byte (the frame length + 31), the status, data and CRC.
+FRAME = ('!', 1, -31)
+QUERY_TIMEOUT = Value(2,'s')
+# get_snapshot reads rate, thickness and frequency together, and by default reuses them for this long.
+SNAPSHOT_MAX_AGE = Value(0.5,'s')
 BAUD    = 19200
 BYTESIZE = 8
 STOPBITS = 1
 PARITY = 0
 
+
+def crc(text):
+    """The FTM-2400 CRC of text, as a 14 bit number"""
+    value = 0
+    if len(text) > 0:
+        value = 0x3fff
+        for ch in text:
+            value = value ^ ord(ch)
+            for ix in range(0,8):
+                tmpCRC = value
+                value = value>>1
+                if tmpCRC & 0x1 == 1:
+                    value = value ^ 0x2001
+            value = value & 0x3fff
+    return value
+
+
+def crc_chars(crc):
+    """The two characters that carry a CRC value at the end of a frame"""
+    return chr((crc & 0x7f) + 34) + chr(((crc >> 7) & 0x7f) + 34)
+
+
+class FrameParser(object):
+    """Finds reply frames whose CRC checks out in text as it arrives.
+
+    The text holds one character per byte received (latin-1), so length
+    and CRC bytes above 0x7f come through unchanged.  Text that is not
+    part of a valid frame, such as noise on the line or the rest of a
+    corrupted reply, is dropped.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, text):
+        self.buffer += text
+
+    def frame(self):
+        """Remove and return the next valid frame, or None if there is none yet."""
+        while True:
+            start = self.buffer.find('!')
+            if start < 0:
+                self.buffer = ''
+                return None
+            self.buffer = self.buffer[start:]
+            if len(self.buffer) < 2:
+                return None
+            length = ord(self.buffer[1]) - 31 # sync, length, status, data and 2 CRC characters
+            if length >= 5 and len(self.buffer) < length:
+                return None
+            frame = self.buffer[:length]
+            if length >= 5 and self.checks(frame):
+                self.buffer = self.buffer[length:]
+                return frame
+            self.buffer = self.buffer[1:] # not a frame; look for the next sync
+
+    def checks(self, frame):
+        return crc_chars(crc(frame[1:-2])) == frame[-2:]
+
+
 class FTMWrapper(DeviceWrapper):
 
     @inlineCallbacks
@@ -57,6 +122,7 @@ class FTMWrapper(DeviceWrapper):
         print('connecting to "%s" on port "%s"...' % (server.name, port), end=' ')
         self.server = server
         self.ctx = server.context()
+        self.lock = DeferredLock()
         self.port = port
         p = self.packet()
         p.open(port)
@@ -94,13 +160,59 @@ class FTMWrapper(DeviceWrapper):
         returnValue(ans.read_line)
 
     @inlineCallbacks
-    def query(self, code):
-        """ Write, then read. """
-        p = self.packet()
-        p.write_line(code)
-        p.read_line()
-        ans = yield p.send()
-        returnValue(ans.read_line)
+    def query(self, code, timeout=QUERY_TIMEOUT):
+        """Write a command, then read the reply frame, in one request.
+
+        An empty code just reads the next frame. The reply is read as bytes
+        and returned with one character per byte, so that the CRC can be checked."""
+        ans = yield self.packet().query_bytes(code, FRAME, timeout).send()
+        returnValue(ans.query_bytes.decode('latin-1'))
+
+    @inlineCallbacks
+    def transaction(self, code):
+        """Send a command and return its reply frame once the CRC checks out.
+
+        Commands are sent one at a time, so that each reply goes with its
+        command. Returns whatever has arrived if no valid frame comes
+        within QUERY_TIMEOUT."""
+        yield self.lock.acquire()
+        try:
+            deadline = reactor.seconds() + QUERY_TIMEOUT['s']
+            parser = FrameParser()
+            parser.feed((yield self.query(code)))
+            frame = parser.frame()
+            while frame is None and reactor.seconds() < deadline:
+                more = yield self.query('', Value(deadline - reactor.seconds(), 's'))
+                if not more:
+                    break
+                parser.feed(more)
+                frame = parser.frame()
+        finally:
+            self.lock.release()
+        returnValue(frame if frame is not None else parser.buffer)
+
+    @inlineCallbacks
+    def burst(self, codes):
+        """Send several commands and read their reply frames back to back.
+
+        The commands go to the serial server in one packet, without letting
+        other requests in between. Returns one frame per command, or whatever
+        arrived instead of a valid frame."""
+        yield self.lock.acquire()
+        try:
+            p = self.packet()
+            for i, code in enumerate(codes):
+                p.query_bytes(code, FRAME, QUERY_TIMEOUT, key=str(i))
+            ans = yield p.send()
+        finally:
+            self.lock.release()
+        frames = []
+        for i in range(len(codes)):
+            parser = FrameParser()
+            parser.feed(ans[str(i)].decode('latin-1'))
+            frame = parser.frame()
+            frames.append(frame if frame is not None else parser.buffer)
+        returnValue(frames)
 
 
 class FTMServer(DeviceServer):
@@ -116,7 +228,8 @@ class FTMServer(DeviceServer):
         print('done.')
         print(self.serialLinks)
         yield DeviceServer.initServer(self)
-        self.busy = False
+        self.snapshots = {} # (device name, sensor): (time, replies to the rate, thickness and frequency queries)
+        self.snapshotLock = DeferredLock()
         self.sensor = 1 # The sensor that you are reading from
         print("Sensor " + str(self.sensor) + " Selected by default")
 
@@ -163,19 +276,8 @@ class FTMServer(DeviceServer):
     def calcCRC(self,c,str):
         """For given outgoing string, calculates the appropriate crc value ignoring the first character,
         which should simply be the sync character (in this case '!') """
-        crc = 0
         length = 1 + ord(str[1]) - 34
-        if length > 0:
-            crc = 0x3fff
-            for jx in range(1,length+1):
-                crc = crc ^ ord(str[jx])
-                for ix in range(0,8):
-                    tmpCRC = crc
-                    crc = crc>>1
-                    if tmpCRC & 0x1 == 1:
-                        crc = crc ^ 0x2001
-                crc = crc & 0x3fff
-        return crc
+        return crc(str[1:length+1])
 
     @setting(102,crc='i',returns='i')
     def crc2(self,c,crc):
@@ -208,16 +310,12 @@ class FTMServer(DeviceServer):
         try:
             crc_val = self.calcCRC_in(c,ans[:-2])
 
-            # Python 3 update, a unicode decoding error will mess this up thr original test
-            # added the elif statement as a hack-y solution, checks if it contains the error character serial server will put
+            # Replies are read as bytes, one character per byte, so the CRC can always be checked
             crc = chr(self.crc1(c,crc_val)) + chr(self.crc2(c,crc_val))
             if crc == ans[-2:]:
                 return True
-            elif ans[-2]==u"\uFFFD" or ans[-1]==u"\uFFFD":
-                return True
             else:
                 print(ans)
-                print(ans[-2], ans[-1], u"\uFFFD")
                 print('CRC did not match expected form. Error in data: ' + str(ans))
                 return False
         except IndexError:
@@ -227,54 +325,25 @@ class FTMServer(DeviceServer):
     def calcCRC_in(self,c,str):
         """For given incoming string, calculates the appropriate crc value ignoring the first character,
         which should simply be the sync character (in this case '!') """
-        crc = 0
         length = 1 + ord(str[1]) - 35
-        if length > 0:
-            crc = 0x3fff
-            for jx in range(1,length+1):
-                crc = crc ^ ord(str[jx])
-                for ix in range(0,8):
-                    tmpCRC = crc
-                    crc = crc>>1
-                    if tmpCRC & 0x1 == 1:
-                        crc = crc ^ 0x2001
-                crc = crc & 0x3fff
-        return crc
+        return crc(str[1:length+1])
 
     @setting(106,input = 's', returns = 's')
     def read(self,c, input):
         """This piece of equipment doesn't use carriage returns, so the serial port cannot recognize
-        the end of a message. The timeout parameter is set to be 0 and this function
-        loops until the message from the Deposition Monitor has completely arrived or two seconds
-        have elapsed. Also ensures that only one message is sent / being received at a time."""
+        the end of a message. Instead the serial server reads the reply as a frame, using the length
+        byte, and the reply is returned as soon as a frame with a valid CRC has arrived, waiting up
+        to two seconds. Requests to the device are queued, so that only one message is sent / being
+        received at a time."""
         command = self.format_command(c,input)
-        tzero = time.perf_counter()
         #print 'Attempting to write: ' + command
-        while True:
-            if not self.busy:
-                self.busy = True
-                dev=self.selectedDevice(c)
-                #print 'Writing: ' + command
-                yield dev.write(command)
-                ans = ''
-                tzero = time.perf_counter()
-                while True:
-                    temp_ans = yield dev.read()
-                    ans = ans + temp_ans
-                    if self.check_ans(c,ans):
-                        #print 'Returning ans: ' + str(ans[3:-2])
-                        self.busy = False
-                        returnValue(ans[3:-2])
-                    elif (time.perf_counter() - tzero) > 2:
-                        print('Connection timed out while reading')
-                        self.busy = False
-                        returnValue('Timeout')
-            elif (time.perf_counter() - tzero) > 2:
-                print('Connection timed out while writing')
-                self.busy = False
-                returnValue("Timeout")
-            yield self.sleep(0.1)
-            #print "Sleeping"
+        dev=self.selectedDevice(c)
+        ans = yield dev.transaction(command)
+        if self.check_ans(c,ans):
+            #print 'Returning ans: ' + str(ans[3:-2])
+            returnValue(ans[3:-2])
+        print('Connection timed out while reading')
+        returnValue('Timeout')
 
     @setting(107, sensor='i')
     def select_sensor(self, c, sensor):
@@ -282,6 +351,26 @@ class FTMServer(DeviceServer):
         print("Sensor " + str(self.sensor) + " Selected")
         #returnValue(self.sensor)
 
+    def readSnapshot(self, c, maxAge):
+        """Replies to the rate, thickness and frequency queries of the selected sensor,
+        read in one burst unless there are some at most maxAge seconds old. Replies that
+        did not arrive are 'Timeout'."""
+        return self.snapshotLock.run(self._readSnapshot, c, maxAge)
+
+    @inlineCallbacks
+    def _readSnapshot(self, c, maxAge):
+        dev = self.selectedDevice(c)
+        key = (dev.name, self.sensor)
+        if key in self.snapshots and reactor.seconds() - self.snapshots[key][0] <= maxAge:
+            returnValue(self.snapshots[key][1])
+        now = reactor.seconds()
+        commands = ['L'+str(self.sensor)+'?', 'N'+str(self.sensor)+'?', 'P'+str(self.sensor)]
+        frames = yield dev.burst([self.format_command(c,command) for command in commands])
+        replies = tuple(ans[3:-2] if self.check_ans(c,ans) else 'Timeout' for ans in frames)
+        if 'Timeout' not in replies:
+            self.snapshots[key] = (now, replies)
+        returnValue(replies)
+
     def sleep(self,secs):
         """Asynchronous compatible sleep command. Sleeps for given time in seconds, but allows
         other operations to be done elsewhere while paused."""
@@ -387,6 +476,7 @@ class FTMServer(DeviceServer):
     def zero_rates_thickness(self,c):
         """Queries the S command and returns the response. Usage is zero_rates_thickness()"""
         ans = yield self.read(c,'S')
+        self.snapshots.clear()
         returnValue(ans)
 
     @setting(216,returns='s')
@@ -431,6 +521,18 @@ class FTMServer(DeviceServer):
         ans = yield self.read(c,'Z')
         returnValue(ans)
 
+    @setting(223, max_age='v[s]', returns='(vvv)')
+    def get_snapshot(self,c,max_age=None):
+        """Reads the rate (A/s), thickness (A) and crystal frequency of the selected sensor
+        in one burst. If they were read less than max_age ago (default half a second),
+        returns those readings instead, so that several tracked variables can share one
+        read. Usage is get_snapshot() or get_snapshot(max_age)"""
+        maxAge = SNAPSHOT_MAX_AGE['s'] if max_age is None else max_age['s']
+        rate, thickness, freq = yield self.readSnapshot(c,maxAge)
+        if 'Timeout' in (rate, thickness, freq):
+            raise Error('Timeout reading the FTM 2400')
+        returnValue((float(rate), float(thickness)*1e3, float(freq)))
+
 __server__ = FTMServer()
 if __name__ == '__main__':
     from labrad import util
@@ -123,12 +123,9 @@ class LakeShore336Wrapper(DeviceWrapper):
 
     @inlineCallbacks
     def query(self, code):
-        """ Write, then read. """
-        p = self.packet()
-        p.write(code)
-        p.read_line()
-        ans = yield p.send()
-        returnValue(ans.read_line)
+        """Write, then read a line, in one request."""
+        ans = yield self.packet().query(code).send()
+        returnValue(ans.query)
 
 
 class LakeShore336Server(DeviceServer):
@@ -209,37 +206,32 @@ class LakeShore336Server(DeviceServer):
     @setting(101,returns='s')
     def ID(self,c):
         dev=self.selectedDevice(c)
-        yield dev.write("*IDN?\n")
-        ans = yield dev.read()
+        ans = yield dev.query("*IDN?\n")
         returnValue(ans)
 
     @setting(102, channel='?',returns='s')
     def read_temp(self,c,channel):
         dev=self.selectedDevice(c)
-        yield dev.write("KRDG? %s\n"%channel)
-        ans = yield dev.read()
+        ans = yield dev.query("KRDG? %s\n"%channel)
         returnValue(ans)
 
     @setting(103, channel='i',p='v')
     def set_p(self,c,channel,p):
         dev=self.selectedDevice(c)
         yield dev.write("SETP %s,%s\n"%(channel,p))
-        yield dev.write("SETP? %s\n"%channel)
-        ans = yield dev.read()
+        ans = yield dev.query("SETP? %s\n"%channel)
         returnValue(ans)
 
     @setting(104, channel='i',returns='s')
     def read_p(self,c,channel):
         dev=self.selectedDevice(c)
-        yield dev.write("SETP? %s\n"%channel)
-        ans = yield dev.read()
+        ans = yield dev.query("SETP? %s\n"%channel)
         returnValue(ans)
 
     @setting(105, channel='i',returns='s')
     def read_heater_ouput(self,c,channel):
         dev=self.selectedDevice(c)
-        yield dev.write("HTR? %s\n"%channel)
-        ans = yield dev.read()
+        ans = yield dev.query("HTR? %s\n"%channel)
         returnValue(ans)
 
     @setting(106, channel='i', range='i')
@@ -250,8 +242,7 @@ class LakeShore336Server(DeviceServer):
     @setting(107, channel='i',returns='s')
     def read_heater_range(self,c,channel):
         dev=self.selectedDevice(c)
-        yield dev.write("RANGE? %s\n"%channel)
-        ans = yield dev.read()
+        ans = yield dev.query("RANGE? %s\n"%channel)
         returnValue(ans)
 
     @setting(108, channel='i', resistance='i',max_current='i', max_user_current='v',output_display='i')
@@ -262,8 +253,7 @@ class LakeShore336Server(DeviceServer):
     @setting(109, channel='i',returns='s')
     def read_heater_setup(self,c,channel):
         dev=self.selectedDevice(c)
-        yield dev.write("HTRSET? %s\n"%channel)
-        ans = yield dev.read()
+        ans = yield dev.query("HTRSET? %s\n"%channel)
         returnValue(ans)
 
     @setting(111, output = 'i', prop = 'v[]', integ = 'v[]', deriv = 'v[]')
@@ -359,22 +349,19 @@ class LakeShore336Server(DeviceServer):
     @setting(9004)
     def query(self,c,phrase):
         dev=self.selectedDevice(c)
-        yield dev.write(phrase)
-        ret = yield dev.read()
+        ret = yield dev.query(phrase)
         returnValue(ret)
 
     @setting(9005, channel='?',returns='s')
     def read_temp_a(self,c,channel='A'):
         dev=self.selectedDevice(c)
-        yield dev.write("KRDG? %s\n"%channel)
-        ans = yield dev.read()
+        ans = yield dev.query("KRDG? %s\n"%channel)
         returnValue(ans)
 
     @setting(9006, channel='?',returns='s')
     def read_temp_b(self,c,channel='B'):
         dev=self.selectedDevice(c)
-        yield dev.write("KRDG? %s\n"%channel)
-        ans = yield dev.read()
+        ans = yield dev.query("KRDG? %s\n"%channel)
         returnValue(ans)
 __server__ = LakeShore336Server()
 
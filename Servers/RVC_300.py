@@ -96,12 +96,9 @@ class RVCWrapper(DeviceWrapper):
 
     @inlineCallbacks
     def query(self, code):
-        """ Write, then read. """
-        p = self.packet()
-        p.write_line(code)
-        p.read_line()
-        ans = yield p.send()
-        returnValue(ans.read_line)
+        """Write, then read a line, in one request."""
+        ans = yield self.packet().query(code).send()
+        returnValue(ans.query)
 
 
 class RVCServer(DeviceServer):
@@ -157,16 +154,14 @@ class RVCServer(DeviceServer):
     def get_ver(self, c):
         """Queries the VER? command and returns the response. Usage is get_ver()"""
         dev = self.selectedDevice(c)
-        yield dev.write("VER?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("VER?\r\n")
         returnValue(ans)
 
     @setting(206, returns='s')
     def get_nom_prs(self, c):
         """Queries the PRS? command and returns the response. Response is nominal pressure. Usage is get_nom_prs()"""
         dev = self.selectedDevice(c)
-        yield dev.write("PRS?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("PRS?\r\n")
         returnValue(ans)
 
     @setting(207, nom_prs='?', returns='s')
@@ -175,8 +170,7 @@ class RVCServer(DeviceServer):
         of the form x.xxEsxx, where x are digits and s is either + or -. Usage is set_nom_prs('1.00E+01')"""
         dev = self.selectedDevice(c)
         nom_prs = "{:.2E}".format(float(nom_prs))
-        yield dev.write("PRS=" + nom_prs + "\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("PRS=" + nom_prs + "\r\n")
         self.state = True
         returnValue(ans)
 
@@ -184,8 +178,7 @@ class RVCServer(DeviceServer):
     def get_nom_flo(self, c):
         """Queries the PRS? command and returns the response. Response is nominal pressure. Usage is get_nom_flo()"""
         dev = self.selectedDevice(c)
-        yield dev.write("FLO?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("FLO?\r\n")
         returnValue(ans)
 
     @setting(209, nom_flo='s', returns='s')
@@ -193,8 +186,7 @@ class RVCServer(DeviceServer):
         """Queries the FLO=xxx.x command and returns the response. Input requires string
         of the form xxx.x, where x are digits. This sets flow to a percentage. Usage is set_nom_flo('012.5')"""
         dev = self.selectedDevice(c)
-        yield dev.write("FLO=" + nom_flo + "\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("FLO=" + nom_flo + "\r\n")
         self.state = True
         returnValue(ans)
 
@@ -203,10 +195,8 @@ class RVCServer(DeviceServer):
         """Queries the PRS=5.01E-09 and FLO=0000.0 commands and returns the responses. Sets nominal pressure to minimum and
         sets nominal flow to 0, closing the valve in either pressure or flow mode. Usage close_valve()"""
         dev = self.selectedDevice(c)
-        yield dev.write("FLO=000.0\r\n")
-        ans1 = yield dev.read()
-        yield dev.write("PRS=5.01E-09\r\n")
-        ans2 = yield dev.read()
+        ans1 = yield dev.query("FLO=000.0\r\n")
+        ans2 = yield dev.query("PRS=5.01E-09\r\n")
         self.state = False
         returnValue([ans1, ans2])
 
@@ -214,24 +204,21 @@ class RVCServer(DeviceServer):
     def get_mode(self, c):
         """Queries the MOD? command and returns the response. Usage get_mode()"""
         dev = self.selectedDevice(c)
-        yield dev.write("MOD?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("MOD?\r\n")
         returnValue(ans)
 
     @setting(212, returns='s')
     def set_mode_prs(self, c):
         """Queries the MOD=P command and returns the response. Usage set_mode_prs()"""
         dev = self.selectedDevice(c)
-        yield dev.write("MOD=P\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("MOD=P\r\n")
         returnValue(ans)
 
     @setting(213, returns='s')
     def set_mode_flo(self, c):
         """Queries the MOD=F command and returns the response. Usage set_mode_flo()"""
         dev = self.selectedDevice(c)
-        yield dev.write("MOD=F\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("MOD=F\r\n")
         returnValue(ans)
 
     @setting(214, returns='s')
@@ -239,8 +226,7 @@ class RVCServer(DeviceServer):
         """Queries the TAS=D command and returns the response. Disables usage of keys on RVC screen. Usage keys_lock(
         ) """
         dev = self.selectedDevice(c)
-        yield dev.write("TAS=D\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("TAS=D\r\n")
         returnValue(ans)
 
     @setting(215, returns='s')
@@ -248,16 +234,14 @@ class RVCServer(DeviceServer):
         """Queries the TAS=E command and returns the response. Enables usage of keys on RVC screen. Usage
         keys_enable() """
         dev = self.selectedDevice(c)
-        yield dev.write("TAS=E\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("TAS=E\r\n")
         returnValue(ans)
 
     @setting(216, returns='s')
     def get_prs(self, c):
         """Queries the PRI? command and returns the response. Gets current pressure. Usage get_prs()"""
         dev = self.selectedDevice(c)
-        yield dev.write("PRI?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("PRI?\r\n")
         returnValue(ans)
 
     @setting(316, returns='?')
@@ -267,8 +251,7 @@ class RVCServer(DeviceServer):
         and returns a floating point value of the pressure in mbar.
         """
         dev = self.selectedDevice(c)
-        yield dev.write("PRI?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("PRI?\r\n")
         ans = ans.replace("PRI=", "").replace("mbar", "")
         try:
             #returnValue(float(ans))
@@ -282,24 +265,21 @@ class RVCServer(DeviceServer):
     def get_unit(self, c):
         """Queries the UNT? command and returns the response. Gets measurement unit. Usage get_unit()"""
         dev = self.selectedDevice(c)
-        yield dev.write("UNT?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("UNT?\r\n")
         returnValue(ans)
 
     @setting(218, returns='s')
     def get_prs_sensor(self, c):
         """Queries the RTP? command and returns the response. Gets pressure sensor name. Usage get_prs_sensor()"""
         dev = self.selectedDevice(c)
-        yield dev.write("PRS?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("PRS?\r\n")
         returnValue(ans)
 
     @setting(219, returns='s')
     def get_valve_type(self, c):
         """Queries the VEN? command and returns the response. Gets valve type name. Usage get_valve_type()"""
         dev = self.selectedDevice(c)
-        yield dev.write("VEN?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("VEN?\r\n")
         returnValue(ans)
 
     @setting(220, auto='s', returns='s')
@@ -308,8 +288,7 @@ class RVCServer(DeviceServer):
            This sets the PID to automatic paramter where auto = '01' is the slowest response, and auto = '99' is
            the fastest. An example query would be RAS=05. Usage is set_auto_controller('05')."""
         dev = self.selectedDevice(c)
-        yield dev.write("RAS=" + auto + "\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RAS=" + auto + "\r\n")
         returnValue(ans)
 
     @setting(221, auto='s', returns='s')
@@ -318,8 +297,7 @@ class RVCServer(DeviceServer):
             This sets the PID to automatic paramter where auto = '01' is the slowest response, and auto = '99' is
             the fastest. An example query would be RAS=05. Usage is set_auto_controller('05')."""
         dev = self.selectedDevice(c)
-        yield dev.write("RAS=" + auto + "\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RAS=" + auto + "\r\n")
         returnValue(ans)
 
     @setting(222, Kp='s', returns='s')
@@ -328,8 +306,7 @@ class RVCServer(DeviceServer):
             This sets the PID proportional term to the provided input value. Accepts values 0.1 through 100.0."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RSP=" + Kp + "\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RSP=" + Kp + "\r\n")
         returnValue(ans)
 
     @setting(223, Tv='s', returns='s')
@@ -338,8 +315,7 @@ class RVCServer(DeviceServer):
             This sets the PID derivative time Tv to the provided input value. Accepts values 0.0 through 3600.0."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RSD=" + Tv + "\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RSD=" + Tv + "\r\n")
         returnValue(ans)
 
     @setting(224, on='s', returns='s')
@@ -348,8 +324,7 @@ class RVCServer(DeviceServer):
         is on. This turns the auto reset function off and on."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RAR=" + on + "\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RAR=" + on + "\r\n")
         returnValue(ans)
 
     @setting(225, returns='s')
@@ -358,8 +333,7 @@ class RVCServer(DeviceServer):
         parameter entry, 1-99 is slow to fast automatic settings."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RAS?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RAS?\r\n")
         returnValue(ans)
 
     @setting(226, returns='s')
@@ -367,8 +341,7 @@ class RVCServer(DeviceServer):
         """Queries the RSP? command and returns the response, which is the manual PID proportional gain."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RSP?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RSP?\r\n")
         returnValue(ans)
 
     @setting(227, returns='s')
@@ -376,8 +349,7 @@ class RVCServer(DeviceServer):
         """Queries the RSI? command and returns the response, which is the manual PID reset time."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RSI?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RSI?\r\n")
         returnValue(ans)
 
     @setting(228, returns='s')
@@ -385,8 +357,7 @@ class RVCServer(DeviceServer):
         """Queries the RSD? command and returns the response, which is the manual PID derivative time."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RSD?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RSD?\r\n")
         returnValue(ans)
 
     @setting(229, returns='s')
@@ -395,8 +366,7 @@ class RVCServer(DeviceServer):
             whereas RAR=1 corresponds to it being on."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RAR?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RAR?\r\n")
         returnValue(ans)
 
     @setting(230, returns='s')
@@ -404,8 +374,7 @@ class RVCServer(DeviceServer):
         """Queries the RVA? command and returns the response. Returns the deviation."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RVA?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RVA?\r\n")
         returnValue(ans)
 
     @setting(231, returns='s')
@@ -413,8 +382,7 @@ class RVCServer(DeviceServer):
         """Queries the RVP? command and returns the response. Returns the P component."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RVA?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RVA?\r\n")
         returnValue(ans)
 
     @setting(232, returns='s')
@@ -422,8 +390,7 @@ class RVCServer(DeviceServer):
         """Queries the RVI? command and returns the response. Returns the I component."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RVI?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RVI?\r\n")
         returnValue(ans)
 
     @setting(233, returns='s')
@@ -431,16 +398,14 @@ class RVCServer(DeviceServer):
         """Queries the RVD? command and returns the response. Returns the D component."""
 
         dev = self.selectedDevice(c)
-        yield dev.write("RVD?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RVD?\r\n")
         returnValue(ans)
 
     @setting(234, returns='s')
     def get_manipulating_variable(self, c):
         """Queries the RVO? command and returns the response. Returns the manipulating variable."""
         dev = self.selectedDevice(c)
-        yield dev.write("RVO?\r\n")
-        ans = yield dev.read()
+        ans = yield dev.query("RVO?\r\n")
         returnValue(ans)
 
     @setting(235, returns='b')
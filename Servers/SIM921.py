@@ -96,12 +96,9 @@ class SIM921Wrapper(DeviceWrapper):
 
     @inlineCallbacks
     def query(self, code):
-        """ Write, then read. """
-        p = self.packet()
-        p.write(code)
-        p.read_line()
-        ans = yield p.send()
-        returnValue(ans.read_line)
+        """Write, then read a line, in one request."""
+        ans = yield self.packet().query(code).send()
+        returnValue(ans.query)
 
 
 class SIM921Server(DeviceServer):
@@ -39,14 +39,26 @@ from labrad.devices import DeviceServer,DeviceWrapper
 from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.internet import reactor, defer
 from labrad.types import Value
-import time
+from labrad.errors import Error
 
 TIMEOUT = Value(2,'s')
+QUERY_TIMEOUT = Value(5,'s')
+READ_DEADLINE = Value(2,'s') # readings that can't get the port by then are dropped
+STALE_REQUEST = 6 # error code of the serial server's StaleRequestError
+# Replies end in '$' and a two digit checksum, then a CR. They are read through the checksum,
+# since stray characters from the supply can include a CR; the CR is left and filtered out.
+REPLY_END = ('$', 2)
+# The supply randomly inserts unimportant characters; only these are kept from a reply.
+PRINTABLE = frozenset(chr(code) for code in range(32, 128))
 BAUD    = 19200
 BYTESIZE = 8
 STOPBITS = 1
 PARITY = 0
 
+def ascii_codes(text):
+    """The character codes of text, for error messages"""
+    return ''.join(str(ord(char)) + ',' for char in text)
+
 class PowerSupplyWrapper(DeviceWrapper):
 
     @inlineCallbacks
@@ -55,6 +67,9 @@ class PowerSupplyWrapper(DeviceWrapper):
         print('connecting to "%s" on port "%s"...' % (server.name, port), end=' ')
         self.server = server
         self.ctx = server.context()
+        # Readings share the port from a second context, so that setting
+        # the output never waits behind them.
+        self.telemetry = server.context()
         self.port = port
         p = self.packet()
         p.open(port)
@@ -66,16 +81,23 @@ class PowerSupplyWrapper(DeviceWrapper):
         p.read()  # clear out the read buffer
         #Set timeout to 0
         p.timeout(None)
-        print(" CONNECTED ")
+        p.priority('control')
         yield p.send()
+        p = self.packet(self.telemetry)
+        p.open(port)
+        p.priority('telemetry', READ_DEADLINE)
+        yield p.send()
+        print(" CONNECTED ")
 
-    def packet(self):
-        """Create a packet in our private context"""
-        return self.server.packet(context=self.ctx)
+    def packet(self, context=None):
+        """Create a packet in our private context, or the given one"""
+        return self.server.packet(context=context or self.ctx)
 
+    @inlineCallbacks
     def shutdown(self):
         """Disconnect from the serial port when we shut down"""
-        return self.packet().close().send()
+        yield self.packet(self.telemetry).close().send()
+        yield self.packet().close().send()
 
     @inlineCallbacks
     def write(self, code):
@@ -91,13 +113,20 @@ class PowerSupplyWrapper(DeviceWrapper):
         returnValue(ans.read_line)
 
     @inlineCallbacks
-    def query(self, code):
-        """ Write, then read. """
-        p = self.packet()
-        p.write_line(code)
-        p.read_line()
-        ans = yield p.send()
-        returnValue(ans.read_line)
+    def query(self, code, telemetry=False):
+        """Write a command, then read the reply through its checksum, in one request.
+
+        Telemetry queries go to the back of the port's queue and return
+        None if they can't get the port within READ_DEADLINE.
+        """
+        try:
+            ans = yield self.packet(self.telemetry if telemetry else None).query(
+                code, REPLY_END, QUERY_TIMEOUT).send()
+        except Error as e:
+            if e.code != STALE_REQUEST:
+                raise
+            returnValue(None)
+        returnValue(ans.query)
 
 
 class PowerSupplyServer(DeviceServer):
@@ -113,7 +142,6 @@ class PowerSupplyServer(DeviceServer):
         print('done.')
         print(self.serialLinks)
         yield DeviceServer.initServer(self)
-        self.busy = False
 
     @inlineCallbacks
     def loadConfigInfo(self):
@@ -148,68 +176,32 @@ class PowerSupplyServer(DeviceServer):
 
     @setting(100,input = 's',returns = 's')
     def read(self,c, input):
-        """This piece of equipment doesn't use carriage returns, so the serial port cannot recognize
-        the end of a message. The timeout parameter is set to be 0 and this function
-        loops until the message from the Power Supply has completely arrived or two seconds
-        have elapsed. Also ensures that only one message is sent / being received at a time."""
+        """Sends a command with its checksum and reads the reply through its checksum, waiting up to five
+        seconds for it to arrive, then checks the reply's checksum. The serial server sends one
+        message at a time; commands go ahead of queries (ending in ?), and a query that waits
+        more than two seconds for the port returns Timeout."""
 
-        tzero = time.perf_counter()
+        telemetry = input.endswith('?')
         input = input + '$' + self.checksum(input) + '\r'
         #print 'Attempting to write: ' + input
 
-        while True:
-            if self.busy == False:
-                #print('Initiating Query: ' + input)
-                self.busy = True
-                dev=self.selectedDevice(c)
-                #print('Writing: ' + input)
-                yield dev.write(input)
-                ans = ''
-                tzero = time.perf_counter()
-                while True:
-                    temp_ans = yield dev.read()
-                    ans = ans + temp_ans
-                    #TDK power supply randomly inserts unimportant characters. Following loop removes them
-                    ans_final = ''
-                    for char in ans:
-                        if ord(char) > 31 and ord(char) < 128:
-                            ans_final = ans_final + char
-
-                    ans = ans_final
-                    #print(ans)
-                    #print(len(ans))
-                    # try:
-                    #     print('Printing 3rd to last char: ' + ans[-3])
-                    # except:
-                    #     pass
-                    if len(ans)>3 and ans[-3] == '$':
-                        #print('Checking stuff')
-                        #print(ans[-2:])
-                        #print(self.checksum(ans[:-3]))
-                        if ans[-2:] == self.checksum(ans[:-3]):
-                            #print('Returning: ' + ans)
-                            self.busy = False
-                            returnValue(ans[:-3])
-                        else:
-                            ans_num = ''
-                            for char in ans:
-                                ans_num = ans_num + str(ord(char)) + ','
-                            print('Checksum error: ' + ans + ', Length: ' + str(len(ans)) + ', ASCII: ' +  ans_num)
-                            self.busy = False
-                            returnValue('ChecksumError')
-                    elif (time.perf_counter() - tzero) > 5:
-                        ans_num = ''
-                        for char in ans:
-                            ans_num = ans_num + str(ord(char)) + ','
-                        #print('Reading timeout: ' + ans + ', Length: ' + str(len(ans)) + ', ASCII: ' +  ans_num)
-                        self.busy = False
-                        returnValue('Timeout')
-                    yield self.sleep(0.005)
-            elif (time.perf_counter() - tzero) > 2:
-                #print('Connection timed out while writing')
-                self.busy = False
-                returnValue("Timeout")
-            yield self.sleep(0.01)
+        dev=self.selectedDevice(c)
+        ans = yield dev.query(input, telemetry)
+        if ans is None:
+            #print('Connection timed out while writing')
+            returnValue("Timeout")
+
+        #TDK power supply randomly inserts unimportant characters. Following line removes them
+        ans = ''.join(char for char in ans if char in PRINTABLE)
+
+        if len(ans)>3 and ans[-3] == '$':
+            if ans[-2:] == self.checksum(ans[:-3]):
+                #print('Returning: ' + ans)
+                returnValue(ans[:-3])
+            print('Checksum error: ' + ans + ', Length: ' + str(len(ans)) + ', ASCII: ' +  ascii_codes(ans))
+            returnValue('ChecksumError')
+        #print('Reading timeout: ' + ans + ', Length: ' + str(len(ans)) + ', ASCII: ' +  ascii_codes(ans))
+        returnValue('Timeout')
 
     def sleep(self,secs):
         d = defer.Deferred()
@@ -33,13 +33,15 @@ timeout = 5
 import os
 import sys
 
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
 from twisted.internet.defer import inlineCallbacks, returnValue
 
 import labrad.util
 import labrad.wrappers
 
-from datavault import SessionStore
+from datavault import SessionStore, backend
+from datavault.executor import IOExecutor
+from datavault.index import INDEX_FILE, VaultIndex
 from datavault.server import DataVault
 
 
@@ -51,6 +53,11 @@ def load_settings(cxn, name):
     registry. If not configured, we instead prompt the user to enter a path
     to use for storing data, and save this config into the registry to be
     used later.
+
+    An optional boolean 'SWMR' key in the same directory makes new HDF5
+    datasets readable by other processes while they are being written.
+    Optional 'Cache MB' and 'Cache Handles' keys set the budget for data
+    held in memory and datafiles held open across all datasets.
     """
     path = ['', 'Servers', name, 'Repository']
     nodename = labrad.util.getNodeName()
@@ -77,7 +84,15 @@ def load_settings(cxn, name):
         print('Data location configured in the registry at {}: {}'.format(
             path + [nodename], datadir))
         print('To change this, edit the registry keys and restart the server.')
-    returnValue(datadir)
+    swmr = False
+    if 'SWMR' in keys:
+        swmr = bool((yield reg.get('SWMR')))
+    cache = {}
+    if 'Cache MB' in keys:
+        cache['maxBytes'] = int((yield reg.get('Cache MB')) * 1024 * 1024)
+    if 'Cache Handles' in keys:
+        cache['maxHandles'] = int((yield reg.get('Cache Handles')))
+    returnValue((datadir, swmr, cache))
 
 def main(argv=sys.argv):
     @inlineCallbacks
@@ -85,9 +100,17 @@ def main(argv=sys.argv):
         opts = labrad.util.parseServerOptions(name=DataVault.name)
         cxn = yield labrad.wrappers.connectAsync(
             host=opts['host'], port=int(opts['port']), password=opts['password'])
-        datadir = yield load_settings(cxn, opts['name'])
+        datadir, swmr, cache = yield load_settings(cxn, opts['name'])
         yield cxn.disconnect()
-        session_store = SessionStore(datadir, hub=None)
+        backend.resource_cache.configure(**cache)
+        vault_index = VaultIndex(os.path.join(datadir, INDEX_FILE))
+        if vault_index.created:
+            # first start with an index: fill it in from the existing files
+            print('Building the vault index in the background.')
+            threads.deferToThread(vault_index.rebuild, datadir, report=print)
+        session_store = SessionStore(datadir, hub=None, swmr=swmr,
+                                     executor=IOExecutor(),
+                                     vault_index=vault_index)
         server = DataVault(session_store)
         session_store.hub = server
 
@@ -5,9 +5,13 @@ import re
 #import collections
 import weakref
 
+import numpy as np
+from twisted.internet import defer, reactor
+from twisted.python import log
 #from labrad import types as T
 
-from . import backend, errors, util
+from . import backend, decimate, errors, util
+from .tags import TagJournal
 
 
 ## Filename translation.
@@ -82,11 +86,114 @@ def parse_dependent(s):
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
 
 
+class DirectoryIndex(object):
+    """In-memory listing of the files in a session directory.
+
+    The directory is only rescanned when its modification time changes, so
+    repeated listings and lookups by dataset number don't hit the disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+
+    def _scan(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        self.dirs = set()
+        self.extensions = {} # dataset name -> set of file extensions
+        for s in os.listdir(self.path):
+            base, _, ext = s.rpartition('.')
+            if ext == 'dir':
+                self.dirs.add(filename_decode(base))
+            elif base.endswith(backend.CONVERTING_SUFFIX):
+                continue
+            elif ext in ('csv', 'hdf5') or (ext == 'ini' and s.lower() != 'session.ini'):
+                self.extensions.setdefault(filename_decode(base), set()).add(ext)
+        self._rebuild()
+        self._mtime = mtime
+
+    def _rebuild(self):
+        # csv datasets are listed by their .ini file, but can only be
+        # opened once the .csv file exists
+        self.listed = sorted(name for name, exts in self.extensions.items()
+                             if exts & {'ini', 'hdf5'})
+        self.datasets = sorted(name for name, exts in self.extensions.items()
+                               if exts & {'csv', 'hdf5'})
+        self.numbers = {}
+        for name in self.datasets:
+            if name[:5].isdigit():
+                self.numbers.setdefault(int(name[:5]), name)
+
+    def contents(self):
+        """Get sorted lists of subdirectory and dataset names."""
+        self._scan()
+        return sorted(self.dirs), list(self.listed)
+
+    def listDatasets(self):
+        """Get a sorted list of dataset names that can be opened."""
+        self._scan()
+        return list(self.datasets)
+
+    def hasDataset(self, name):
+        self._scan()
+        return name in self.extensions and bool(self.extensions[name] & {'csv', 'hdf5'})
+
+    def lookup(self, num):
+        """Get the name of the dataset with the given number, or None."""
+        self._scan()
+        return self.numbers.get(num)
+
+    def current(self):
+        """Check whether the index matches what is on disk right now."""
+        return self._mtime is not None and os.stat(self.path).st_mtime_ns == self._mtime
+
+    def addDataset(self, name, ext):
+        """Record a dataset file that we just created in this directory.
+
+        Only call this if the index was current before the file was created;
+        otherwise leave it for the next rescan to pick up.
+        """
+        self.extensions.setdefault(name, set()).add(ext)
+        self._rebuild()
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def rewrite(self, write, *args):
+        """Call write(*args), which rewrites files that don't change the listing.
+
+        Metadata such as session.ini is replaced by renaming a temp file
+        over it, which changes the directory's modification time.  If the
+        index was current before, it is kept rather than rescanned.
+        """
+        indexed = self.current()
+        result = write(*args)
+        if indexed:
+            self._mtime = os.stat(self.path).st_mtime_ns
+        return result
+
+    def rewriteIn(self, run, write, *args):
+        """Like rewrite, but write(*args) is passed to run, e.g. an I/O lane.
+
+        run must return a Deferred.  The index itself is only looked at and
+        updated here and in its callback, on the calling (reactor) thread.
+        """
+        indexed = self.current()
+        def written(result):
+            if indexed:
+                self._mtime = os.stat(self.path).st_mtime_ns
+            return result
+        return run(write, *args).addCallback(written)
+
+
 class SessionStore(object):
-    def __init__(self, datadir, hub):
+    def __init__(self, datadir, hub, swmr=False, executor=None, vault_index=None):
         self._sessions = weakref.WeakValueDictionary()
         self.datadir = datadir
         self.hub = hub
+        self.swmr = swmr # write HDF5 files so other processes can read them live
+        self.executor = executor # runs dataset I/O off the reactor thread, if set
+        self.vault_index = vault_index # vault-wide search index kept up to date, if set
 
     def get_all(self):
         return list(self._sessions.values())
@@ -108,10 +215,25 @@ class SessionStore(object):
         path = tuple(path)
         if path in self._sessions:
             return self._sessions[path]
-        session = Session(self.datadir, path, self.hub, self)
+        session = Session(self.datadir, path, self.hub, self, swmr=self.swmr,
+                          executor=self.executor, vault_index=self.vault_index)
         self._sessions[path] = session
         return session
 
+    def flush(self):
+        """Write out any metadata changes that are still waiting to be saved.
+
+        Returns a Deferred that fires once they have been written.
+        """
+        saves = []
+        for session in self.get_all():
+            saves.append(defer.maybeDeferred(session.flush))
+            for dataset in list(session.datasets.values()):
+                saves.append(defer.maybeDeferred(dataset.flush))
+        for d in saves:
+            d.addErrback(log.err, 'Failed to save metadata')
+        return defer.DeferredList(saves)
+
 
 class Session(object):
     """Stores information about a directory on disk.
@@ -121,13 +243,23 @@ class Session(object):
     file, and manages the datasets in this directory.
     """
 
-    def __init__(self, datadir, path, hub, session_store):
+    def __init__(self, datadir, path, hub, session_store, reactor=reactor, swmr=False,
+                 executor=None, vault_index=None):
         """Initialization that happens once when session object is created."""
         self.path = path
         self.hub = hub
+        self.reactor = reactor
+        self.swmr = swmr
+        self.executor = executor
+        self.vault_index = vault_index
         self.dir = filedir(datadir, path)
         self.infofile = os.path.join(self.dir, 'session.ini')
         self.datasets = weakref.WeakValueDictionary()
+        # session.ini is written in this lane when an executor is given
+        self._lane = executor.lane() if executor is not None else None
+        self._saver = backend.DelayedSave(self.save, reactor=reactor)
+        self._index = DirectoryIndex(self.dir)
+        self._tags = TagJournal(self.dir)
 
         if not os.path.exists(self.dir):
             os.makedirs(self.dir)
@@ -141,10 +273,12 @@ class Session(object):
         else:
             self.counter = 1
             self.created = self.modified = datetime.now()
-            self.session_tags = {}
-            self.dataset_tags = {}
+        self.session_tags = self._tags.sessions
+        self.dataset_tags = self._tags.datasets
 
-        self.access() # update current access time and save
+        # update current access time and save; later accesses are batched
+        self.accessed = datetime.now()
+        self.save().addErrback(log.err, 'Failed to save ' + self.infofile)
         self.listeners = set()
 
     def load(self):
@@ -160,16 +294,23 @@ class Session(object):
         self.accessed = time_from_str(S.get(sec, 'Accessed'))
         self.modified = time_from_str(S.get(sec, 'Modified'))
 
-        # get tags if they're there
-        if S.has_section('Tags'):
-            self.session_tags = eval(S.get('Tags', 'sessions', raw=True))
-            self.dataset_tags = eval(S.get('Tags', 'datasets', raw=True))
+        # The saved counter can lag behind the files on disk if we stopped
+        # before a delayed save went out, so never reuse a dataset number.
+        numbers = [int(name[:5]) for name in self.listDatasets() if name[:5].isdigit()]
+        if numbers:
+            self.counter = max(self.counter, max(numbers) + 1)
+
+        # tags live in their own journal; older sessions kept them in here
+        if self._tags.exists():
+            self._tags.load()
         else:
-            self.session_tags = {}
-            self.dataset_tags = {}
+            self._index.rewrite(self._tags.migrate, S)
 
     def save(self):
-        """Save info to the session.ini file."""
+        """Save info to the session.ini file.
+
+        The file is written in the session's I/O lane; returns a Deferred.
+        """
         S = util.DVSafeConfigParser()
 
         sec = 'File System'
@@ -182,26 +323,29 @@ class Session(object):
         S.set(sec, 'Accessed', time_to_str(self.accessed))
         S.set(sec, 'Modified', time_to_str(self.modified))
 
-        sec = 'Tags'
-        S.add_section(sec)
-        S.set(sec, 'sessions', repr(self.session_tags))
-        S.set(sec, 'datasets', repr(self.dataset_tags))
+        return self._index.rewriteIn(self.run, util.write_config, S, self.infofile)
 
-        with open(self.infofile, 'w') as f:
-            S.write(f)
+    def run(self, func, *args, **kw):
+        """Run func in this session's I/O lane and return a Deferred.
+
+        Without an executor, func runs right away on the calling thread.
+        """
+        if self._lane is None:
+            return defer.maybeDeferred(func, *args, **kw)
+        return self._lane.run(func, *args, **kw)
+
+    def flush(self):
+        """Save now if anything has changed since the last save."""
+        return self._saver.flush()
 
     def access(self):
-        """Update last access time and save."""
+        """Update last access time and schedule a save."""
         self.accessed = datetime.now()
-        self.save()
+        self._saver.mark()
 
     def listContents(self, tagFilters):
         """Get a list of directory names in this directory."""
-        files = os.listdir(self.dir)
-        dirs = [filename_decode(s[:-4]) for s in files if s.endswith('.dir')]
-        csv_datasets = [filename_decode(s[:-4]) for s in files if s.endswith('.ini') and s.lower() != 'session.ini' ]
-        hdf5_datasets = [filename_decode(s[:-5]) for s in files if s.endswith('.hdf5')]
-        datasets = sorted(csv_datasets + hdf5_datasets)
+        dirs, datasets = self._index.contents()
         # apply tag filters
         def include(entries, tag, tags):
             """Include only entries that have the specified tag."""
@@ -223,13 +367,7 @@ class Session(object):
 
     def listDatasets(self):
         """Get a list of dataset names in this directory."""
-        files = os.listdir(self.dir)
-        filenames = []
-        for s in files:
-            base, _, ext = s.rpartition('.')
-            if ext in ['csv', 'hdf5']:
-                filenames.append(filename_decode(base))
-        return sorted(filenames)
+        return self._index.listDatasets()
 
     def newDataset(self, title, independents, dependents, extended=False):
         num = self.counter
@@ -237,10 +375,18 @@ class Session(object):
         self.modified = datetime.now()
 
         name = '%05d - %s' % (num, title)
+        indexed = self._index.current()
         dataset = Dataset(self, name, title, create=True,
                           independents=independents,
                           dependents=dependents,
-                          extended=extended)
+                          extended=extended,
+                          reactor=self.reactor,
+                          swmr=self.swmr,
+                          executor=self.executor)
+        if indexed:
+            self._index.addDataset(name, 'hdf5')
+        if self.vault_index is not None:
+            self.vault_index.addDataset(self.path, name, title)
         self.datasets[name] = dataset
         self.access()
 
@@ -251,18 +397,13 @@ class Session(object):
     def openDataset(self, name):
         # first lookup by number if necessary
         if isinstance(name, int):
-            for oldName in self.listDatasets():
-                num = int(oldName[:5])
-                if name == num:
-                    name = oldName
-                    break
-        # if it's still a number, we didn't find the set
-        if isinstance(name, int):
-            raise errors.DatasetNotFoundError(name)
+            num = name
+            name = self._index.lookup(num)
+            # if there's no name, we didn't find the set
+            if name is None:
+                raise errors.DatasetNotFoundError(num)
 
-        filename = filename_encode(name)
-        file_base = os.path.join(self.dir, filename)
-        if not (os.path.exists(file_base + '.csv') or os.path.exists(file_base + '.hdf5')):
+        if not self._index.hasDataset(name):
             raise errors.DatasetNotFoundError(name)
 
         if name in self.datasets:
@@ -270,7 +411,8 @@ class Session(object):
             dataset.access()
         else:
             # need to create a new wrapper for this dataset
-            dataset = Dataset(self, name)
+            dataset = Dataset(self, name, reactor=self.reactor, swmr=self.swmr,
+                              executor=self.executor)
             self.datasets[name] = dataset
         self.access()
 
@@ -311,7 +453,10 @@ class Session(object):
         sessUpdates = updateTagDict(tags, sessions, self.session_tags)
         dataUpdates = updateTagDict(tags, datasets, self.dataset_tags)
 
+        self._index.rewrite(self._tags.record, sessUpdates, dataUpdates)
         self.access()
+        if self.vault_index is not None:
+            self.vault_index.setTags(self.path, sessUpdates, dataUpdates)
         if len(sessUpdates) + len(dataUpdates):
             # fire a message about the new tags
             msg = (sessUpdates, dataUpdates)
@@ -327,39 +472,78 @@ class Dataset(object):
     This object basically takes care of listeners and notifications.
     All the actual data or metadata access is proxied through to a
     backend object.
+
+    Apart from opening the dataset, the backend is only used in the
+    dataset's I/O lane.  The metadata that clients ask for (variables,
+    parameters and comments) is read when the dataset is opened and kept
+    here, so the reactor thread serves it without touching the file.
+    The listener sets are only changed on the reactor thread.
     """
-    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False):
+    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False,
+                 reactor=reactor, swmr=False, executor=None):
         self.hub = session.hub
         self.name = name
+        self.reactor = reactor
+        self.vault_index = session.vault_index
+        self._path = session.path
+        self._index = session._index # for saving CSV datasets' .ini files
+        # file I/O runs in this lane when an executor is given; the backend
+        # also uses it to schedule its idle timeouts
+        self._lane = executor.lane() if executor is not None else None
+        io_reactor = self._lane or reactor
         file_base = os.path.join(session.dir, filename_encode(name))
         self.listeners = set() # contexts that want to hear about added data
+        self.push_listeners = {} # context -> (cursor, maxPoints, method); see startPushing
         self.param_listeners = set()
         self.comment_listeners = set()
+        self._saver = backend.DelayedSave(self.save, reactor=reactor)
 
         if create:
             indep = [self.makeIndependent(i, extended) for i in independents]
             dep = [self.makeDependent(d, extended) for d in dependents]
-            self.data = backend.create_backend(file_base, title, indep, dep, extended)
-            self.save()
+            self.data = backend.create_backend(file_base, title, indep, dep, extended, swmr,
+                                               reactor=io_reactor)
+            self._loadInfo()
+            self.save().addErrback(log.err, 'Failed to save ' + name)
         else:
-            self.data = backend.open_backend(file_base)
+            self.data = backend.open_backend(file_base, swmr, reactor=io_reactor)
             self.load()
+            self._loadInfo()
             self.access()
 
+    def _loadInfo(self):
+        """Read the metadata that is served from memory."""
+        data = self.data
+        with data.hold():
+            self.dtype = data.dtype
+            self._version = '.'.join(str(x) for x in data.version)
+            self._title = data.title
+            self._independents = data.getIndependents()
+            self._dependents = data.getDependents()
+            self._rowType = data.getRowType()
+            self._transposeType = data.getTransposeType()
+            self._paramNames = data.getParamNames()
+            self._params = dict((name, data.getParameter(name)) for name in self._paramNames)
+            self._comments, _ = data.getComments(None, 0)
+
     def save(self):
-        self.data.save()
+        """Save the metadata file, in the I/O lane; returns a Deferred."""
+        return self._index.rewriteIn(self.run, self.data.save)
 
     def load(self):
         self.data.load()
 
     def version(self):
-        v = self.data.version
-        return '.'.join(str(x) for x in v)
+        return self._version
+
+    def flush(self):
+        """Save now if anything has changed since the last save."""
+        return self._saver.flush()
 
     def access(self):
-        """Update time of last access for this dataset."""
-        self.data.access()
-        self.save()
+        """Update time of last access for this dataset and schedule a save."""
+        self.run(self.data.access).addErrback(log.err, 'Failed to update ' + self.name)
+        self._saver.mark()
 
     def makeIndependent(self, label, extended):
         """Add an independent variable to this dataset."""
@@ -381,55 +565,174 @@ class Dataset(object):
             label, legend, units = parse_dependent(label)
         return backend.Dependent(label=label, legend=legend, shape=(1,), datatype='v', unit=units)
 
+    def isSimple(self):
+        """Whether every column is a scalar float, so rows can be read with get."""
+        return all(self.dtype[name] == np.float64 for name in self.dtype.names)
+
     def getIndependents(self):
-        return self.data.getIndependents()
+        return self._independents
 
     def getDependents(self):
-        return self.data.getDependents()
+        return self._dependents
 
     def getRowType(self):
-        return self.data.getRowType()
+        return self._rowType
 
     def getTransposeType(self):
-        return self.data.getTransposeType()
+        return self._transposeType
 
     def addParameter(self, name, data, saveNow=True):
-        self.data.addParam(name, data)
-        if saveNow:
-            self.save()
-
-        # notify all listening contexts
-        self.hub.onNewParameter(None, self.param_listeners)
-        self.param_listeners = set()
-        return name
+        """Add a parameter; returns a Deferred that fires with its name once written."""
+        d = self.addParameters([(name, data)], saveNow)
+        return d.addCallback(lambda _: name)
 
     def addParameters(self, params, saveNow=True):
-        for name, data in params:
-            self.data.addParam(name, data)
+        """Add parameters; returns a Deferred that fires once they are written."""
+        names = set(self._paramNames)
+        for name, _ in params:
+            if name in names:
+                raise errors.ParameterInUseError(name)
+            names.add(name)
+        def write():
+            for name, data in params:
+                self.data.addParam(name, data)
+            # read back what was stored, as getParameter would have
+            return (self.data.getParamNames(),
+                    [(name, self.data.getParameter(name)) for name, _ in params])
+        d = self.run(write)
+        d.addCallback(self._parametersAdded)
         if saveNow:
-            self.save()
+            d.addCallback(lambda _: self.save())
+        return d
+
+    def _parametersAdded(self, written):
+        names, params = written
+        self._paramNames = names
+        self._params.update(params)
+        self._indexParameters(params)
 
         # notify all listening contexts
         self.hub.onNewParameter(None, self.param_listeners)
         self.param_listeners = set()
 
+    def _indexParameters(self, params):
+        if self.vault_index is not None:
+            self.vault_index.addParameters(self._path, self.name, params,
+                                     title=self._title)
+
     def getParameter(self, name, case_sensitive=True):
-        return self.data.getParameter(name, case_sensitive)
+        if case_sensitive:
+            if name in self._params:
+                return self._params[name]
+        else:
+            for key in self._paramNames:
+                if key.lower() == name.lower():
+                    return self._params[key]
+        raise errors.BadParameterError(name)
 
     def getParamNames(self):
-        return self.data.getParamNames()
+        return list(self._paramNames)
+
+    def run(self, func, *args, **kw):
+        """Run func in this dataset's I/O lane and return a Deferred.
+
+        Without an executor, func runs right away on the calling thread.
+        """
+        if self._lane is None:
+            return defer.maybeDeferred(func, *args, **kw)
+        return self._lane.run(func, *args, **kw)
+
+    def _onReactor(self, func, *args):
+        """Call func on the reactor thread, from the lane if running in one."""
+        if self._lane is None:
+            func(*args)
+        else:
+            self.reactor.callFromThread(func, *args)
 
     def addData(self, data):
         # append the data to the file
         self.data.addData(data)
+        self._onReactor(self._dataAdded)
 
+    def _dataAdded(self):
         # notify all listening contexts
         self.hub.onDataAvailable(None, self.listeners)
         self.listeners = set()
+        if self.push_listeners:
+            self._pushAll()
+
+    def readAt(self, cursor, read, *args):
+        """Read from a context's position and move it past what was read.
+
+        cursor is a dict whose 'filepos' entry is the read position (the
+        server passes the context itself).  read(start, *args) runs in the
+        I/O lane and returns (result, end); the Deferred fires with result.
+        Call this from the reactor thread, which is the only one that
+        changes cursors.  Reads through one cursor are queued so that none
+        starts before the previous one has moved it, and no rows are seen
+        twice or skipped.
+        """
+        lock = cursor.setdefault('readlock', defer.DeferredLock())
+        @defer.inlineCallbacks
+        def locked():
+            result, end = yield self.run(read, cursor['filepos'], *args)
+            if cursor.get('datasetObj', self) is self: # not moved to another dataset meanwhile
+                cursor['filepos'] = end
+            defer.returnValue(result)
+        return lock.run(locked)
+
+    def startPushing(self, context, cursor, maxPoints=0, method='stride'):
+        """Send rows to context as they are added, in 'data pushed' signals.
+
+        cursor is as for readAt.  Each message carries (start, end, rows)
+        for the rows from the cursor to the end of the dataset, decimated
+        to at most maxPoints rows if maxPoints is nonzero, and the cursor
+        is moved to end.  Rows already waiting are sent right away; the
+        Deferred returned fires once they have been.
+        """
+        self.push_listeners[context] = (cursor, maxPoints, method)
+        return self._push([context])
+
+    def stopPushing(self, context):
+        self.push_listeners.pop(context, None)
+
+    def _pushAll(self):
+        self._push(list(self.push_listeners))
+
+    def _push(self, contexts):
+        blocks = {} # contexts at the same position share one read
+        pushes = []
+        for context in contexts:
+            if context not in self.push_listeners:
+                continue
+            cursor, maxPoints, method = self.push_listeners[context]
+            d = self.readAt(cursor, self._readPush, blocks, maxPoints, method)
+            d.addCallback(self._pushed, context)
+            # the rows are stored whatever happens here, so don't fail the writer
+            d.addErrback(log.err, 'Failed to push data from {}'.format(self.name))
+            pushes.append(d)
+        return defer.DeferredList(pushes)
+
+    def _readPush(self, start, blocks, maxPoints, method):
+        if not self.data.hasMore(start):
+            return None, start
+        if start not in blocks:
+            blocks[start] = self.data.getData(None, start, False, True)
+        rows, end = blocks[start]
+        if maxPoints:
+            rows = decimate.decimate(rows, maxPoints, method)
+        return (start, end, rows), end
+
+    def _pushed(self, message, context):
+        if message is not None and context in self.push_listeners:
+            self.hub.onDataPushed(message, [context])
 
     def getData(self, limit, start, transpose=False, simpleOnly=False):
         return self.data.getData(limit, start, transpose, simpleOnly)
 
+    def findRow(self, value, right=False):
+        return self.data.findRow(value, right)
+
     def keepStreaming(self, context, pos):
         # keepStreaming does something a bit odd and has a confusing name (ERJ)
         #
@@ -445,7 +748,13 @@ class Dataset(object):
         #
         # If a client reads, but not to the end of the dataset, it is immediately notified that
         # there is more data for it to read, and then removed from the set of notifiers.
-        if self.data.hasMore(pos):
+        #
+        # Only the check runs in the I/O lane; the listeners are updated back on the
+        # reactor thread.  Returns a Deferred that fires once they have been.
+        return self.run(self.data.hasMore, pos).addCallback(self._keepStreaming, context)
+
+    def _keepStreaming(self, more, context):
+        if more:
             if context in self.listeners:
                 self.listeners.remove(context)
             self.hub.onDataAvailable(None, [context])
@@ -453,18 +762,31 @@ class Dataset(object):
             self.listeners.add(context)
 
     def addComment(self, user, comment):
-        self.data.addComment(user, comment)
-        self.save()
+        """Add a comment; returns a Deferred that fires once it is written."""
+        def write():
+            self.data.addComment(user, comment)
+            return self.data.getComments(None, self.data.numComments() - 1)[0]
+        d = self.run(write)
+        d.addCallback(self._commentAdded)
+        d.addCallback(lambda _: self.save())
+        return d.addCallback(lambda _: None)
+
+    def _commentAdded(self, comments):
+        self._comments.extend(comments)
 
         # notify all listening contexts
         self.hub.onCommentsAvailable(None, self.comment_listeners)
         self.comment_listeners = set()
 
     def getComments(self, limit, start):
-        return self.data.getComments(limit, start)
+        if limit is None:
+            comments = self._comments[start:]
+        else:
+            comments = self._comments[start:start+limit]
+        return comments, start + len(comments)
 
     def keepStreamingComments(self, context, pos):
-        if pos < self.data.numComments():
+        if pos < len(self._comments):
             if context in self.comment_listeners:
                 self.comment_listeners.remove(context)
             self.hub.onCommentsAvailable(None, [context])
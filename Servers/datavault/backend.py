@@ -1,13 +1,17 @@
 import base64
 import collections
+import contextlib
 import datetime
 import os
 #import re
 import sys
+import threading
 import time
+import weakref
 
 import h5py
-from twisted.internet import reactor
+from twisted.internet import defer, reactor
+from twisted.python import log
 
 try:
     import numpy as np
@@ -31,7 +35,13 @@ PRECISION = 12 # digits of precision to use when saving data
 DATA_FORMAT = '%%.%dG' % PRECISION
 FILE_TIMEOUT_SEC = 60 # how long to keep datafiles open if not accessed
 DATA_TIMEOUT = 300 # how long to keep data in memory if not accessed
+CACHE_MAX_BYTES = 1 << 30 # in-memory data kept by all datasets together
+CACHE_MAX_HANDLES = 64 # datafiles kept open by all datasets together
+SAVE_DELAY_SEC = 5 # how long to coalesce metadata changes before writing them
+COMMENT_CHUNK = 64 # number of comments per chunk in the HDF5 comments dataset
+COMMENTS_DATASET_MINOR = 1 # HDF5 files from version x.1 keep comments in a dataset
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
+CONVERTING_SUFFIX = '.converting' # partly written by convert.py, not a dataset yet
 
 def time_to_str(t):
     return t.strftime(TIME_FORMAT)
@@ -48,52 +58,221 @@ def labrad_urlencode(data):
     else:
         data_bytes, t = T.flatten(data)
         all_bytes, _ = T.flatten((str(t), data_bytes), 'ss')
-    data_url = DATA_URL_PREFIX + base64.urlsafe_b64encode(all_bytes)
+    data_url = DATA_URL_PREFIX + base64.urlsafe_b64encode(all_bytes).decode('ascii')
     return data_url
 
 def labrad_urldecode(data_url):
     if data_url.startswith(DATA_URL_PREFIX):
         # decode parameter data from dataurl
         all_bytes = base64.urlsafe_b64decode(data_url[len(DATA_URL_PREFIX):])
-        t, data_bytes = T.unflatten(all_bytes, 'ss')
+        t, data_bytes = T.unflatten(all_bytes, 'sy')
         data = T.unflatten(data_bytes, t)
         return data
     else:
         raise ValueError("Trying to labrad_urldecode data that doesn't start "
                          "with prefix: {}".format(DATA_URL_PREFIX))
 
+class ResourceCache(object):
+    """Least-recently-used bookkeeping for open files and in-memory data.
+
+    Every dataset reports its open file handles and loaded data here each
+    time they are used.  When the total goes over either budget, the least
+    recently used entries are evicted: their evict function is scheduled
+    with the reactor (or I/O lane) the entry was registered with, so it
+    runs in the same thread as the rest of that dataset's I/O.  An entry
+    that is used again before its eviction runs is re-registered, and the
+    evict function is expected to check for that (see `in`).
+
+    Entries may be registered from any thread.
+    """
+
+    def __init__(self, maxBytes=CACHE_MAX_BYTES, maxHandles=CACHE_MAX_HANDLES):
+        self.maxBytes = maxBytes
+        self.maxHandles = maxHandles
+        self._entries = collections.OrderedDict() # key -> (nbytes, handles, evict, reactor)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.handles = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def use(self, key, evict, reactor, nbytes=0, handles=0, count=True):
+        """Mark key as just used, holding nbytes of memory and some handles.
+
+        Counts as a miss if key was not in the cache.  If it was, counts as
+        a hit only if count is true: owners pass false when they use the
+        entry again within one operation, which saves nothing.
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is None:
+                self.misses += 1
+            else:
+                if count:
+                    self.hits += 1
+                self.bytes -= old[0]
+                self.handles -= old[1]
+            self._entries[key] = (nbytes, handles, evict, reactor)
+            self.bytes += nbytes
+            self.handles += handles
+            victims = self._overflow(keep=key)
+        self._evict(victims)
+
+    def discard(self, key):
+        """Forget key, e.g. because its owner released it on its own."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[0]
+                self.handles -= old[1]
+
+    def configure(self, maxBytes=None, maxHandles=None):
+        """Change the budgets, evicting entries if they no longer fit."""
+        with self._lock:
+            if maxBytes is not None:
+                self.maxBytes = maxBytes
+            if maxHandles is not None:
+                self.maxHandles = maxHandles
+            victims = self._overflow()
+        self._evict(victims)
+
+    def stats(self):
+        with self._lock:
+            return collections.OrderedDict([
+                ('hits', self.hits),
+                ('misses', self.misses),
+                ('evictions', self.evictions),
+                ('entries', len(self._entries)),
+                ('bytes', self.bytes),
+                ('handles', self.handles),
+                ('max bytes', self.maxBytes),
+                ('max handles', self.maxHandles),
+            ])
+
+    def _overflow(self, keep=None):
+        """Remove least recently used entries until within budget.
+
+        Must be called with the lock held.  The entry for keep is never
+        removed, so a single oversized dataset can still be used.
+        """
+        victims = []
+        for key in list(self._entries):
+            if self.bytes <= self.maxBytes and self.handles <= self.maxHandles:
+                break
+            if key == keep:
+                continue
+            nbytes, handles, evict, reactor = self._entries.pop(key)
+            self.bytes -= nbytes
+            self.handles -= handles
+            self.evictions += 1
+            victims.append((evict, reactor))
+        return victims
+
+    def _evict(self, victims):
+        for evict, reactor in victims:
+            reactor.callLater(0, evict)
+
+resource_cache = ResourceCache()
+
 class SelfClosingFile(object):
     """A container for a file object that manages the underlying file handle.
 
     The file will be opened on demand when this container is called, then
-    closed automatically if not accessed within a specified timeout.
+    closed automatically if not accessed within a specified timeout, or
+    sooner if the resource cache needs the handle for another file.
     """
     def __init__(self, opener=open, open_args=(), open_kw={},
-                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor):
+                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor,
+                 cache=None):
         self.opener = opener
         self.open_args = open_args
         self.open_kw = open_kw
         self.timeout = timeout
         self.callbacks = []
         self.reactor = reactor
+        self.cache = cache if cache is not None else resource_cache
+        # the file may be used from an I/O lane and the reactor thread at once
+        self._lock = threading.RLock()
+        self._holds = 0 # nested held() blocks of the thread with the lock
+        self.accesses = 0 # uses from outside a held() block
         if touch:
             self.__call__()
 
     def __call__(self):
-        if not hasattr(self, '_file'):
-            self._file = self.opener(*self.open_args, **self.open_kw)
-            self._fileTimeoutCall = self.reactor.callLater(
-                    self.timeout, self._fileTimeout)
-        else:
-            self._fileTimeoutCall.reset(self.timeout)
-        return self._file
+        with self._lock:
+            fresh = not self._holds
+            if fresh:
+                self.accesses += 1
+            self._lastAccess = self.reactor.seconds()
+            if not hasattr(self, '_file'):
+                self._file = self.opener(*self.open_args, **self.open_kw)
+                self._fileTimeoutCall = self.reactor.callLater(
+                        self.timeout, self._fileTimeout)
+            else:
+                self._fileTimeoutCall.reset(self.timeout)
+            self.cache.use(self, self._evict, self.reactor, handles=1, count=fresh)
+            return self._file
+
+    def _evict(self):
+        with self._lock:
+            if self in self.cache:
+                return # used again since it was evicted
+            self.close()
 
     def _fileTimeout(self):
-        for callback in self.callbacks:
-            callback(self)
-        self._file.close()
-        del self._file
-        del self._fileTimeoutCall
+        with self._lock:
+            if not hasattr(self, '_file'):
+                return
+            idle = self.reactor.seconds() - self._lastAccess
+            if idle < self.timeout:
+                # touched after the timer fired but before we got to run
+                self._fileTimeoutCall = self.reactor.callLater(
+                        self.timeout - idle, self._fileTimeout)
+                return
+            self.cache.discard(self)
+            for callback in self.callbacks:
+                callback(self)
+            self._file.close()
+            del self._file
+            del self._fileTimeoutCall
+
+    def close(self):
+        """Close the file now, if it is open."""
+        with self._lock:
+            if not hasattr(self, '_file'):
+                return
+            if self._fileTimeoutCall.active():
+                self._fileTimeoutCall.cancel()
+            self.cache.discard(self)
+            for callback in self.callbacks:
+                callback(self)
+            self._file.close()
+            del self._file
+            del self._fileTimeoutCall
+
+    @contextlib.contextmanager
+    def held(self):
+        """Open the file and keep it open until the end of the with block.
+
+        Timeouts and evictions from other threads wait for the block to
+        finish instead of closing the file under it.
+        """
+        with self._lock:
+            f = self()
+            self._holds += 1
+            try:
+                yield f
+            finally:
+                self._holds -= 1
 
     def size(self):
         return os.fstat(self().fileno()).st_size
@@ -102,6 +281,41 @@ class SelfClosingFile(object):
         """Calls callback *before* the file is closes."""
         self.callbacks.append(callback)
 
+class DelayedSave(object):
+    """Coalesces repeated saves of some metadata into a single write.
+
+    mark() flags the metadata as changed and schedules a flush after a
+    delay, unless one is already pending.  flush() writes immediately if
+    anything has changed since the last write, and returns what save
+    returned (a Deferred if it writes in the background).
+    """
+    def __init__(self, save, delay=SAVE_DELAY_SEC, reactor=reactor):
+        # save is normally a method of the object that owns us, so keep
+        # only a weak reference to avoid a cycle that delays its cleanup
+        self._save = weakref.WeakMethod(save)
+        self.delay = delay
+        self.reactor = reactor
+        self.dirty = False
+        self._saveCall = None
+
+    def mark(self):
+        self.dirty = True
+        if self._saveCall is None or not self._saveCall.active():
+            # the pending call holds the owner alive until it has been saved
+            self._saveCall = self.reactor.callLater(self.delay, self._fire, self._save())
+
+    def _fire(self, save):
+        defer.maybeDeferred(self.flush).addErrback(log.err, 'Failed to save metadata')
+
+    def flush(self):
+        if self._saveCall is not None and self._saveCall.active():
+            self._saveCall.cancel()
+        self._saveCall = None
+        save = self._save()
+        if self.dirty and save is not None:
+            self.dirty = False
+            return save()
+
 class IniData(object):
     """Handles dataset metadata stored in INI files.
 
@@ -218,8 +432,7 @@ class IniData(object):
             time = time_to_str(time)
             S.set(sec, 'c{}'.format(i), repr((time, user, comment)))
 
-        with open(self.infofile, 'w') as f:
-            S.write(f)
+        util.write_config(S, self.infofile)
 
     def initialize_info(self, title, indep, dep):
         self.title = title
@@ -313,6 +526,10 @@ class CsvListData(IniData):
     def file(self):
         return self._file()
 
+    def hold(self):
+        """Keep the datafile open for a with block; see SelfClosingFile.held."""
+        return self._file.held()
+
     @property
     def version(self):
         return np.asarray([1,0,0], np.int32)
@@ -334,13 +551,34 @@ class CsvListData(IniData):
         lines = f.readlines()
         self._data.extend([float(n) for n in line.split(',')] for line in lines)
         self._datapos = f.tell()
+        # rough size: a list of lists of python floats
+        nbytes = 32 * len(self._data) * (len(self._data[0]) if self._data else 0)
+        self._file.cache.use(self, self._evict, self.reactor, nbytes=nbytes,
+                             count=self._newAccess())
         return self._data
 
+    def _newAccess(self):
+        """Whether the file has been accessed since the data was last used.
+
+        Uses of the data within one access of the file count as one.
+        """
+        accesses = self._file.accesses
+        new = accesses != getattr(self, '_accesses', None)
+        self._accesses = accesses
+        return new
+
     def _on_timeout(self):
+        self._file.cache.discard(self)
         del self._data
         del self._datapos
         del self._timeout_call
 
+    def _evict(self):
+        if self in self._file.cache or not hasattr(self, '_data'):
+            return # used again since it was evicted
+        self._timeout_call.cancel()
+        self._on_timeout()
+
     def _saveData(self, data):
         f = self.file
         for row in data:
@@ -366,6 +604,11 @@ class CsvListData(IniData):
             data = self.data[start:start+limit]
         return data, start + len(data)
 
+    def findRow(self, value, right=False):
+        """Find the first row whose first column is >= value (> if right)."""
+        data = self.data
+        return _bisect(lambda i: data[i][0], 0, len(data), value, right)
+
     def hasMore(self, pos):
         return pos < len(self.data)
 
@@ -414,17 +657,30 @@ class CsvNumpyData(CsvListData):
             self._timeout_call = self.reactor.callLater(DATA_TIMEOUT, self._on_timeout)
         else:
             self._timeout_call.reset(DATA_TIMEOUT)
+        self._cache_use()
         return self._data
 
     def _set_data(self, data):
         self._data = data
+        self._cache_use()
 
     data = property(_get_data, _set_data)
 
+    def _cache_use(self):
+        self._file.cache.use(self, self._evict, self.reactor, nbytes=self._data.nbytes,
+                             count=self._newAccess())
+
     def _on_timeout(self):
+        self._file.cache.discard(self)
         del self._data
         del self._timeout_call
 
+    def _evict(self):
+        if self in self._file.cache or not hasattr(self, '_data'):
+            return # used again since it was evicted
+        self._timeout_call.cancel()
+        self._on_timeout()
+
     def _saveData(self, data):
         f = self.file
         # always save with dos linebreaks (requires numpy 1.5.0 or greater)
@@ -459,6 +715,13 @@ class CsvNumpyData(CsvListData):
         nrows = len(data) if data.size > 0 else 0
         return data, start + nrows
 
+    def findRow(self, value, right=False):
+        """Find the first row whose first column is >= value (> if right)."""
+        data = self.data
+        if data.size == 0:
+            return 0
+        return int(np.searchsorted(data[:, 0], value, 'right' if right else 'left'))
+
     def hasMore(self, pos):
         # cheesy hack: if pos == 0, we only need to check whether
         # the filesize is nonzero
@@ -468,6 +731,27 @@ class CsvNumpyData(CsvListData):
             nrows = len(self.data) if self.data.size > 0 else 0
             return pos < nrows
 
+def _bisect(key, lo, hi, value, right=False):
+    """Binary search over rows [lo, hi) whose key(i) does not decrease.
+
+    Returns the first row with key >= value, or > value if right is set,
+    like bisect.bisect_left/bisect_right.
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        k = key(mid)
+        if k < value or (right and k == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _to_str(s):
+    """Variable-length strings read back from HDF5 may come out as bytes."""
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return str(s)
+
 class HDF5MetaData(object):
     """Class to store metadata inside the file itself.
 
@@ -487,6 +771,10 @@ class HDF5MetaData(object):
         """Load and save do nothing because HDF5 metadata is accessed live"""
         pass
 
+    def hold(self):
+        """Keep the datafile open for a with block; see SelfClosingFile.held."""
+        return self._file.held()
+
     def save(self):
         """Load and save do nothing because HDF5 metadata is accessed live"""
         pass
@@ -495,6 +783,10 @@ class HDF5MetaData(object):
     def dtype(self):
         return self.dataset.dtype
 
+    @property
+    def title(self):
+        return _to_str(self.dataset.attrs['Title'])
+
     def initialize_info(self, title, indep, dep):
         """Initializes the metadata for a newly created dataset."""
         t = time.time()
@@ -504,7 +796,10 @@ class HDF5MetaData(object):
         attrs['Access Time'] = t
         attrs['Modification Time'] = t
         attrs['Creation Time'] = t
-        attrs['Comments'] = np.ndarray((0,), dtype=self.comment_type)
+        if self._commentsInDataset():
+            self._create_comments()
+        else:
+            attrs['Comments'] = np.ndarray((0,), dtype=self.comment_type)
 
         for idx, i in enumerate(indep):
             prefix = 'Independent{}.'.format(idx)
@@ -601,6 +896,9 @@ class HDF5MetaData(object):
         keyname = 'Param.{}'.format(name)
         if keyname in self.dataset.attrs:
             raise errors.ParameterInUseError(name)
+        if self.dataset.file.swmr_mode:
+            # SWMR writers cannot create new attributes
+            raise errors.SWMRParameterError(name)
         value = labrad_urlencode(data)
         self.dataset.attrs[keyname] = value
 
@@ -625,25 +923,95 @@ class HDF5MetaData(object):
         names = [str(k[6:]) for k in self.dataset.attrs if k.startswith('Param.')]
         return names
 
-    def addComment(self, user, comment):
-        """Add a comment to the dataset."""
-        t = time.time()
-        new_comment = np.array([(t, user, comment)], dtype=self.comment_type)
-        old_comments = self.dataset.attrs['Comments']
-        data = np.hstack((old_comments, new_comment))
-        self.dataset.attrs.create('Comments', data, dtype=self.comment_type)
+    def _commentsInDataset(self):
+        """Whether this file keeps its comments in the 'Comments' dataset.
+
+        Files before version x.1 keep them in an attribute of the data,
+        and go on doing so, so that older readers can still see them.
+        """
+        return self.version[1] >= COMMENTS_DATASET_MINOR
+
+    def _create_comments(self):
+        """Create the resizable dataset that holds the comments.
+
+        Comments live next to the data in their own chunked dataset, so
+        adding one appends a row instead of rewriting every comment.
+        """
+        return self.dataset.parent.create_dataset(
+            'Comments', (0,), maxshape=(None,), chunks=(COMMENT_CHUNK,),
+            dtype=self.comment_type)
+
+    @property
+    def _comments(self):
+        """Comments dataset, or the legacy attribute in older files."""
+        if self._commentsInDataset():
+            return self.dataset.parent['Comments']
+        return self.dataset.attrs['Comments']
+
+    def addComment(self, user, comment, timestamp=None):
+        """Add a comment to the dataset.
+
+        timestamp defaults to now; it is given when copying old comments.
+        """
+        t = time.time() if timestamp is None else timestamp
+        new_comment = np.array((t, user, comment), dtype=self.comment_type)
+        if not self._commentsInDataset():
+            data = np.hstack((self.dataset.attrs['Comments'], new_comment))
+            self.dataset.attrs.create('Comments', data, dtype=self.comment_type)
+            return
+        comments = self.dataset.parent['Comments']
+        n = comments.shape[0]
+        comments.resize((n + 1,))
+        comments[n] = new_comment
 
     def getComments(self, limit, start):
         """Get comments in [(datetime, username, comment), ...] format."""
         if limit is None:
-            raw_comments = self.dataset.attrs['Comments'][start:]
+            raw_comments = self._comments[start:]
         else:
-            raw_comments = self.dataset.attrs['Comments'][start:start+limit]
-        comments = [(datetime.datetime.fromtimestamp(c[0]), str(c[1]), str(c[2])) for c in raw_comments]
+            raw_comments = self._comments[start:start+limit]
+        comments = [(datetime.datetime.fromtimestamp(c[0]), _to_str(c[1]), _to_str(c[2]))
+                    for c in raw_comments]
         return comments, start+len(comments)
 
     def numComments(self):
-        return len(self.dataset.attrs['Comments'])
+        return len(self._comments)
+
+    def close(self):
+        """Close the underlying file now rather than waiting for its timeout."""
+        self._file.close()
+
+    def startSWMR(self):
+        """Make rows written so far visible to SWMR readers.
+
+        The first call switches the file into SWMR mode, after which no new
+        attributes (parameters) can be created.  Files whose comments are in
+        an attribute stay out of SWMR mode, since adding a comment rewrites it.
+        """
+        if not self.swmr:
+            return
+        f = self.dataset.file
+        if not f.swmr_mode:
+            if not self._commentsInDataset():
+                self.swmr = False
+                return
+            try:
+                f.swmr_mode = True
+            except (ValueError, RuntimeError):
+                # file was written before SWMR support
+                self.swmr = False
+                return
+        f.flush()
+
+    def findRow(self, value, right=False):
+        """Find the first row whose first column is >= value (> if right).
+
+        Only the rows visited by the binary search are read from disk.
+        """
+        dataset = self.dataset
+        if dataset.dtype.fields[dataset.dtype.names[0]][0].shape != ():
+            raise RuntimeError("Row search needs a scalar first column")
+        return _bisect(lambda i: dataset[i][0], 0, dataset.shape[0], value, right)
 
 class ExtendedHDF5Data(HDF5MetaData):
     """Dataset backed by HDF5 file
@@ -652,10 +1020,11 @@ class ExtendedHDF5Data(HDF5MetaData):
     to have a different type and to be arrays themselves.
     """
 
-    def __init__(self, fh):
+    def __init__(self, fh, swmr=False):
         self._file = fh
+        self.swmr = swmr
         if 'Version' not in self.file.attrs:
-            self.file.attrs['Version'] = np.asarray([3, 0, 0], dtype=np.int32)
+            self.file.attrs['Version'] = np.asarray([3, COMMENTS_DATASET_MINOR, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], np.int32)
 
     def initialize_info(self, title, indep, dep):
@@ -704,6 +1073,7 @@ class ExtendedHDF5Data(HDF5MetaData):
         old_rows = self.dataset.shape[0]
         self.dataset.resize((old_rows + new_rows,))
         self.dataset[old_rows:(old_rows + new_rows)] = data
+        self.startSWMR()
 
     def getData(self, limit, start, transpose, simpleOnly):
         """Get up to limit rows from a dataset."""
@@ -716,6 +1086,9 @@ class ExtendedHDF5Data(HDF5MetaData):
             return self.getDataTranspose(limit, start)
 
         data, new_pos = self._getData(limit, start)
+        if simpleOnly:
+            # every column is a scalar float, so hand back a plain 2-D array
+            return util.to_float_array(data), new_pos
         row_data = [tuple(row) for row in data]
         return row_data, new_pos
 
@@ -763,10 +1136,11 @@ class SimpleHDF5Data(HDF5MetaData):
     a filesystem-like tree of datasets within one file.  Here, the single dataset
     is stored in /DataVault within the HDF5 file.
     """
-    def __init__(self, fh):
+    def __init__(self, fh, swmr=False):
         self._file = fh
+        self.swmr = swmr
         if 'Version' not in self.file.attrs:
-            self.file.attrs['Version'] = np.asarray([2, 0, 0], dtype=np.int32)
+            self.file.attrs['Version'] = np.asarray([2, COMMENTS_DATASET_MINOR, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], dtype=np.int32)
 
     def initialize_info(self, title, indep, dep):
@@ -797,6 +1171,7 @@ class SimpleHDF5Data(HDF5MetaData):
         #    field = "f%d" % (col,)
         #    new_data[field] = data[:,col]
         self.dataset[old_rows:(old_rows + new_rows)] = data
+        self.startSWMR()
 
     def getData(self, limit, start, transpose, simpleOnly):
         """Get up to limit rows from a dataset."""
@@ -806,10 +1181,7 @@ class SimpleHDF5Data(HDF5MetaData):
             struct_data = self.dataset[start:]
         else:
             struct_data = self.dataset[start:start+limit]
-        columns = []
-        for idx in range(len(struct_data.dtype)):
-            columns.append(struct_data['f{}'.format(idx)])
-        data = np.column_stack(columns)
+        data = util.to_float_array(struct_data)
         return data, start + data.shape[0]
 
     def __len__(self):
@@ -818,31 +1190,64 @@ class SimpleHDF5Data(HDF5MetaData):
     def hasMore(self, pos):
         return pos < len(self)
 
-def open_hdf5_file(filename):
+def _open_swmr_writer(filename):
+    """Open an HDF5 file for writing in a format that SWMR readers can share.
+
+    Files that already hold data go straight into SWMR mode; new files stay
+    out of it until their first rows are added (see HDF5MetaData.startSWMR),
+    so the metadata can be set up first.  Files written before SWMR support,
+    and files that keep their comments in an attribute, are opened normally.
+    """
+    f = h5py.File(filename, 'a', libver='latest')
+    if (not f.swmr_mode and 'DataVault' in f and f['DataVault'].shape[0] > 0
+            and f.attrs['Version'][1] >= COMMENTS_DATASET_MINOR):
+        try:
+            f.swmr_mode = True
+        except (ValueError, RuntimeError):
+            pass # superblock too old for SWMR
+    return f
+
+def _hdf5_handle(filename, swmr, reactor):
+    if swmr:
+        return SelfClosingFile(_open_swmr_writer, open_args=(filename,), reactor=reactor)
+    return SelfClosingFile(h5py.File, open_args=(filename, 'a'), reactor=reactor)
+
+def open_hdf5_file(filename, swmr=False, reactor=reactor):
     """Factory for HDF5 files.
 
     We check the version of the file to construct the proper class.  Currently, only two
-    options exist: version 2.0.0 -> legacy format, 3.0.0 -> extended format.
-    Version 1 is reserved for CSV files.
+    options exist: version 2.x.0 -> legacy format, 3.x.0 -> extended format.
+    Version 1 is reserved for CSV files.  Minor version 1 keeps the comments in a
+    dataset rather than an attribute.
     """
-    fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'))
+    fh = _hdf5_handle(filename, swmr, reactor)
     version = fh().attrs['Version']
     if version[0] == 2:
-        return SimpleHDF5Data(fh)
+        return SimpleHDF5Data(fh, swmr)
     else:
-        return ExtendedHDF5Data(fh)
+        return ExtendedHDF5Data(fh, swmr)
+
+def open_hdf5_reader(filename):
+    """Open a dataset file read-only while the data vault is still writing it.
+
+    For use by other processes, e.g. analysis scripts tailing a live
+    dataset.  The vault must have been started with SWMR enabled.  Call
+    refresh() on the 'DataVault' dataset to see rows added since the last
+    read.
+    """
+    return h5py.File(filename, 'r', libver='latest', swmr=True)
 
-def create_backend(filename, title, indep, dep, extended):
+def create_backend(filename, title, indep, dep, extended, swmr=False, reactor=reactor):
     hdf5_file = filename + '.hdf5'
-    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'))
+    fh = _hdf5_handle(hdf5_file, swmr, reactor)
     if extended:
-        data = ExtendedHDF5Data(fh)
+        data = ExtendedHDF5Data(fh, swmr)
     else:
-        data = SimpleHDF5Data(fh)
+        data = SimpleHDF5Data(fh, swmr)
     data.initialize_info(title, indep, dep)
     return data
 
-def open_backend(filename):
+def open_backend(filename, swmr=False, reactor=reactor):
     """Make a data object that manages in-memory and on-disk storage for a dataset.
 
     filename should be specified without a file extension. If there is an existing
@@ -854,10 +1259,10 @@ def open_backend(filename):
 
     if os.path.exists(csv_file):
         if use_numpy:
-            return CsvNumpyData(csv_file)
+            return CsvNumpyData(csv_file, reactor=reactor)
         else:
-            return CsvListData(csv_file)
+            return CsvListData(csv_file, reactor=reactor)
     elif os.path.exists(hdf5_file):
-        return open_hdf5_file(hdf5_file)
+        return open_hdf5_file(hdf5_file, swmr, reactor)
     else: # We should have already checked, this should not happen
         raise errors.DatasetNotFoundError(filename)
@@ -0,0 +1,92 @@
+"""Fixtures for the datavault storage benchmarks.
+
+The benchmarks need pytest-benchmark and are skipped without it:
+
+    pip install pytest-benchmark
+    python -m pytest datavault/benchmarks --benchmark-only
+
+Dataset sizes are taken from DATAVAULT_BENCH_ROWS, a comma-separated list
+of row counts (default 1e3,1e5).  The full range the vault is expected to
+handle is 1e3,1e4,1e5,1e6,1e7; the largest sizes take minutes to set up
+and a few GB of disk.  Compare runs with --benchmark-autosave and
+--benchmark-compare.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+from twisted.internet import task
+
+from datavault import backend, util
+
+BACKENDS = ['csv', 'hdf5']
+
+INDEPENDENTS = [
+    backend.Independent(label='time', shape=(1,), datatype='v', unit='s')]
+DEPENDENTS = [
+    backend.Dependent(label='rate', legend='FTM', shape=(1,), datatype='v', unit='A/s'),
+    backend.Dependent(label='thickness', legend='FTM', shape=(1,), datatype='v', unit='A')]
+COLUMNS = len(INDEPENDENTS) + len(DEPENDENTS)
+
+
+def row_counts():
+    spec = os.environ.get('DATAVAULT_BENCH_ROWS', '1e3,1e5')
+    return [int(float(n)) for n in spec.split(',') if n.strip()]
+
+
+def make_rows(count, start=0):
+    """Rows of (time, rate, thickness) like a deposition log."""
+    data = np.empty((count, COLUMNS))
+    data[:, 0] = np.arange(start, start + count) * 0.1
+    data[:, 1] = np.random.random(count)
+    data[:, 2] = np.cumsum(data[:, 1])
+    return data
+
+
+@pytest.fixture
+def clock():
+    """Keeps the backend's idle timers off the real reactor."""
+    return task.Clock()
+
+
+@pytest.fixture
+def datadir():
+    path = tempfile.mkdtemp(prefix='dvbench_')
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def new_backend(datadir, clock):
+    """Factory for empty datasets of either kind; closed after the test."""
+    created = []
+    def make(kind, name='bench'):
+        base = os.path.join(datadir, name)
+        if kind == 'csv':
+            data = backend.CsvNumpyData(base + '.csv', reactor=clock)
+            data.initialize_info('bench', INDEPENDENTS, DEPENDENTS)
+        else:
+            data = backend.create_backend(base, 'bench', INDEPENDENTS,
+                                          DEPENDENTS, extended=False,
+                                          reactor=clock)
+        created.append(data)
+        return data
+    yield make
+    for data in created:
+        data._file.close()
+
+
+@pytest.fixture
+def filled_backend(new_backend):
+    """Factory for datasets already holding some rows, written in blocks."""
+    def make(kind, count, block=100000):
+        data = new_backend(kind)
+        for start in range(0, count, block):
+            rows = make_rows(min(block, count - start), start)
+            data.addData(util.to_record_array(rows))
+        data.save()
+        return data
+    return make
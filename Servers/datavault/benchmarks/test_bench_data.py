@@ -0,0 +1,63 @@
+"""Benchmarks for writing and reading rows through the storage backends."""
+
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from conftest import BACKENDS, make_rows, row_counts
+from datavault import backend, util
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+@pytest.mark.parametrize('rows', [1, 100, 10000])
+def test_add(benchmark, new_backend, kind, rows):
+    data = new_backend(kind)
+    block = util.to_record_array(make_rows(rows))
+    benchmark(data.addData, block)
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+@pytest.mark.parametrize('count', row_counts())
+def test_get_all(benchmark, filled_backend, kind, count):
+    data = filled_backend(kind, count)
+    rows, _ = benchmark(data.getData, None, 0, False, True)
+    assert len(rows) == count
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+@pytest.mark.parametrize('count', row_counts())
+def test_get_all_cold(benchmark, filled_backend, datadir, clock, kind, count):
+    """Open the dataset from disk and read everything, as a new client does."""
+    filled_backend(kind, count)
+    base = os.path.join(datadir, 'bench')
+    def read():
+        data = backend.open_backend(base, reactor=clock)
+        try:
+            return data.getData(None, 0, False, True)
+        finally:
+            data._file.close()
+    rows, _ = benchmark(read)
+    assert len(rows) == count
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+@pytest.mark.parametrize('count', row_counts())
+def test_get_partial(benchmark, filled_backend, kind, count):
+    """Read 1000 rows from the middle, as an incremental plot update does."""
+    data = filled_backend(kind, count)
+    rows, _ = benchmark(data.getData, 1000, count // 2, False, True)
+    assert len(rows) == min(1000, count - count // 2)
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+@pytest.mark.parametrize('count', row_counts())
+def test_get_range(benchmark, filled_backend, kind, count):
+    """Find and read the last tenth of the rows by time."""
+    data = filled_backend(kind, count)
+    t0 = count * 0.09
+    def read():
+        start = data.findRow(t0)
+        return data.getData(None, start, False, True)
+    benchmark(read)
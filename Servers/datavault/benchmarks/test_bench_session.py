@@ -0,0 +1,85 @@
+"""Benchmarks for dataset creation, directory listing and metadata writes."""
+
+import itertools
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from conftest import BACKENDS
+from datavault import Session
+
+DIRECTORY_ENTRIES = 10000
+
+# variables as the 'new' setting takes them
+INDEPENDENTS = [('time', 's')]
+DEPENDENTS = [('rate', 'FTM', 'A/s'), ('thickness', 'FTM', 'A')]
+
+
+class _Hub(object):
+    """Swallows the signals a session sends."""
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+@pytest.fixture
+def session(datadir, clock):
+    return Session(datadir, [''], _Hub(), None, reactor=clock)
+
+
+def _fill_directory(datadir, entries):
+    """Add empty dataset files and subdirectories, like a long-used vault."""
+    for i in range(1, entries + 1):
+        if i % 100 == 0:
+            os.mkdir(os.path.join(datadir, 'tip{}.dir'.format(i)))
+        else:
+            open(os.path.join(datadir, '%05d - bench.hdf5' % i), 'w').close()
+
+
+def test_new_dataset(benchmark, session):
+    def new_dataset():
+        dataset = session.newDataset('bench', INDEPENDENTS, DEPENDENTS)
+        dataset.data._file.close()
+    benchmark(new_dataset)
+
+
+def test_open_dataset(benchmark, session):
+    """Open by number, bypassing the session's cache of open datasets."""
+    num = int(session.newDataset('bench', INDEPENDENTS, DEPENDENTS).name[:5])
+    session.datasets.clear()
+    def open_dataset():
+        dataset = session.openDataset(num)
+        session.datasets.clear()
+        dataset.data._file.close()
+    benchmark(open_dataset)
+
+
+def test_list_contents(benchmark, datadir, session):
+    _fill_directory(datadir, DIRECTORY_ENTRIES)
+    dirs, datasets = benchmark(session.listContents, [])
+    assert len(dirs) + len(datasets) == DIRECTORY_ENTRIES
+
+
+def test_list_contents_after_change(benchmark, datadir, session):
+    """List after every new dataset, so the directory is rescanned each time."""
+    _fill_directory(datadir, DIRECTORY_ENTRIES)
+    names = ('%05d - extra.hdf5' % i for i in itertools.count(DIRECTORY_ENTRIES + 1))
+    def add_and_list():
+        open(os.path.join(datadir, next(names)), 'w').close()
+        return session.listContents([])
+    benchmark(add_and_list)
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_add_comment(benchmark, new_backend, kind):
+    data = new_backend(kind)
+    benchmark(data.addComment, 'bench', 'deposition started')
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_add_parameter(benchmark, new_backend, kind):
+    data = new_backend(kind)
+    names = ('param{}'.format(i) for i in itertools.count())
+    benchmark(lambda: data.addParam(next(names), 1.5))
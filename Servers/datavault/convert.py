@@ -0,0 +1,182 @@
+"""Convert legacy CSV datasets in a data vault to HDF5.
+
+Usage:
+    python -m datavault.convert VAULT_DIR [--jobs N] [--backup DIR] [--dry-run]
+
+Walks the vault and turns every .csv/.ini dataset into a SimpleHDF5Data
+file with the same name, so it keeps its number, its session tags and its
+place in the listing.  Title, variables, parameters, comments and the
+created/accessed/modified times are carried over.  Datasets are converted
+in a process pool.
+
+Each dataset is written to a temporary file, read back and checked against
+the CSV (row count and SHA-1 of the values, parameter values and comment
+text) before it is renamed into place.
+The original .csv and .ini are then moved into the backup directory, under
+the same relative path.  Running the tool again picks up where it left off.
+
+Stop the Data Vault before converting a vault it is serving.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from . import backend, util
+
+TMP_SUFFIX = backend.CONVERTING_SUFFIX
+
+
+def find_csv_datasets(vault, skip=()):
+    """Yield the base path (without extension) of every CSV dataset."""
+    skip = [os.path.abspath(d) for d in skip]
+    for dirpath, dirnames, filenames in os.walk(vault):
+        dirnames[:] = [d for d in dirnames
+                       if os.path.abspath(os.path.join(dirpath, d)) not in skip]
+        for name in sorted(filenames):
+            if name.endswith('.csv'):
+                base = os.path.join(dirpath, name[:-4])
+                if os.path.exists(base + '.ini'):
+                    yield base
+
+
+def _checksum(data):
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    return data.shape[0], hashlib.sha1(data.tobytes()).hexdigest()
+
+
+def _load_csv(base):
+    info = backend.IniData()
+    info.infofile = base + '.ini'
+    info.load()
+    if os.path.getsize(base + '.csv') > 0:
+        data = np.loadtxt(base + '.csv', delimiter=',', ndmin=2)
+    else:
+        data = np.zeros((0, info.cols))
+    return info, data
+
+
+def _write_hdf5(base, info, data):
+    """Write info and data to base + '.hdf5'."""
+    hdf5 = backend.create_backend(base, info.title, info.independents,
+                                  info.dependents, extended=False)
+    try:
+        for p in info.parameters:
+            hdf5.addParam(p['label'], p['data'])
+        for t, user, comment in info.comments:
+            hdf5.addComment(user, comment, timestamp=t.timestamp())
+        if len(data):
+            hdf5.addData(util.to_record_array(data))
+        attrs = hdf5.dataset.attrs
+        attrs['Creation Time'] = info.created.timestamp()
+        attrs['Modification Time'] = info.modified.timestamp()
+        attrs['Access Time'] = info.accessed.timestamp()
+    finally:
+        hdf5.close()
+
+
+def _verify(filename, info, expected):
+    """Check that an HDF5 file holds the same data and metadata as the CSV."""
+    hdf5 = backend.open_hdf5_file(filename)
+    try:
+        data, _ = hdf5.getData(None, 0, False, True)
+        if _checksum(data) != expected:
+            return 'data mismatch'
+        if sorted(hdf5.getParamNames()) != sorted(p['label'] for p in info.parameters):
+            return 'parameter mismatch'
+        for p in info.parameters:
+            # compare encoded, which works for arrays and values with units
+            if (backend.labrad_urlencode(hdf5.getParameter(p['label'])) !=
+                    backend.labrad_urlencode(p['data'])):
+                return 'parameter mismatch: ' + p['label']
+        comments, _ = hdf5.getComments(None, 0)
+        if [c[1:] for c in comments] != [tuple(c[1:]) for c in info.comments]:
+            return 'comment mismatch'
+    finally:
+        hdf5.close()
+    return None
+
+
+def convert_dataset(base, vault, backup):
+    """Convert one CSV dataset.  Returns (base, status, message)."""
+    try:
+        info, data = _load_csv(base)
+        expected = _checksum(data)
+        target = base + '.hdf5'
+        if not os.path.exists(target):
+            tmp = base + TMP_SUFFIX
+            if os.path.exists(tmp + '.hdf5'):
+                os.remove(tmp + '.hdf5') # left over from an interrupted run
+            _write_hdf5(tmp, info, data)
+            error = _verify(tmp + '.hdf5', info, expected)
+            if error:
+                os.remove(tmp + '.hdf5')
+                return base, 'failed', error
+            os.replace(tmp + '.hdf5', target)
+        else:
+            # renamed by an earlier run that stopped before moving the CSV
+            error = _verify(target, info, expected)
+            if error:
+                return base, 'failed', 'existing HDF5 file does not match: ' + error
+        st = os.stat(base + '.csv')
+        os.utime(target, (st.st_atime, st.st_mtime))
+
+        dest = os.path.join(backup, os.path.relpath(os.path.dirname(base), vault))
+        if not os.path.exists(dest):
+            os.makedirs(dest)
+        for ext in ('.csv', '.ini'):
+            shutil.move(base + ext, os.path.join(dest, os.path.basename(base) + ext))
+        return base, 'converted', '{} rows'.format(expected[0])
+    except Exception as e:
+        return base, 'failed', '{}: {}'.format(type(e).__name__, e)
+
+
+def convert_vault(vault, backup, jobs=None, report=print):
+    """Convert all CSV datasets in a vault.  Returns the number of failures."""
+    datasets = list(find_csv_datasets(vault, skip=[backup]))
+    report('{} CSV datasets to convert'.format(len(datasets)))
+    if jobs == 1:
+        results = (convert_dataset(base, vault, backup) for base in datasets)
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        futures = [pool.submit(convert_dataset, base, vault, backup) for base in datasets]
+        results = (f.result() for f in concurrent.futures.as_completed(futures))
+    failures = 0
+    for base, status, message in results:
+        if status == 'failed':
+            failures += 1
+        report('{}: {} ({})'.format(os.path.relpath(base, vault), status, message))
+    if jobs != 1:
+        pool.shutdown()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert CSV datasets in a data vault to HDF5.')
+    parser.add_argument('vault', help='data vault root directory')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--backup', default=None,
+                        help='where to move the original CSV files '
+                             '(default: VAULT_csv_backup next to the vault)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only list the datasets that would be converted')
+    args = parser.parse_args(argv)
+
+    vault = os.path.abspath(args.vault)
+    backup = os.path.abspath(args.backup or vault.rstrip(os.sep) + '_csv_backup')
+    if args.dry_run:
+        for base in find_csv_datasets(vault, skip=[backup]):
+            print(os.path.relpath(base, vault))
+        return 0
+    return 1 if convert_vault(vault, backup, args.jobs) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
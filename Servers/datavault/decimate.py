@@ -0,0 +1,88 @@
+"""Reduce a block of data to a bounded number of rows for plotting.
+
+All functions take a 2-D float array whose first column is the independent
+variable (usually time) and return a 2-D array with the same columns and
+at most the requested number of rows.  Inputs that already fit are
+returned unchanged.
+"""
+
+import numpy as np
+
+
+def stride(data, points):
+    """Keep evenly spaced rows, always including the first and last."""
+    n = len(data)
+    if n <= points:
+        return data
+    if points < 2:
+        return data[:points]
+    idx = np.unique(np.linspace(0, n - 1, points).round().astype(np.intp))
+    return data[idx]
+
+
+def minmax(data, points):
+    """Bucketed min/max envelope.
+
+    The rows are split into points // 2 buckets and each bucket becomes two
+    rows: one at the bucket's first x value holding the minimum of every
+    dependent column, and one at its last x value holding the maximum.
+    Spikes are kept no matter how much the data is reduced.
+    """
+    n = len(data)
+    buckets = points // 2
+    if n <= points or buckets < 1:
+        return stride(data, points)
+    starts = np.linspace(0, n, buckets + 1).astype(np.intp)[:-1]
+    ends = np.append(starts[1:], n) - 1
+    out = np.empty((2 * buckets, data.shape[1]), dtype=data.dtype)
+    out[0::2, 0] = data[starts, 0]
+    out[1::2, 0] = data[ends, 0]
+    out[0::2, 1:] = np.minimum.reduceat(data[:, 1:], starts, axis=0)
+    out[1::2, 1:] = np.maximum.reduceat(data[:, 1:], starts, axis=0)
+    return out
+
+
+def lttb(data, points, column=1):
+    """Largest-triangle-three-buckets downsampling.
+
+    Picks one row per bucket: the one forming the largest triangle with the
+    row chosen in the previous bucket and the mean of the next bucket, using
+    the given column as y.  The choice in each bucket depends on the one
+    before, so the buckets are visited in order, but the work inside each
+    bucket is vectorized.
+    """
+    n = len(data)
+    if n <= points or points < 3 or data.shape[1] <= column:
+        return stride(data, points)
+    x = data[:, 0]
+    y = data[:, column]
+    # first and last rows are always kept; the rest is split into buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    idx = np.empty(points, dtype=np.intp)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return data[idx]
+
+
+METHODS = {
+    'stride': stride,
+    'minmax': minmax,
+    'lttb': lttb,
+}
+
+
+def decimate(data, points, method='stride'):
+    """Decimate data with the named method (one of METHODS)."""
+    return METHODS[method](np.asarray(data, dtype=np.float64), points)
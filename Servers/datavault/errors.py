@@ -46,3 +46,19 @@ class DataVersionMismatchError(T.Error):
     code = 11
     def __init__(self):
         self.msg = "Dataset was created with newer API, cannot be read.  Use get_ex"
+
+class BadDecimationError(T.Error):
+    code = 12
+    def __init__(self, method):
+        self.msg = "Unknown decimation method '{0}'.".format(method)
+
+class SWMRParameterError(T.Error):
+    code = 13
+    def __init__(self, name):
+        self.msg = ("Cannot add parameter '{0}': the dataset is open for SWMR "
+                    "readers, so parameters must be added before data.".format(name))
+
+class BadQueryError(T.Error):
+    code = 14
+    def __init__(self, reason):
+        self.msg = "Bad index query: {0}.".format(reason)
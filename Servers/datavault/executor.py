@@ -0,0 +1,117 @@
+"""Run blocking dataset I/O in worker threads.
+
+Each dataset gets its own Lane.  Work submitted to a lane runs in a worker
+thread, one call at a time and in the order it was submitted, so reads and
+writes on one dataset never overlap while different datasets proceed in
+parallel.  Meanwhile the reactor thread stays free to serve other clients.
+
+A lane also stands in for the reactor that the backend objects use to
+schedule their idle timeouts and cache evictions (see SelfClosingFile,
+CsvNumpyData and ResourceCache): those calls may be made from worker
+threads, and the cleanup runs in the lane so it cannot close a file under
+a running read or write.
+"""
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import log, threadpool
+
+
+IO_THREADS = 4 # worker threads shared by all lanes
+
+
+class IOExecutor(object):
+    """A pool of worker threads shared by the lanes it hands out."""
+
+    def __init__(self, maxThreads=IO_THREADS, reactor=reactor):
+        self.reactor = reactor
+        self.pool = threadpool.ThreadPool(0, maxThreads, 'datavault-io')
+        self.pool.start()
+        self._shutdownTrigger = reactor.addSystemEventTrigger(
+                'during', 'shutdown', self._shutdown)
+
+    def _shutdown(self):
+        self._shutdownTrigger = None
+        self.pool.stop()
+
+    def stop(self):
+        """Stop the worker threads once the work already queued is done."""
+        if self._shutdownTrigger is not None:
+            self.reactor.removeSystemEventTrigger(self._shutdownTrigger)
+            self._shutdown()
+
+    def lane(self):
+        """Make a new lane for one dataset."""
+        return Lane(self)
+
+
+class Lane(object):
+    """Runs functions in worker threads, one at a time and in call order.
+
+    run() must be called from the reactor thread.
+    """
+
+    def __init__(self, executor):
+        self.reactor = executor.reactor
+        self.pool = executor.pool
+        self._lock = defer.DeferredLock()
+
+    def run(self, func, *args, **kw):
+        """Queue func(*args, **kw) and return a Deferred with its result."""
+        return self._lock.run(threads.deferToThreadPool,
+                              self.reactor, self.pool, func, *args, **kw)
+
+    def seconds(self):
+        return self.reactor.seconds()
+
+    def callLater(self, delay, func, *args, **kw):
+        """Like reactor.callLater, but usable from any thread.
+
+        When the delay expires, func is queued on this lane like any
+        other work.
+        """
+        return LaneCall(self, delay, func, args, kw)
+
+
+class LaneCall(object):
+    """Delayed call returned by Lane.callLater.
+
+    It can be reset or cancelled from any thread.  The underlying timer
+    lives on the reactor, so those requests take effect on its next
+    iteration.
+    """
+
+    def __init__(self, lane, delay, func, args, kw):
+        self.lane = lane
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self._call = None
+        self._done = False
+        lane.reactor.callFromThread(self._start, delay)
+
+    def _start(self, delay):
+        if not self._done:
+            self._call = self.lane.reactor.callLater(delay, self._fire)
+
+    def _fire(self):
+        self._done = True
+        d = self.lane.run(self.func, *self.args, **self.kw)
+        d.addErrback(log.err)
+
+    def active(self):
+        return not self._done
+
+    def reset(self, delay):
+        self.lane.reactor.callFromThread(self._reset, delay)
+
+    def _reset(self, delay):
+        if self._call is not None and self._call.active():
+            self._call.reset(delay)
+
+    def cancel(self):
+        self._done = True
+        self.lane.reactor.callFromThread(self._cancel)
+
+    def _cancel(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
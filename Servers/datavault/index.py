@@ -0,0 +1,324 @@
+"""Vault-wide search index of datasets, their parameters and tags.
+
+The index is an SQLite database in the root of the vault.  The server
+keeps it up to date as datasets are created, parameters are added and tags
+change, so a query can find matching datasets across every session
+without opening any files.  The files stay the authority: if the index is
+lost or out of date, rebuild it from the vault:
+
+    python -m datavault.index VAULT_DIR
+
+Queries are lists of (field, op, value) conditions that must all hold.
+field is 'name', 'title', 'session' (the path joined with '/'), 'tag', or
+'param:' followed by a parameter name.  op is one of =, !=, <, <=, >, >=
+or 'match' (a glob pattern with * and ?).  Tags support = and != only.
+Numeric parameter values compare as numbers; values with units compare
+in base units, so 0.08 um matches a parameter saved as 80 nm.  Over
+LabRAD the values are sent as strings and read with parse_value.
+"""
+
+import argparse
+import functools
+import json
+import numbers
+import os
+import sqlite3
+import sys
+import threading
+
+from labrad import units as U
+from twisted.internet import task
+from twisted.python import log
+
+from . import backend, errors, filename_decode, util
+from .tags import read_tags
+
+INDEX_FILE = 'vault_index.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,     -- session path as a JSON list
+    session TEXT NOT NULL,  -- session path joined with '/'
+    name TEXT NOT NULL,
+    title TEXT,
+    UNIQUE (path, name)
+);
+CREATE TABLE IF NOT EXISTS params (
+    dataset INTEGER NOT NULL REFERENCES datasets(id),
+    name TEXT NOT NULL,
+    value TEXT,             -- str() of the value
+    num REAL,               -- number in the value's own unit
+    si REAL,                -- number in base units
+    si_unit TEXT,
+    PRIMARY KEY (dataset, name)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    path TEXT NOT NULL,
+    entry TEXT NOT NULL,    -- dataset name, or subdirectory name
+    kind TEXT NOT NULL,     -- 'dataset' or 'dir'
+    tag TEXT NOT NULL,
+    PRIMARY KEY (path, kind, entry, tag)
+);
+CREATE INDEX IF NOT EXISTS params_num ON params (name, num);
+CREATE INDEX IF NOT EXISTS params_si ON params (name, si);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag, kind);
+"""
+
+_OPS = {'=': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+        'match': 'GLOB'}
+_COLUMNS = {'name': 'd.name', 'title': 'd.title', 'session': 'd.session'}
+
+QUERY_LIMIT = 10000 # most results a query will return
+
+
+def _path_key(path):
+    return json.dumps(list(path))
+
+
+def _session_name(path):
+    return '/'.join(path) or '/'
+
+
+def _numbers(data):
+    """(num, si, si_unit) for a parameter value, or Nones if not numeric."""
+    if isinstance(data, bool):
+        return None, None, None
+    if isinstance(data, numbers.Real):
+        return float(data), float(data), ''
+    if isinstance(data, U.Value):
+        base = data.inBaseUnits()
+        return float(data._value), float(base._value), str(base.unit)
+    return None, None, None
+
+
+def parse_value(text):
+    """A query value from its string form: '3', '80 nm' or 'Pb'.
+
+    Numbers, with an optional unit after a space, are parsed as numbers
+    or Values; anything else is kept as a string.
+    """
+    number, _, unit = text.strip().partition(' ')
+    try:
+        num = float(number)
+    except ValueError:
+        return text
+    unit = unit.strip()
+    if not unit:
+        return num
+    try:
+        return U.Value(num, unit)
+    except Exception:
+        return text
+
+
+def _update(method):
+    """Index updates must not fail the operation that triggered them.
+
+    The change is already on disk, so a failed update is logged and the
+    index is marked stale until it is rebuilt.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kw):
+        try:
+            return method(self, *args, **kw)
+        except sqlite3.Error:
+            self.stale = True
+            log.err(None, 'Failed to update the vault index')
+    return wrapper
+
+
+class VaultIndex(object):
+    """Index of every dataset in a vault.
+
+    Updates may come from the reactor thread or from dataset I/O lanes, so
+    the connection is shared and guarded by a lock.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.created = not os.path.exists(filename)
+        self.stale = False
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _dataset_id(self, path, name, title=None):
+        key = _path_key(path)
+        self._db.execute(
+            'INSERT OR IGNORE INTO datasets (path, session, name, title) '
+            'VALUES (?, ?, ?, ?)', (key, _session_name(path), name, title))
+        if title is not None:
+            self._db.execute(
+                'UPDATE datasets SET title = ? WHERE path = ? AND name = ?',
+                (title, key, name))
+        row = self._db.execute(
+            'SELECT id FROM datasets WHERE path = ? AND name = ?',
+            (key, name)).fetchone()
+        return row[0]
+
+    @_update
+    def addDataset(self, path, name, title):
+        with self._lock, self._db:
+            self._dataset_id(path, name, title)
+
+    @_update
+    def addParameters(self, path, name, params, title=None):
+        """Record (name, value) parameters of a dataset, replacing old values."""
+        with self._lock, self._db:
+            ds = self._dataset_id(path, name, title)
+            self._db.executemany(
+                'INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?, ?, ?)',
+                [(ds, p, str(data)) + _numbers(data) for p, data in params])
+
+    @_update
+    def setTags(self, path, sessions, datasets):
+        """Replace the tags of some entries in a session.
+
+        sessions and datasets are lists of (entry, tags), as in the
+        'signal: tags updated' message.
+        """
+        key = _path_key(path)
+        with self._lock, self._db:
+            for kind, updates in (('dir', sessions), ('dataset', datasets)):
+                for entry, tags in updates:
+                    self._db.execute(
+                        'DELETE FROM tags WHERE path = ? AND kind = ? AND entry = ?',
+                        (key, kind, entry))
+                    self._db.executemany(
+                        'INSERT INTO tags VALUES (?, ?, ?, ?)',
+                        [(key, entry, kind, tag) for tag in tags])
+
+    def count(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM datasets').fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._db:
+            for table in ('params', 'tags', 'datasets'):
+                self._db.execute('DELETE FROM ' + table)
+
+    def query(self, conditions, limit=QUERY_LIMIT):
+        """Find datasets matching all conditions.
+
+        Returns a list of (session path, dataset name), ordered by path.
+        """
+        where = []
+        args = []
+        for field, op, value in conditions:
+            if op not in _OPS:
+                raise errors.BadQueryError("unknown operator '{}'".format(op))
+            sql_op = _OPS[op]
+            if field in _COLUMNS:
+                where.append('{} {} ?'.format(_COLUMNS[field], sql_op))
+                args.append(str(value))
+            elif field == 'tag':
+                if op not in ('=', '!='):
+                    raise errors.BadQueryError("tags only support = and !=")
+                where.append(
+                    '{} EXISTS (SELECT 1 FROM tags t WHERE t.path = d.path AND '
+                    "t.kind = 'dataset' AND t.entry = d.name AND t.tag = ?)"
+                    .format('' if op == '=' else 'NOT'))
+                args.append(str(value))
+            elif field.startswith('param:'):
+                num, si, si_unit = _numbers(value)
+                if num is None or op == 'match':
+                    test, test_args = 'p.value {} ?'.format(sql_op), [str(value)]
+                elif isinstance(value, U.Value):
+                    test = 'p.si {} ? AND p.si_unit = ?'.format(sql_op)
+                    test_args = [si, si_unit]
+                else:
+                    test, test_args = 'p.num {} ?'.format(sql_op), [num]
+                where.append(
+                    'EXISTS (SELECT 1 FROM params p WHERE p.dataset = d.id AND '
+                    'p.name = ? AND {})'.format(test))
+                args.extend([field[len('param:'):]] + test_args)
+            else:
+                raise errors.BadQueryError("unknown field '{}'".format(field))
+        sql = 'SELECT d.path, d.name FROM datasets d'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY d.session, d.name LIMIT ?'
+        with self._lock:
+            rows = self._db.execute(sql, args + [limit]).fetchall()
+        return [(json.loads(path), name) for path, name in rows]
+
+    def rebuild(self, datadir, report=None):
+        """Re-index every session and dataset under datadir from the files.
+
+        Datasets that cannot be read are skipped and passed to report.
+        """
+        self.clear()
+        for path, dirpath, filenames in _walk_sessions(datadir):
+            if 'session.ini' in filenames:
+                sessions, datasets = _read_session_tags(os.path.join(dirpath, 'session.ini'))
+                self.setTags(path, sorted(sessions.items()), sorted(datasets.items()))
+            for base in _dataset_files(dirpath, filenames):
+                name = filename_decode(os.path.basename(base))
+                try:
+                    title, params = _read_dataset(base)
+                except Exception as e:
+                    if report is not None:
+                        report('{}: {}'.format(base, e))
+                    continue
+                self.addParameters(path, name, params, title=title)
+        self.created = self.stale = False
+
+
+def _walk_sessions(datadir):
+    """Yield (session path, directory, filenames) for every session."""
+    for dirpath, dirnames, filenames in os.walk(datadir):
+        dirnames[:] = sorted(d for d in dirnames if d.endswith('.dir'))
+        rel = os.path.relpath(dirpath, datadir)
+        parts = [] if rel == '.' else rel.split(os.sep)
+        path = [''] + [filename_decode(p[:-len('.dir')]) for p in parts]
+        yield path, dirpath, filenames
+
+
+def _dataset_files(dirpath, filenames):
+    for f in sorted(filenames):
+        base, ext = os.path.splitext(f)
+        if base.endswith(backend.CONVERTING_SUFFIX):
+            continue
+        if ext == '.hdf5' or (ext == '.csv' and base + '.ini' in filenames):
+            yield os.path.join(dirpath, base)
+
+
+def _read_session_tags(infofile):
+    S = util.DVSafeConfigParser()
+    S.read(infofile)
+    return read_tags(os.path.dirname(infofile), S)
+
+
+def _read_dataset(base):
+    # a private clock keeps the file's idle timer off the reactor, which
+    # may be running in another thread
+    data = backend.open_backend(base, reactor=task.Clock())
+    try:
+        data.load()
+        params = [(p, data.getParameter(p)) for p in data.getParamNames()]
+        return data.title, params
+    finally:
+        data._file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Rebuild the search index of a data vault.')
+    parser.add_argument('vault', help='data vault root directory')
+    args = parser.parse_args(argv)
+    index = VaultIndex(os.path.join(args.vault, INDEX_FILE))
+    index.rebuild(args.vault, report=print)
+    print('indexed {} datasets'.format(index.count()))
+    index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,12 +2,12 @@
 
 import collections
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue
 import twisted.internet.task
 import numpy as np
 from labrad.server import LabradServer, Signal, setting
 
-from . import errors
+from . import backend, decimate, errors, index
 
 
 class DataVault(LabradServer):
@@ -25,6 +25,7 @@ class DataVault(LabradServer):
 
         # dataset signals
         self.onDataAvailable = Signal(543619, 'signal: data available', '')
+        self.onDataPushed = Signal(543623, 'signal: data pushed', '(ww*2v)')
         self.onNewParameter = Signal(543620, 'signal: new parameter', '')
         self.onCommentsAvailable = Signal(543621, 'signal: comments available', '')
 
@@ -32,6 +33,10 @@ class DataVault(LabradServer):
         # create root session
         _root = self.session_store.get([''])
 
+    def stopServer(self):
+        # write out metadata changes that are still waiting to be saved
+        return self.session_store.flush()
+
     def contextKey(self, c):
         """The key used to identify a given context for notifications"""
         return c.ID
@@ -55,6 +60,7 @@ class DataVault(LabradServer):
                 removeFromList(dataset.listeners)
                 removeFromList(dataset.param_listeners)
                 removeFromList(dataset.comment_listeners)
+                dataset.stopPushing(key)
 
     def getSession(self, c):
         """Get a session object for the current path."""
@@ -66,6 +72,11 @@ class DataVault(LabradServer):
             raise errors.NoDatasetError()
         return c['datasetObj']
 
+    def leaveDataset(self, c):
+        """Stop pushing data from the current dataset, before opening another."""
+        if 'datasetObj' in c:
+            c['datasetObj'].stopPushing(self.contextKey(c))
+
     @setting(5, returns=['*s'])
     def dump_existing_sessions(self, c):
         return ['/'.join(session.path)
@@ -161,6 +172,7 @@ class DataVault(LabradServer):
         Returns the path and name for this dataset.
         """
         session = self.getSession(c)
+        self.leaveDataset(c)
         dataset = session.newDataset(name or 'untitled', independents, dependents)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
@@ -201,6 +213,7 @@ class DataVault(LabradServer):
         The legacy format requires each column be a scalar v[unit] type.
         """
         session = self.getSession(c)
+        self.leaveDataset(c)
         dataset = session.newDataset(name, independents, dependents, extended=True)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
@@ -218,15 +231,16 @@ class DataVault(LabradServer):
         """
         session = self.getSession(c)
         dataset = session.openDataset(name)
+        self.leaveDataset(c)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0
         c['commentpos'] = 0
         c['writing'] = append
         key = self.contextKey(c)
-        dataset.keepStreaming(key, 0)
+        yield dataset.keepStreaming(key, 0)
         dataset.keepStreamingComments(key, 0)
-        return c['path'], c['dataset']
+        returnValue((c['path'], c['dataset']))
 
     @setting(1010, returns='s')
     def get_version(self, c):
@@ -255,8 +269,8 @@ class DataVault(LabradServer):
         data = np.atleast_2d(np.asarray(data))
         # fromarrays is faster than fromrecords, and when we have a simple 2-D array
         # we can just transpose the array.
-        rec_data = np.core.records.fromarrays(data.T, dtype=dataset.data.dtype)
-        dataset.addData(rec_data)
+        rec_data = np.core.records.fromarrays(data.T, dtype=dataset.dtype)
+        yield dataset.run(dataset.addData, rec_data)
 
     @setting(1020, data='?', returns='')
     def add_ex(self, c, data):
@@ -273,7 +287,8 @@ class DataVault(LabradServer):
         if not c['writing']:
             raise errors.ReadOnlyError()
         list_data = [tuple(row) for row in data]
-        dataset.addData(np.core.records.fromrecords(list_data, dtype=dataset.data.dtype))
+        rec_data = np.core.records.fromrecords(list_data, dtype=dataset.dtype)
+        yield dataset.run(dataset.addData, rec_data)
 
     @setting(2020, data='?', returns='')
     def add_ex_t(self, c, data):
@@ -286,7 +301,8 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         if not c['writing']:
             raise errors.ReadOnlyError()
-        dataset.addData(np.core.records.fromarrays(data, dtype=dataset.data.dtype))
+        rec_data = np.core.records.fromarrays(data, dtype=dataset.dtype)
+        yield dataset.run(dataset.addData, rec_data)
 
     @setting(21, limit='w', startOver='b', returns='*2v')
     def get(self, c, limit=None, startOver=False):
@@ -299,11 +315,77 @@ class DataVault(LabradServer):
         in this context is returned.
         """
         dataset = self.getDataset(c)
-        c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], simpleOnly=True)
+        def read(start):
+            return dataset.getData(limit, 0 if startOver else start, simpleOnly=True)
+        data = yield dataset.readAt(c, read)
         key = self.contextKey(c)
-        dataset.keepStreaming(key, c['filepos'])
-        return data
+        yield dataset.keepStreaming(key, c['filepos'])
+        returnValue(data)
+
+    @setting(22, points='w', method='s', start='w', stop='w', returns='*2v')
+    def get_decimated(self, c, points, method='stride', start=0, stop=None):
+        """Get a decimated view of rows [start, stop) of the current dataset.
+
+        At most points rows are returned, so plots of long datasets only
+        transfer what they can show.  Method is 'stride' (evenly spaced
+        rows), 'minmax' (min and max of each bucket, which keeps spikes)
+        or 'lttb' (largest-triangle-three-buckets on the first dependent).
+        The read position used by get is not changed.
+        """
+        if method not in decimate.METHODS:
+            raise errors.BadDecimationError(method)
+        dataset = self.getDataset(c)
+        limit = None if stop is None else max(stop - start, 0)
+        def read():
+            data, _ = dataset.getData(limit, start, simpleOnly=True)
+            return decimate.decimate(data, points, method)
+        data = yield dataset.run(read)
+        returnValue(data)
+
+    @setting(23, t0='v', t1='v', returns='*2v')
+    def get_range(self, c, t0, t1):
+        """Get the rows whose first independent lies in [t0, t1].
+
+        The first independent must be non-decreasing, as for time traces.
+        Rows are located by binary search, so only the requested window is
+        read.  The read position used by get is not changed.
+        """
+        dataset = self.getDataset(c)
+        def read():
+            start = dataset.findRow(t0)
+            stop = dataset.findRow(t1, right=True)
+            data, _ = dataset.getData(max(stop - start, 0), start, simpleOnly=True)
+            return data
+        data = yield dataset.run(read)
+        returnValue(data)
+
+    @setting(24, enable='b', maxPoints='w', method='s', returns='')
+    def stream_data(self, c, enable=True, maxPoints=0, method='stride'):
+        """Push new rows of the current dataset to this context as they arrive.
+
+        Once enabled, every 'add' to the dataset sends this context a
+        'signal: data pushed' message with (start, end, rows): the rows
+        from the read position up to the end of the dataset.  The read
+        position used by get moves to end, so no get calls are needed.
+        If maxPoints is nonzero, each batch is decimated to at most that
+        many rows using method (see get_decimated); start and end still
+        count the rows in the dataset.  Rows not yet read are sent as soon
+        as streaming is enabled.  Like get, this only works for datasets
+        whose columns are all scalar floats.  Streaming stops when the
+        context opens another dataset.  Listen to the signal before
+        enabling this.
+        """
+        if method not in decimate.METHODS:
+            raise errors.BadDecimationError(method)
+        dataset = self.getDataset(c)
+        key = self.contextKey(c)
+        if enable:
+            if not dataset.isSimple():
+                # pushed rows are sent as *2v, like get
+                raise errors.DataVersionMismatchError()
+            yield dataset.startPushing(key, c, maxPoints, method)
+        else:
+            dataset.stopPushing(key)
 
     @setting(1021, limit='w', startOver='b', returns='?')
     def get_ex(self, c, limit=None, startOver=False):
@@ -315,11 +397,12 @@ class DataVault(LabradServer):
         performance.
         """
         dataset = self.getDataset(c)
-        c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=False)
+        def read(start):
+            return dataset.getData(limit, 0 if startOver else start, transpose=False)
+        data = yield dataset.readAt(c, read)
         ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        yield dataset.keepStreaming(ctx, c['filepos'])
+        returnValue(data)
 
     @setting(2021, limit='w', startOver='b', returns='?')
     def get_ex_t(self, c, limit=None, startOver=False):
@@ -333,11 +416,12 @@ class DataVault(LabradServer):
         code.
         """
         dataset = self.getDataset(c)
-        c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=True)
+        def read(start):
+            return dataset.getData(limit, 0 if startOver else start, transpose=True)
+        data = yield dataset.readAt(c, read)
         ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        yield dataset.keepStreaming(ctx, c['filepos'])
+        returnValue(data)
 
     @setting(100, returns='(*(ss){independents}, *(sss){dependents})')
     def variables(self, c):
@@ -398,13 +482,13 @@ class DataVault(LabradServer):
     def add_parameter(self, c, name, data):
         """Add a new parameter to the current dataset."""
         dataset = self.getDataset(c)
-        dataset.addParameter(name, data)
+        yield dataset.addParameter(name, data)
 
     @setting(124, 'add parameters', params='?{((s?)(s?)...)}', returns='')
     def add_parameters(self, c, params):
         """Add a new parameter to the current dataset."""
         dataset = self.getDataset(c)
-        dataset.addParameters(params)
+        yield dataset.addParameters(params)
 
 
     @setting(126, 'get name', returns='s')
@@ -489,6 +573,37 @@ class DataVault(LabradServer):
             datasets = [datasets]
         return sess.getTags(dirs, datasets)
 
+    @setting(350, 'cache stats', returns='*(sv)')
+    def cache_stats(self, c):
+        """Get statistics for the cache of open datafiles and loaded data.
+
+        Returns (name, value) pairs: hits, misses and evictions since the
+        server started, the number of entries, the bytes and file handles
+        they currently hold, and the budgets for both.
+        """
+        return [(k, float(v)) for k, v in backend.resource_cache.stats().items()]
+
+    @setting(360, 'query', conditions='*(sss)', limit='w', returns='*(*ss)')
+    def query(self, c, conditions, limit=None):
+        """Find datasets anywhere in the vault by name, title, tag or parameter.
+
+        conditions is a list of (field, op, value) that must all hold, e.g.
+        [('param:material', '=', 'Pb'), ('param:diameter', '<', '80 nm'),
+        ('tag', '!=', 'trash')].  Values are strings: numbers, with an
+        optional unit after a space, compare as numbers.  Fields are
+        'name', 'title', 'session', 'tag' and 'param:<name>'; ops are =,
+        !=, <, <=, >, >= and 'match' (glob pattern).  Returns (session path, dataset name) for each
+        match, which can be passed to 'cd' and 'open'.
+        """
+        vault_index = self.session_store.vault_index
+        if vault_index is None:
+            raise errors.BadQueryError('this data vault has no index')
+        conditions = [(field, op, index.parse_value(value))
+                      for field, op, value in conditions]
+        if limit is None:
+            return vault_index.query(conditions)
+        return vault_index.query(conditions, limit)
+
 
 class DataVaultMultiHead(DataVault):
     """Data Vault server with additional settings for running multi-headed.
@@ -0,0 +1,154 @@
+"""Per-session tag storage.
+
+Tags for the subdirectories and datasets of a session are kept in an
+append-only journal next to session.ini.  Each line is a JSON list
+[kind, entry, tags], where kind is 's' for a subdirectory or 'd' for a
+dataset, and tags is the entry's complete set of tags after a change.
+Loading replays the lines in order, so the last line for an entry wins,
+and a tag update only appends a line per changed entry.  Once the
+journal holds many more lines than entries it is compacted: rewritten
+with one line per tagged entry and renamed into place.
+
+Older versions stored the tags as the repr of two dicts of sets in the
+[Tags] section of session.ini.  Those are read with a restricted parser
+(never eval) and moved into a new journal the first time a session loads.
+"""
+
+import ast
+import json
+import os
+
+JOURNAL_FILE = 'tags.jsonl'
+COMPACT_MIN_LINES = 1000 # never compact journals shorter than this
+COMPACT_RATIO = 2 # compact once there are this many lines per tagged entry
+
+_KINDS = {'s': 0, 'd': 1}
+
+
+def _line(kind, entry, tags):
+    # entries are names, but anything else is written as its string
+    return json.dumps([kind, entry, sorted(tags)], default=str) + '\n'
+
+
+class TagJournal(object):
+    """Tags of one session directory, backed by a journal file.
+
+    sessions and datasets map entry names to sets of tags.  Change the
+    sets in place, then pass the changed entries to record().
+    """
+
+    def __init__(self, dirname):
+        self.filename = os.path.join(dirname, JOURNAL_FILE)
+        self.sessions = {}
+        self.datasets = {}
+        self._lines = 0
+        self._limit = COMPACT_MIN_LINES
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def load(self):
+        """Replay the journal.
+
+        A torn last line from a crash mid-append is ignored.
+        """
+        tags = (self.sessions, self.datasets)
+        self._lines = 0
+        with open(self.filename, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    kind, entry, entry_tags = json.loads(line)
+                    tags[_KINDS[kind]][entry] = set(entry_tags)
+                except (ValueError, KeyError, TypeError):
+                    continue
+                self._lines += 1
+        self._setLimit()
+
+    def _setLimit(self):
+        # counting entries on every update would cost O(entries), so the
+        # compaction threshold is only worked out after a load or compaction
+        entries = sum(1 for d in (self.sessions, self.datasets)
+                      for tags in d.values() if tags)
+        self._limit = max(COMPACT_MIN_LINES, COMPACT_RATIO * entries)
+
+    def record(self, sessions, datasets):
+        """Append updates, given as lists of (entry, tags) like updateTags makes."""
+        lines = [_line(kind, entry, tags)
+                 for kind, updates in (('s', sessions), ('d', datasets))
+                 for entry, tags in updates]
+        if not lines:
+            return
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+        self._lines += len(lines)
+        if self._lines > self._limit:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal with one line per tagged entry."""
+        tmpfile = self.filename + '.tmp'
+        lines = 0
+        with open(tmpfile, 'w', encoding='utf-8') as f:
+            for kind, tags in (('s', self.sessions), ('d', self.datasets)):
+                for entry in sorted(tags, key=str):
+                    if tags[entry]:
+                        f.write(_line(kind, entry, tags[entry]))
+                        lines += 1
+        os.replace(tmpfile, self.filename)
+        self._lines = lines
+        self._setLimit()
+
+    def migrate(self, config):
+        """Take tags from the [Tags] section of an old session.ini parser."""
+        if config.has_section('Tags'):
+            self.sessions.update(parse_legacy_tags(config.get('Tags', 'sessions', raw=True)))
+            self.datasets.update(parse_legacy_tags(config.get('Tags', 'datasets', raw=True)))
+            self.compact()
+
+
+def parse_legacy_tags(text):
+    """Parse the repr of a dict of sets of strings, as old sessions saved tags.
+
+    Only dict, set, list and tuple displays of string literals, and set()
+    calls, are accepted; anything else raises ValueError.
+    """
+    def strings(node):
+        if isinstance(node, (ast.Set, ast.List, ast.Tuple)):
+            items = node.elts
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in ('set', 'frozenset') and not node.keywords
+                and len(node.args) <= 1):
+            if not node.args:
+                return set()
+            return strings(node.args[0])
+        else:
+            raise ValueError('unexpected tag set: {}'.format(ast.dump(node)))
+        return {string(item) for item in items}
+
+    def string(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+        raise ValueError('unexpected tag: {}'.format(ast.dump(node)))
+
+    try:
+        tree = ast.parse(text.strip(), mode='eval').body
+    except SyntaxError as e:
+        raise ValueError('bad tags: {}'.format(e))
+    if not isinstance(tree, ast.Dict):
+        raise ValueError('tags must be a dict')
+    return {string(k): strings(v) for k, v in zip(tree.keys, tree.values)}
+
+
+def read_tags(dirname, config):
+    """Get (session tags, dataset tags) of a directory without changing it.
+
+    config is a parser holding its session.ini, for directories whose tags
+    have not been moved to a journal yet.
+    """
+    journal = TagJournal(dirname)
+    if journal.exists():
+        journal.load()
+    elif config.has_section('Tags'):
+        journal.sessions = parse_legacy_tags(config.get('Tags', 'sessions', raw=True))
+        journal.datasets = parse_legacy_tags(config.get('Tags', 'datasets', raw=True))
+    return journal.sessions, journal.datasets
@@ -7,14 +7,16 @@ import random
 import string
 import time
 import tempfile
+import threading
 import unittest
+import weakref
 
 from labrad import types as T
 from labrad import units as U
 
 from twisted.internet import task
 
-from datavault import backend, errors
+from datavault import backend, errors, util
 
 
 def _unique_filename(suffix='.hdf5'):
@@ -132,6 +134,143 @@ class SelfClosingFileTest(_TestCase):
         self.assertTrue(self.close_callback_called,
                     msg='Registered callback not called!')
 
+    def test_late_timeout_keeps_recently_used_file(self):
+        # With an I/O lane the timeout can run after a late touch.
+        self.clock.advance(self.close_timeout_sec / 2.0)
+        self.file()
+        # the timer already fired, but the timeout only gets to run now
+        self.file._fileTimeoutCall.cancel()
+        self.file._fileTimeout()
+        self.assertTrue(self.opener.file.is_open)
+        self.clock.advance(self.close_timeout_sec)
+        self.assertFalse(self.opener.file.is_open)
+
+
+    def test_held_file_is_not_closed_under_its_user(self):
+        closer = threading.Thread(target=self.file.close)
+        with self.file.held() as f:
+            closer.start()
+            closer.join(0.05)
+            # the close waits for the block to finish
+            self.assertTrue(closer.is_alive())
+            self.assertTrue(f.is_open)
+        closer.join()
+        self.assertFalse(self.opener.file.is_open)
+
+    def test_reuse_within_a_hold_is_not_a_hit(self):
+        cache = backend.ResourceCache()
+        f = backend.SelfClosingFile(opener=self.opener, reactor=self.clock,
+                                    cache=cache)
+        with f.held():
+            f()
+            f()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        f()
+        self.assertEqual(cache.hits, 2)
+
+class _Evictee(object):
+    def __init__(self):
+        self.evicted = 0
+
+    def evict(self):
+        self.evicted += 1
+
+
+class ResourceCacheTest(_TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = backend.ResourceCache(maxBytes=100, maxHandles=2)
+
+    def use(self, key, **kw):
+        self.cache.use(key, key.evict, self.clock, **kw)
+
+    def test_hits_and_misses(self):
+        a = _Evictee()
+        self.use(a, handles=1)
+        self.use(a, handles=1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['handles'], 1)
+        self.use(a, handles=1, count=False)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_evicts_least_recently_used_handle(self):
+        a, b, c = _Evictee(), _Evictee(), _Evictee()
+        self.use(a, handles=1)
+        self.use(b, handles=1)
+        self.use(a, handles=1)
+        self.use(c, handles=1)
+        self.assertNotIn(b, self.cache)
+        self.assertEqual(self.cache.handles, 2)
+        # evictions run on the entry's reactor, not inline
+        self.assertEqual(b.evicted, 0)
+        self.clock.advance(0)
+        self.assertEqual((a.evicted, b.evicted, c.evicted), (0, 1, 0))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_evicts_by_bytes(self):
+        a, b = _Evictee(), _Evictee()
+        self.use(a, nbytes=60)
+        self.use(b, nbytes=60)
+        self.clock.advance(0)
+        self.assertEqual(a.evicted, 1)
+        self.assertEqual(self.cache.bytes, 60)
+
+    def test_keeps_oversized_entry(self):
+        a = _Evictee()
+        self.use(a, nbytes=1000)
+        self.clock.advance(0)
+        self.assertEqual(a.evicted, 0)
+        self.assertIn(a, self.cache)
+
+    def test_size_update_does_not_double_count(self):
+        a = _Evictee()
+        self.use(a, nbytes=10)
+        self.use(a, nbytes=30)
+        self.assertEqual(self.cache.bytes, 30)
+        self.cache.discard(a)
+        self.assertEqual(self.cache.bytes, 0)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_configure_shrinks(self):
+        a, b = _Evictee(), _Evictee()
+        self.use(a, handles=1)
+        self.use(b, handles=1)
+        self.cache.configure(maxHandles=1)
+        self.clock.advance(0)
+        self.assertEqual((a.evicted, b.evicted), (1, 0))
+
+    def test_evicted_files_are_closed(self):
+        openers = [_MockFileOpener() for _ in range(3)]
+        files = [backend.SelfClosingFile(opener=o, reactor=self.clock, cache=self.cache)
+                 for o in openers]
+        self.clock.advance(0)
+        self.assertFalse(openers[0].file.is_open)
+        self.assertTrue(openers[1].file.is_open)
+        self.assertTrue(openers[2].file.is_open)
+        # reopened on demand, evicting the next least recently used file
+        files[0]()
+        self.clock.advance(0)
+        self.assertTrue(openers[0].file.is_open)
+        self.assertFalse(openers[1].file.is_open)
+
+    def test_eviction_skips_file_used_again(self):
+        opener = _MockFileOpener()
+        f = backend.SelfClosingFile(opener=opener, reactor=self.clock, cache=self.cache)
+        self.use(_Evictee(), handles=1)
+        self.use(_Evictee(), handles=1)
+        # touched again before the scheduled eviction gets to run
+        f()
+        self.clock.advance(0)
+        self.assertTrue(opener.file.is_open)
+
+    def test_timeout_releases_handle(self):
+        f = backend.SelfClosingFile(opener=_MockFileOpener(), timeout=1,
+                                    reactor=self.clock, cache=self.cache)
+        self.assertEqual(self.cache.handles, 1)
+        self.clock.advance(1)
+        self.assertEqual(self.cache.handles, 0)
+
 
 # Dependent and Independent variables used for testing IniData and HDF5MetaData.
 _INDEPENDENTS = [
@@ -155,6 +294,49 @@ _DEPENDENTS = [
                 unit='Dollars')]
 
 
+class _Saver(object):
+    def __init__(self):
+        self.saves = 0
+
+    def save(self):
+        self.saves += 1
+
+
+class DelayedSaveTest(_TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.saver = _Saver()
+        self.delayed = backend.DelayedSave(
+                self.saver.save, delay=5, reactor=self.clock)
+
+    def test_marks_are_coalesced(self):
+        for _ in range(10):
+            self.delayed.mark()
+        self.assertEqual(self.saver.saves, 0)
+        self.clock.advance(5)
+        self.assertEqual(self.saver.saves, 1)
+        self.assertFalse(self.delayed.dirty)
+
+    def test_flush_writes_immediately(self):
+        self.delayed.mark()
+        self.delayed.flush()
+        self.assertEqual(self.saver.saves, 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        # nothing changed, so a second flush should not write again
+        self.delayed.flush()
+        self.assertEqual(self.saver.saves, 1)
+
+    def test_pending_save_keeps_owner_alive(self):
+        saver = _Saver()
+        delayed = backend.DelayedSave(saver.save, delay=5, reactor=self.clock)
+        delayed.mark()
+        ref = weakref.ref(saver)
+        del saver
+        self.assertIsNotNone(ref())
+        self.clock.advance(5)
+        self.assertIsNone(ref())
+        self.assertFalse(delayed.dirty)
+
 
 class _MetadataTest(_TestCase):
     def run(self, result):
@@ -401,25 +583,44 @@ c1=('2012-09-25, 03:14:15','fizz','buzz')
                 data.getTransposeType(), '(*v[Ghz],*v[Kelvin],*v[Dollars])')
 
 
-class _MockAttrs(dict):
-    """Mock Attributes class for use in the _MockDataset."""
-    def create(self, name, data, dtype):
-        self[name] = np.asarray(data, dtype=dtype)
-
-
-class _MockDataset(object):
-    """Mock Dataset class to use in the HDF5MetaDataTest."""
-    def __init__(self):
-        self.attrs = _MockAttrs()
-
-
 class HDF5MetaDataTest(_MetadataTest):
 
     def get_data(self):
+        # in-memory file that is never written to disk
+        self.h5file = h5py.File(_unique_filename(), 'w', driver='core',
+                                backing_store=False)
+        self.addCleanup(self.h5file.close)
         data = backend.HDF5MetaData()
-        data.dataset = _MockDataset()
+        data.version = np.asarray([2, backend.COMMENTS_DATASET_MINOR, 0], np.int32)
+        data.dataset = self.h5file.create_dataset(
+                'DataVault', (0,), dtype=np.float64, maxshape=(None,))
         return data
 
+    def test_comments_are_appended_to_dataset(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        for i in range(100):
+            data.addComment('user', str(i))
+        self.assertNotIn('Comments', data.dataset.attrs)
+        self.assertEqual(self.h5file['Comments'].shape, (100,))
+        comments, next_pos = data.getComments(2, 98)
+        self.assertEqual([c[2] for c in comments], ['98', '99'])
+        self.assertEqual(next_pos, 100)
+
+    def test_legacy_comments_stay_in_attribute(self):
+        data = self.get_data()
+        data.version = np.asarray([2, 0, 0], np.int32)
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        self.assertNotIn('Comments', self.h5file)
+        data.addComment('old user', 'old comment')
+        data.addComment('new user', 'new comment')
+        self.assertNotIn('Comments', self.h5file)
+        self.assertEqual(data.numComments(), 2)
+        comments, _ = data.getComments(None, 0)
+        self.assertEqual([c[1:] for c in comments],
+                         [('old user', 'old comment'),
+                          ('new user', 'new comment')])
+
 
 class _BackendDataTestCase(_TestCase):
     def assert_data_in_backend(self, backend_data, expected_data):
@@ -522,6 +723,19 @@ class _BackendDataTest(_BackendDataTestCase):
         self.data.addData(data1)
         self.assert_data_in_backend(self.data, [[1, 2, 3], [4, 5, 6]])
 
+    def test_find_row(self):
+        rows = np.recarray(
+            (5, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i, t in enumerate([0., 1., 1., 2., 5.]):
+            rows[i] = (t, i, 0)
+        self.data.addData(rows)
+        self.assertEqual(self.data.findRow(-1), 0)
+        self.assertEqual(self.data.findRow(1), 1)
+        self.assertEqual(self.data.findRow(1, right=True), 3)
+        self.assertEqual(self.data.findRow(3), 4)
+        self.assertEqual(self.data.findRow(6), 5)
+
     def test_add_recarray_data_then_read(self):
         data = np.recarray(
             (2, ),
@@ -587,6 +801,18 @@ class CsvNumpyDataTest(_BackendDataTest):
         self.files_to_remove.append(filename)
         return backend.CsvNumpyData(filename, reactor=self.clock)
 
+    def test_data_evicted_from_cache(self):
+        cache = backend.ResourceCache()
+        self.data._file.cache = cache
+        self.data.addData(util.to_record_array(np.array([[1., 2., 3.]])))
+        self.assertEqual(cache.bytes, self.data.data.nbytes)
+        cache.configure(maxBytes=0, maxHandles=0)
+        self.clock.advance(0)
+        self.assertFalse(hasattr(self.data, '_data'))
+        self.assertEqual(len(cache), 0)
+        # reloaded from disk on demand
+        self.assert_arrays_equal(self.data.data, [[1., 2., 3.]])
+
     def test_empty_data_read(self):
         read_data = self.data.data
         self.assertEqual(read_data.dtype, np.dtype(float))
@@ -635,6 +861,20 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         self.assertEqual(len(actual), 3)
         self.assert_arrays_equal(actual, [[1, 4], [2, 5], [3, 6]])
 
+    def test_get_data_simple_only(self):
+        data_to_add = np.recarray(
+            (2, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add[0] = (1, 2, 3)
+        data_to_add[1] = (4, 5, 6)
+        self.data.addData(data_to_add)
+
+        actual, next_pos = self.data.getData(None, 0, False, True)
+        self.assertEqual(next_pos, 2)
+        self.assertTrue(isinstance(actual, np.ndarray))
+        self.assertEqual(actual.dtype, np.float64)
+        self.assert_arrays_equal(actual, [[1, 2, 3], [4, 5, 6]])
+
     def test_initialize_info_bad_vars(self):
         bad_independents = [
                         backend.Independent(
@@ -811,5 +1051,69 @@ class SimpleHDF5DataTest(_BackendDataTest):
         self.assertEqual(read_data.dtype, np.dtype(float))
         self.assertEqual(read_data.size, 0)
 
+class SWMRTest(_TestCase):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix='')
+        self.data = backend.create_backend(
+                self.filename, 'FooTitle', _INDEPENDENTS, _DEPENDENTS,
+                extended=False, swmr=True)
+        self.addCleanup(_remove_file_if_exists, self.filename + '.hdf5')
+        self.addCleanup(self.data.file.close)
+
+    def test_reader_sees_new_rows(self):
+        self.data.addData(util.to_record_array(np.array([[1., 2., 3.]])))
+        reader = backend.open_hdf5_reader(self.filename + '.hdf5')
+        self.addCleanup(reader.close)
+        self.assertEqual(reader['DataVault'].shape, (1,))
+
+        self.data.addData(util.to_record_array(
+                np.array([[4., 5., 6.], [7., 8., 9.]])))
+        self.data.addComment('user', 'mid-run note')
+        reader['DataVault'].refresh()
+        reader['Comments'].refresh()
+        self.assertEqual(reader['DataVault'].shape, (3,))
+        self.assertEqual(reader['DataVault'][2][0], 7.)
+        self.assertEqual(reader['Comments'].shape, (1,))
+
+    def test_file_without_swmr_support(self):
+        # written with the default libver, so its superblock is too old
+        filename = _unique_filename(suffix='')
+        self.addCleanup(_remove_file_if_exists, filename + '.hdf5')
+        with h5py.File(filename + '.hdf5', 'w') as f:
+            f.attrs['Version'] = np.asarray([2, backend.COMMENTS_DATASET_MINOR, 0], np.int32)
+        data = backend.SimpleHDF5Data(backend.SelfClosingFile(
+                h5py.File, open_args=(filename + '.hdf5', 'a')))
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addData(util.to_record_array(np.array([[1., 2., 3.]])))
+        data.close()
+
+        data = backend.open_hdf5_file(filename + '.hdf5', swmr=True)
+        self.addCleanup(data.close)
+        self.assertFalse(data.file.swmr_mode)
+        data.addData(util.to_record_array(np.array([[4., 5., 6.]])))
+        data.addComment('user', 'note')
+        data.addParam('Param1', 1.5)
+        self.assertFalse(data.swmr)
+        self.assertEqual(len(data), 2)
+
+    def test_legacy_comments_stay_out_of_swmr(self):
+        self.data.file.attrs['Version'] = np.asarray([2, 0, 0], np.int32)
+        self.data.version = np.asarray([2, 0, 0], np.int32)
+        del self.data.file['Comments']
+        self.data.dataset.attrs['Comments'] = np.zeros(
+                (0,), dtype=backend.HDF5MetaData.comment_type)
+        self.data.addData(util.to_record_array(np.array([[1., 2., 3.]])))
+        self.data.addComment('user', 'note')
+        self.assertFalse(self.data.file.swmr_mode)
+        self.assertEqual(self.data.numComments(), 1)
+
+    def test_no_new_parameters_after_data(self):
+        self.data.addData(util.to_record_array(np.array([[1., 2., 3.]])))
+        self.assertRaises(
+                errors.SWMRParameterError,
+                self.data.addParam, 'Param1', 1.5)
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
@@ -0,0 +1,116 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import task
+
+from datavault import backend, convert, util
+
+
+_INDEPENDENTS = [backend.Independent(
+        label='Time', shape=(1,), datatype='v', unit='s')]
+_DEPENDENTS = [backend.Dependent(
+        label='Pressure', legend='Chamber', shape=(1,), datatype='v', unit='mbar')]
+
+
+class ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix='dvtest_')
+        self.addCleanup(shutil.rmtree, root)
+        self.vault = os.path.join(root, 'vault')
+        self.backup = os.path.join(root, 'backup')
+        self.dir = os.path.join(self.vault, 'run.dir')
+        os.makedirs(self.dir)
+        self.base = os.path.join(self.dir, '00001 - Deposition')
+        self.rows = np.column_stack((np.arange(50.), np.linspace(1e-3, 2e-7, 50)))
+
+        csv = backend.CsvNumpyData(self.base + '.csv', reactor=task.Clock())
+        csv.initialize_info('Deposition', _INDEPENDENTS, _DEPENDENTS)
+        csv.addParam('Tip', 'T-17')
+        csv.addComment('operator', 'shutter open')
+        csv.save()
+        csv.addData(util.to_record_array(self.rows))
+        csv.file.close()
+
+    def convert(self, jobs=1):
+        messages = []
+        failures = convert.convert_vault(self.vault, self.backup, jobs=jobs,
+                                         report=messages.append)
+        return failures, messages
+
+    def assertConverted(self):
+        self.assertFalse(os.path.exists(self.base + '.csv'))
+        self.assertFalse(os.path.exists(self.base + '.ini'))
+        backup = os.path.join(self.backup, 'run.dir', '00001 - Deposition')
+        self.assertTrue(os.path.exists(backup + '.csv'))
+        self.assertTrue(os.path.exists(backup + '.ini'))
+
+        data = backend.open_backend(self.base)
+        self.assertIsInstance(data, backend.SimpleHDF5Data)
+        try:
+            read, _ = data.getData(None, 0, False, True)
+            self.assertTrue(np.allclose(self.rows, read))
+            self.assertEqual('Deposition', data.dataset.attrs['Title'])
+            self.assertEqual(_INDEPENDENTS, data.getIndependents())
+            self.assertEqual(_DEPENDENTS, data.getDependents())
+            self.assertEqual('T-17', data.getParameter('Tip'))
+            comments, _ = data.getComments(None, 0)
+            self.assertEqual([('operator', 'shutter open')],
+                             [c[1:] for c in comments])
+        finally:
+            data.close()
+
+    def test_convert(self):
+        failures, _ = self.convert()
+        self.assertEqual(0, failures)
+        self.assertConverted()
+
+    def test_convert_in_process_pool(self):
+        failures, _ = self.convert(jobs=2)
+        self.assertEqual(0, failures)
+        self.assertConverted()
+
+    def test_rerun_after_interrupted_move(self):
+        self.convert()
+        # put the originals back as if the run stopped before moving them
+        backup = os.path.join(self.backup, 'run.dir', '00001 - Deposition')
+        for ext in ('.csv', '.ini'):
+            shutil.move(backup + ext, self.base + ext)
+        failures, _ = self.convert()
+        self.assertEqual(0, failures)
+        self.assertConverted()
+
+    def test_rerun_removes_partial_file(self):
+        with open(self.base + convert.TMP_SUFFIX + '.hdf5', 'w') as f:
+            f.write('partial')
+        failures, _ = self.convert()
+        self.assertEqual(0, failures)
+        self.assertFalse(os.path.exists(self.base + convert.TMP_SUFFIX + '.hdf5'))
+        self.assertConverted()
+
+    def test_verify_compares_parameters_and_comments(self):
+        info, data = convert._load_csv(self.base)
+        expected = convert._checksum(data)
+        tmp = self.base + convert.TMP_SUFFIX
+        convert._write_hdf5(tmp, info, data)
+        self.assertIsNone(convert._verify(tmp + '.hdf5', info, expected))
+        info.parameters[0]['data'] = 'T-18'
+        self.assertEqual('parameter mismatch: Tip',
+                         convert._verify(tmp + '.hdf5', info, expected))
+        info.parameters[0]['data'] = 'T-17'
+        t, user, _ = info.comments[0]
+        info.comments[0] = (t, user, 'shutter closed')
+        self.assertEqual('comment mismatch', convert._verify(tmp + '.hdf5', info, expected))
+
+    def test_nothing_left_to_convert(self):
+        self.convert()
+        failures, messages = self.convert()
+        self.assertEqual(0, failures)
+        self.assertEqual(['0 CSV datasets to convert'], messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
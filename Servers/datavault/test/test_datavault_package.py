@@ -9,7 +9,7 @@ from labrad import types
 
 from twisted.internet import task
 
-from datavault import Session, Dataset, SessionStore
+from datavault import Session, Dataset, SessionStore, backend, errors
 
 
 def _unique_dir():
@@ -143,6 +143,41 @@ class SessionTest(_DatavaultTestCase):
         opened_dataset = session.openDataset('00001 - Foo')
         self.assertDatasetsEqual(dataset, opened_dataset)
 
+    def test_open_dataset_by_number(self):
+        session = self._get_session()
+        session.newDataset('First', self._INDEPENDENTS, self._DEPENDENTS)
+        second = session.newDataset(
+                'Second', self._INDEPENDENTS, self._DEPENDENTS)
+        self.assertDatasetsEqual(second, session.openDataset(2))
+        with self.assertRaises(errors.DatasetNotFoundError):
+            session.openDataset(3)
+
+    def test_new_dataset_updates_index_without_rescan(self):
+        session = self._get_session()
+        session.listDatasets()
+        with mock.patch('os.listdir', side_effect=os.listdir) as listdir:
+            session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+            self.assertEqual(['00001 - Foo'], session.listDatasets())
+            self.assertEqual(([], ['00001 - Foo']), session.listContents([]))
+        self.assertFalse(listdir.called)
+
+    def test_metadata_saves_keep_index(self):
+        session = self._get_session()
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        session.listDatasets()
+        with mock.patch('os.listdir', side_effect=os.listdir) as listdir:
+            session.save()
+            session.updateTags(['tagged'], [], ['00001 - Foo'])
+            self.assertEqual(['00001 - Foo'], session.listDatasets())
+        self.assertFalse(listdir.called)
+
+    def test_index_sees_external_changes(self):
+        session = self._get_session()
+        self.assertEqual([], session.listDatasets())
+        os.mkdir(os.path.join(session.dir, 'other.dir'))
+        dirs, datasets = session.listContents([])
+        self.assertEqual(['other'], dirs)
+
     def test_add_child_session(self):
         parent_session = self._get_session(path=['parent'])
         # Add a listener
@@ -168,6 +203,30 @@ class SessionTest(_DatavaultTestCase):
         d2 = s2.openDataset(datasets[0])
         self.assertDatasetsEqual(d1, d2)
 
+    def test_access_saves_are_delayed(self):
+        clock = task.Clock()
+        session = Session(self.datadir, ['foo'], self.hub, self.store,
+                          reactor=clock)
+        saved = os.path.getmtime(session.infofile)
+        os.utime(session.infofile, (saved - 10, saved - 10))
+        for _ in range(5):
+            session.access()
+        self.assertEqual(saved - 10, os.path.getmtime(session.infofile))
+        clock.advance(backend.SAVE_DELAY_SEC)
+        self.assertNotEqual(saved - 10, os.path.getmtime(session.infofile))
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_counter_recovered_from_datasets(self):
+        session = self._get_session()
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        # Simulate a stop before the updated counter was written out.
+        session.counter = 1
+        session.save()
+
+        reloaded = self._get_session()
+        self.assertEqual(3, reloaded.counter)
+
     def test_add_new_tags(self):
         session1 = self._get_session()
         dataset1 = session1.newDataset(
@@ -297,7 +356,7 @@ class DatasetTest(_DatavaultTestCase):
                 independents=self._INDEPENDENTS,
                 dependents=self._DEPENDENTS)
 
-        self.assertEqual('2.0.0', dataset.version())
+        self.assertEqual('2.1.0', dataset.version())
 
         self.assertEqual('*(v[mA],v[Ghz],v[V])', dataset.getRowType())
         self.assertEqual('(*v[mA],*v[Ghz],*v[V])', dataset.getTransposeType())
@@ -327,7 +386,7 @@ class DatasetTest(_DatavaultTestCase):
                 dependents=self._EXT_DEPENDENTS,
                 extended=True)
 
-        self.assertEqual('3.0.0', dataset.version())
+        self.assertEqual('3.1.0', dataset.version())
 
         self.assertEqual('*(v[ns],*2c[V]{2,2},*2i{3,2})', dataset.getRowType())
         self.assertEqual('(*v[ns],*3c[V]{N,2,2},*3i{N,3,2})', dataset.getTransposeType())
@@ -0,0 +1,49 @@
+import numpy as np
+import unittest
+
+from datavault import decimate
+
+
+def _trace(n):
+    t = np.arange(n, dtype=np.float64)
+    return np.column_stack((t, np.sin(t / 50.0), np.cos(t / 50.0)))
+
+
+class DecimateTest(unittest.TestCase):
+
+    def test_short_data_unchanged(self):
+        data = _trace(10)
+        for method in decimate.METHODS:
+            self.assertTrue(np.array_equal(data, decimate.decimate(data, 100, method)))
+
+    def test_stride(self):
+        data = _trace(1001)
+        out = decimate.stride(data, 11)
+        self.assertEqual(out.shape, (11, 3))
+        self.assertTrue(np.array_equal(out[:, 0], np.arange(0, 1001, 100)))
+
+    def test_minmax_keeps_spikes(self):
+        data = _trace(10000)
+        data[1234, 1] = 50.0
+        data[5678, 2] = -50.0
+        out = decimate.minmax(data, 100)
+        self.assertEqual(out.shape, (100, 3))
+        self.assertEqual(out[:, 1].max(), 50.0)
+        self.assertEqual(out[:, 2].min(), -50.0)
+        self.assertEqual(out[0, 0], 0)
+        self.assertEqual(out[-1, 0], 9999)
+        self.assertTrue(np.all(np.diff(out[:, 0]) >= 0))
+
+    def test_lttb(self):
+        data = _trace(10000)
+        data[4321, 1] = 50.0
+        out = decimate.lttb(data, 200)
+        self.assertEqual(out.shape, (200, 3))
+        self.assertEqual(out[0, 0], 0)
+        self.assertEqual(out[-1, 0], 9999)
+        self.assertTrue(np.all(np.diff(out[:, 0]) > 0))
+        self.assertIn(4321, out[:, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
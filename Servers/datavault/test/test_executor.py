@@ -0,0 +1,176 @@
+import numpy as np
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+from h5py._objects import phil
+from twisted.internet import reactor
+from twisted.python import failure
+
+from datavault import Session, executor, util
+
+
+def _wait(d, timeout=30):
+    """Turn the reactor by hand until the Deferred d has fired."""
+    result = []
+    d.addBoth(result.append)
+    end = time.time() + timeout
+    while not result:
+        if time.time() > end:
+            raise AssertionError('Deferred did not fire in {} s'.format(timeout))
+        reactor.iterate(0.001)
+    if isinstance(result[0], failure.Failure):
+        result[0].raiseException()
+    return result[0]
+
+
+class LaneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = executor.IOExecutor()
+        self.addCleanup(self.executor.stop)
+
+    def test_runs_in_order_off_reactor_thread(self):
+        lane = self.executor.lane()
+        order = []
+        main = threading.current_thread()
+        def work(i):
+            time.sleep(0.001 * (5 - i % 5))
+            order.append((i, threading.current_thread() is main))
+        for i in range(20):
+            d = lane.run(work, i)
+        _wait(d)
+        self.assertEqual([(i, False) for i in range(20)], order)
+
+    def test_lanes_run_in_parallel(self):
+        started = threading.Event()
+        release = threading.Event()
+        def blocker():
+            started.set()
+            release.wait(5)
+        d = self.executor.lane().run(blocker)
+        # a second lane is not stuck behind the first one
+        self.assertTrue(_wait(self.executor.lane().run(started.wait, 5)))
+        release.set()
+        _wait(d)
+
+    def test_call_later_runs_in_lane(self):
+        lane = self.executor.lane()
+        fired = []
+        lane.callLater(0.01, lambda: fired.append(threading.current_thread()))
+        _wait(lane.run(time.sleep, 0.05))
+        _wait(lane.run(lambda: None))
+        self.assertEqual(1, len(fired))
+        self.assertIsNot(threading.current_thread(), fired[0])
+
+    def test_cancelled_call_does_not_run(self):
+        lane = self.executor.lane()
+        fired = []
+        call = lane.callLater(0.01, fired.append, True)
+        call.cancel()
+        self.assertFalse(call.active())
+        _wait(lane.run(time.sleep, 0.05))
+        _wait(lane.run(lambda: None))
+        self.assertEqual([], fired)
+
+
+class StreamingCursorTest(unittest.TestCase):
+    """Pushes and gets through one cursor see every row exactly once."""
+
+    def setUp(self):
+        self.executor = executor.IOExecutor()
+        self.addCleanup(self.executor.stop)
+        self.hub = mock.MagicMock()
+        session = Session(tempfile.mkdtemp(prefix='dvtest_'), ['foo'],
+                          self.hub, mock.MagicMock(), executor=self.executor)
+        self.dataset = session.newDataset('live', [('t', 's')], [('p', 'P', 'mbar')])
+
+    def test_concurrent_add_and_get(self):
+        cursor = {'filepos': 0}
+        _wait(self.dataset.startPushing('reader', cursor))
+        def get(start):
+            return self.dataset.getData(None, start, simpleOnly=True)
+        reads = []
+        for i in range(50):
+            rows = np.array([[i, i]], dtype=float)
+            self.dataset.run(self.dataset.addData, util.to_record_array(rows))
+            reads.append(self.dataset.readAt(cursor, get))
+        # let the pushes scheduled from the lane run
+        end = time.time() + 30
+        while cursor['filepos'] < 50 and time.time() < end:
+            reactor.iterate(0.001)
+        _wait(self.dataset.run(lambda: None))
+        seen = [row[0] for d in reads for row in _wait(d)]
+        for call in self.hub.onDataPushed.call_args_list:
+            (start, end, rows), _ = call[0]
+            seen.extend(row[0] for row in rows)
+        self.assertEqual(list(range(50)), sorted(seen))
+        self.assertEqual(50, cursor['filepos'])
+
+
+class ReactorLatencyTest(unittest.TestCase):
+    """The reactor keeps serving one dataset while another is read.
+
+    h5py runs one call at a time under a global lock, so anything the
+    reactor thread did with a file would wait for the whole read.
+    """
+
+    ROWS = 200000
+    READ_TIME = 0.5 # how long each read keeps h5py's lock
+
+    def setUp(self):
+        self.executor = executor.IOExecutor()
+        self.addCleanup(self.executor.stop)
+        session = Session(tempfile.mkdtemp(prefix='dvtest_'), ['foo'],
+                          mock.MagicMock(), mock.MagicMock(),
+                          executor=self.executor)
+        self.big = session.newDataset(
+                'big', [('t', 's')], [('p', 'P', 'mbar'), ('q', 'Q', 'mbar')])
+        rows = np.random.rand(self.ROWS, 3)
+        _wait(self.big.run(self.big.addData, util.to_record_array(rows)))
+        self.small = session.newDataset(
+                'small', [('t', 's')], [('p', 'P', 'mbar')])
+        _wait(self.small.addParameter('material', 'Pb'))
+
+    def get(self):
+        # hold the lock for as long as a much larger dataset would
+        with phil:
+            data, _ = self.big.getData(None, 0, False, True)
+            time.sleep(self.READ_TIME)
+        return data
+
+    def test_add_during_read(self):
+        reads = [self.big.run(self.get) for _ in range(2)]
+        stalls = []
+        writes = []
+        count = 0
+        while not all(d.called for d in reads):
+            # what the add, add parameter, add comment and get parameter
+            # settings do on the reactor thread
+            start = time.time()
+            rows = np.array([[count, count]], dtype=float)
+            records = np.core.records.fromarrays(rows.T, dtype=self.small.dtype)
+            writes.append(self.small.run(self.small.addData, records))
+            writes.append(self.small.addParameter('p{}'.format(count), count))
+            writes.append(self.small.addComment('user', str(count)))
+            self.small.getParameter('Material', case_sensitive=False)
+            self.small.access()
+            stalls.append(time.time() - start)
+            count += 1
+            reactor.iterate(0.001)
+        for d in reads:
+            self.assertEqual(_wait(d).shape, (self.ROWS, 3))
+        for d in writes:
+            _wait(d)
+        self.assertGreater(count, 10)
+        self.assertLess(max(stalls), 0.2 * self.READ_TIME)
+        self.assertEqual(count, len(self.small.getComments(None, 0)[0]))
+        self.assertEqual(count + 1, len(self.small.getParamNames()))
+        data, _ = _wait(self.small.run(self.small.getData, None, 0, False, True))
+        self.assertEqual(list(range(count)), list(data[:, 0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
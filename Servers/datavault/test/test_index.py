@@ -0,0 +1,154 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from labrad import units as U
+
+from datavault import SessionStore, backend, errors, index
+from datavault.index import INDEX_FILE, VaultIndex
+
+
+class VaultIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest_')
+        self.index = VaultIndex(os.path.join(self.datadir, INDEX_FILE))
+        self.index.addDataset([''], '00001 - Pb tip', 'Pb tip')
+        self.index.addDataset(['', 'tips'], '00001 - In tip', 'In tip')
+        self.index.addDataset(['', 'tips'], '00002 - Pb tip', 'Pb tip')
+        self.index.addParameters([''], '00001 - Pb tip',
+                                 [('material', 'Pb'), ('rate', 2.5),
+                                  ('diameter', U.Value(70, 'nm'))])
+        self.index.addParameters(['', 'tips'], '00002 - Pb tip',
+                                 [('material', 'Pb'), ('rate', 1.5),
+                                  ('diameter', U.Value(0.1, 'um'))])
+        self.index.addParameters(['', 'tips'], '00001 - In tip',
+                                 [('material', 'In'), ('rate', 3)])
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.datadir)
+
+    def names(self, conditions):
+        return [name for path, name in self.index.query(conditions)]
+
+    def test_created(self):
+        self.assertTrue(self.index.created)
+        self.index.close()
+        self.index = VaultIndex(os.path.join(self.datadir, INDEX_FILE))
+        self.assertFalse(self.index.created)
+        self.assertEqual(self.index.count(), 3)
+
+    def test_query_returns_paths(self):
+        self.assertEqual(
+                self.index.query([('name', '=', '00002 - Pb tip')]),
+                [(['', 'tips'], '00002 - Pb tip')])
+
+    def test_query_all(self):
+        self.assertEqual(len(self.index.query([])), 3)
+
+    def test_query_text_and_numbers(self):
+        self.assertEqual(
+                self.names([('param:material', '=', 'Pb'),
+                            ('param:rate', '>', 2)]),
+                ['00001 - Pb tip'])
+        self.assertEqual(self.names([('title', 'match', 'I*')]),
+                         ['00001 - In tip'])
+        self.assertEqual(self.names([('session', '=', '/tips'),
+                                     ('param:rate', '<=', 1.5)]),
+                         ['00002 - Pb tip'])
+
+    def test_query_units(self):
+        self.assertEqual(
+                self.names([('param:diameter', '<', U.Value(80, 'nm'))]),
+                ['00001 - Pb tip'])
+        self.assertEqual(
+                self.names([('param:diameter', '>=', U.Value(0.1, 'um'))]),
+                ['00002 - Pb tip'])
+        # incompatible units never match
+        self.assertEqual(
+                self.names([('param:diameter', '<', U.Value(1, 's'))]), [])
+
+    def test_parse_value(self):
+        self.assertEqual(index.parse_value('3'), 3.0)
+        self.assertEqual(index.parse_value('80 nm'), U.Value(80, 'nm'))
+        self.assertEqual(index.parse_value('Pb'), 'Pb')
+        self.assertEqual(index.parse_value('3rd run'), '3rd run')
+
+    def test_parameters_are_replaced(self):
+        self.index.addParameters([''], '00001 - Pb tip', [('rate', 0.5)])
+        self.assertEqual(self.names([('param:rate', '>', 2)]), ['00001 - In tip'])
+
+    def test_tags(self):
+        self.index.setTags(['', 'tips'], [], [('00001 - In tip', ['trash'])])
+        self.assertEqual(self.names([('tag', '=', 'trash')]), ['00001 - In tip'])
+        self.assertEqual(len(self.names([('tag', '!=', 'trash')])), 2)
+        self.index.setTags(['', 'tips'], [], [('00001 - In tip', [])])
+        self.assertEqual(self.names([('tag', '=', 'trash')]), [])
+
+    def test_bad_queries(self):
+        self.assertRaises(errors.BadQueryError,
+                          self.index.query, [('colour', '=', 'red')])
+        self.assertRaises(errors.BadQueryError,
+                          self.index.query, [('name', '~', 'x')])
+        self.assertRaises(errors.BadQueryError,
+                          self.index.query, [('tag', '<', 'x')])
+
+
+class VaultIndexSessionTest(unittest.TestCase):
+    """The index follows changes made through sessions and can be rebuilt."""
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest_')
+        self.index = VaultIndex(os.path.join(self.datadir, INDEX_FILE))
+        self.store = SessionStore(self.datadir, mock.MagicMock(),
+                                  vault_index=self.index)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.datadir)
+
+    def make_datasets(self):
+        root = self.store.get([''])
+        session = self.store.get(['', 'tips'])
+        dataset = session.newDataset('Pb tip', ['t [s]'], ['z (FTM) [A]'])
+        dataset.addParameter('material', 'Pb')
+        dataset.addParameters([('diameter', U.Value(75, 'nm')), ('rate', 2.0)])
+        session.updateTags(['good'], [], [dataset.name])
+        session.newDataset('In tip', ['t [s]'], ['z (FTM) [A]'])
+        root.updateTags(['archive'], ['tips'], [])
+        return dataset
+
+    def test_incremental_updates(self):
+        dataset = self.make_datasets()
+        self.assertEqual(
+                self.index.query([('param:diameter', '<', U.Value(80, 'nm')),
+                                  ('param:material', '=', 'Pb'),
+                                  ('tag', '=', 'good')]),
+                [(['', 'tips'], dataset.name)])
+        self.assertEqual(len(self.index.query([('title', '=', 'In tip')])), 1)
+
+    def test_rebuild(self):
+        self.make_datasets()
+        for session in self.store.get_all():
+            session.flush()
+        before = self.index.query([])
+        tagged = self.index.query([('tag', '=', 'good')])
+        self.index.rebuild(self.datadir)
+        self.assertEqual(self.index.query([]), before)
+        self.assertEqual(self.index.query([('tag', '=', 'good')]), tagged)
+        self.assertEqual(
+                len(self.index.query([('param:rate', '=', 2.0)])), 1)
+
+    def test_rebuild_skips_files_being_converted(self):
+        self.make_datasets()
+        for session in self.store.get_all():
+            session.flush()
+        before = self.index.query([])
+        session = os.path.join(self.datadir, 'tips.dir')
+        name = [f for f in os.listdir(session) if f.endswith('.hdf5')][0]
+        shutil.copy(os.path.join(session, name),
+                    os.path.join(session, name[:-5] + backend.CONVERTING_SUFFIX + '.hdf5'))
+        self.index.rebuild(self.datadir)
+        self.assertEqual(self.index.query([]), before)
@@ -5,12 +5,16 @@ import pytest
 import tempfile
 import unittest
 
-from twisted.internet import reactor, task
+from twisted.internet import defer, reactor, task
+from twisted.python import failure
 
 from labrad.server import LabradServer, Signal, setting
 from labrad import server
+from labrad import types as T
+from labrad import units as U
 
 from datavault import backend, errors, server, SessionStore
+from datavault.index import INDEX_FILE, VaultIndex
 
 
 def _unique_dir():
@@ -38,6 +42,26 @@ def _empty_and_remove_dir(*names):
         os.rmdir(name)
 
 
+class _Synchronous(object):
+    """Call server settings and unwrap the Deferreds they return.
+
+    Without an I/O executor the dataset operations run inline, so the
+    Deferreds have always fired by the time the setting returns.
+    """
+    def __init__(self, server):
+        self._server = server
+
+    def __getattr__(self, name):
+        setting = getattr(self._server, name)
+        def call(*args, **kw):
+            result = []
+            defer.maybeDeferred(setting, *args, **kw).addBoth(result.append)
+            if isinstance(result[0], failure.Failure):
+                result[0].raiseException()
+            return result[0]
+        return call
+
+
 class MockContext(dict):
     def __init__(self, name='test-context'):
         self.ID = name
@@ -52,6 +76,7 @@ class DataVaultTest(unittest.TestCase):
         self.store = SessionStore(self.datadir, self.hub)
         self.datavault = server.DataVault(self.store)
         self.set_default_labrad_server_mocks(self.datavault)
+        self.sync = _Synchronous(self.datavault)
 
         self.context = MockContext()
 
@@ -127,7 +152,7 @@ class DataVaultTest(unittest.TestCase):
 
         self.assertEqual([''], path)
         self.assertEqual('00001 - foo', name)
-        self.assertEqual('2.0.0', self.datavault.get_version(self.context))
+        self.assertEqual('2.1.0', self.datavault.get_version(self.context))
 
         # Check that it contains the right pieces.
         # Simple variables output.
@@ -179,6 +204,45 @@ class DataVaultTest(unittest.TestCase):
         self.assertRaises(
                 errors.NoDatasetError, self.datavault.getDataset, self.context)
 
+    def test_query_without_index(self):
+        self.datavault.initContext(self.context)
+        self.assertRaises(
+                errors.BadQueryError, self.datavault.query, self.context, [])
+
+    def test_query(self):
+        index = VaultIndex(os.path.join(self.datadir, INDEX_FILE))
+        self.addCleanup(index.close)
+        self.store.vault_index = index
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x [s]'], ['y (z) [V]'])
+        self.datavault.add_parameter(self.context, 'material', 'Pb')
+        self.assertEqual(
+                self.datavault.query(self.context, [('param:material', '=', 'Pb')]),
+                [([''], '00001 - foo')])
+        self.assertEqual(
+                self.datavault.query(self.context, [('title', '=', 'bar')]), [])
+
+    def test_query_mixed_values(self):
+        index = VaultIndex(os.path.join(self.datadir, INDEX_FILE))
+        self.addCleanup(index.close)
+        self.store.vault_index = index
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x [s]'], ['y (z) [V]'])
+        self.datavault.add_parameter(self.context, 'material', 'Pb')
+        self.datavault.add_parameter(self.context, 'diameter', U.Value(80, 'nm'))
+        self.datavault.add_parameter(self.context, 'passes', 3)
+        conditions = [('param:material', '=', 'Pb'),
+                      ('param:diameter', '<', '0.1 um'),
+                      ('param:passes', '>=', '3')]
+        # send them the way a client would
+        flat = T.flatten(conditions, server.DataVault.query.accepts[0])
+        self.assertEqual(
+                self.sync.query(self.context, T.unflatten(flat.bytes, flat.tag)),
+                [([''], '00001 - foo')])
+        self.assertEqual(
+                self.sync.query(self.context, [('param:diameter', '>', '1 um')]),
+                [])
+
     def test_add_session_with_cd(self):
         # Create the root session.
         self.datavault.initContext(self.context)
@@ -237,30 +301,112 @@ class DataVaultTest(unittest.TestCase):
                 [('x', 'ms'), ('y', 'Volt')],
                 [('z', 'E', 'eV')])
         # Add two rows of data.
-        self.datavault.add(self.context, [(.1, .2, .3), (.4, .5, .6)])
+        self.sync.add(self.context, [(.1, .2, .3), (.4, .5, .6)])
         # Check that the data is there.
-        data = self.datavault.get(self.context)
+        data = self.sync.get(self.context)
         self.assertArrayEqual([[.1, .2, .3], [.4, .5, .6]], data)
-        more_data = self.datavault.get(self.context)
+        more_data = self.sync.get(self.context)
         self.assertArrayEqual([], more_data)
 
         # Check that data can be fetched incrementally.
-        row_1 = self.datavault.get(self.context, limit=1, startOver=True)
-        row_2 = self.datavault.get(self.context, limit=1)
+        row_1 = self.sync.get(self.context, limit=1, startOver=True)
+        row_2 = self.sync.get(self.context, limit=1)
         self.assertArrayEqual([[.1, .2, .3]], row_1)
         self.assertArrayEqual([[.4, .5, .6]], row_2)
 
+        # Check that a decimated view leaves the read position alone.
+        decimated = self.sync.get_decimated(self.context, 1)
+        self.assertArrayEqual([[.1, .2, .3]], decimated)
+        self.assertArrayEqual([], self.sync.get(self.context))
+        self.assertRaises(
+                errors.BadDecimationError,
+                self.sync.get_decimated,
+                self.context, 10, 'bogus')
+
+        # Check that rows can be selected by their first independent.
+        window = self.sync.get_range(self.context, .3, .5)
+        self.assertArrayEqual([[.4, .5, .6]], window)
+        self.assertArrayEqual([], self.sync.get_range(self.context, 1, 2))
+
+        # Check that reading the open dataset shows up in the cache stats.
+        stats = dict(self.datavault.cache_stats(self.context))
+        self.assertGreater(stats['hits'], 0)
+        self.assertLessEqual(stats['handles'], stats['max handles'])
+
         # Check that the data can be fetched in extended format.
-        data_ex = self.datavault.get_ex(self.context, startOver=True)
+        data_ex = self.sync.get_ex(self.context, startOver=True)
         self.assertArrayEqual([[.1, .2, .3], [.4, .5, .6]], data_ex)
 
         # Check that the data can not be fetched in extended transpose format.
         self.assertRaises(
                 RuntimeError,
-                self.datavault.get_ex_t,
+                self.sync.get_ex_t,
                 self.context,
                 startOver=True)
 
+    def test_stream_data(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.sync.add(self.context, [(0, 0), (1, 1)])
+        reader = MockContext('reader')
+        self.datavault.initContext(reader)
+        self.sync.open(reader, '00001 - foo')
+        pushed = self.hub.onDataPushed
+        # rows already in the dataset are sent when streaming starts
+        self.sync.stream_data(reader)
+        (start, end, rows), contexts = pushed.call_args[0]
+        self.assertEqual((start, end, list(contexts)), (0, 2, ['reader']))
+        self.assertArrayEqual([[0, 0], [1, 1]], rows)
+
+        self.sync.add(self.context, [(2, 2), (3, 3)])
+        (start, end, rows), _ = pushed.call_args[0]
+        self.assertEqual((start, end), (2, 4))
+        self.assertArrayEqual([[2, 2], [3, 3]], rows)
+        # the read position has moved past the pushed rows
+        self.assertArrayEqual([], self.sync.get(reader))
+
+        # decimated batches still report the real positions
+        self.sync.stream_data(reader, True, 2)
+        self.sync.add(self.context, [(i, i) for i in range(4, 14)])
+        (start, end, rows), _ = pushed.call_args[0]
+        self.assertEqual((start, end, len(rows)), (4, 14, 2))
+        self.assertArrayEqual([[4, 4], [13, 13]], rows)
+
+        self.sync.stream_data(reader, False)
+        pushed.reset_mock()
+        self.sync.add(self.context, [(14, 14)])
+        self.assertFalse(pushed.called)
+        self.assertRaises(errors.BadDecimationError,
+                          self.sync.stream_data, reader, True, 10, 'bogus')
+
+    def test_stream_data_stops_on_open(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        first = self.datavault.getDataset(self.context)
+        self.sync.stream_data(self.context)
+        self.datavault.new(self.context, 'bar', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.assertEqual({}, first.push_listeners)
+
+    def test_stream_extended_data(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context, 'foo',
+                [('x', [1], 'v', 'ms')], [('y', 'E', [1], 'i', '')])
+        reader = MockContext('reader')
+        self.datavault.initContext(reader)
+        self.sync.open(reader, '00001 - foo')
+        # the rows could not be sent as *2v
+        self.assertRaises(errors.DataVersionMismatchError,
+                          self.sync.stream_data, reader)
+
+        # a failed push is logged and doesn't fail the writer
+        dataset = self.datavault.getDataset(reader)
+        dataset.startPushing(reader.ID, reader)
+        with mock.patch('twisted.python.log.err') as err:
+            self.sync.add_ex(self.context, [(1.0, 2), (2.0, 3)])
+        self.assertTrue(err.called)
+        self.assertEqual(2, len(self.sync.get_ex(self.context, startOver=True)))
+
     def test_add_extended_data(self):
         self.datavault.initContext(self.context)
         # Create a root dataset.
@@ -272,24 +418,24 @@ class DataVaultTest(unittest.TestCase):
         # Add two rows of data.
         data_row_1 = ([[.1, .5], [.5, .9]], 2, [[.1j, 2j]])
         data_row_2 = ([[.3, .4], [.4, .8]], 3, [[.3j, 5j]])
-        self.datavault.add_ex(self.context, [data_row_1, data_row_2])
+        self.sync.add_ex(self.context, [data_row_1, data_row_2])
 
         # Check that the data is there.
-        data = self.datavault.get_ex(self.context)
+        data = self.sync.get_ex(self.context)
         self.assertDataRowEqual(data_row_1, data[0])
         self.assertDataRowEqual(data_row_2, data[1])
 
-        more_data = self.datavault.get_ex(self.context)
+        more_data = self.sync.get_ex(self.context)
         self.assertArrayEqual([], more_data)
 
         # Check that data can be fetched incrementally.
-        row_1 = self.datavault.get_ex(self.context, limit=1, startOver=True)
-        row_2 = self.datavault.get_ex(self.context, limit=1)
+        row_1 = self.sync.get_ex(self.context, limit=1, startOver=True)
+        row_2 = self.sync.get_ex(self.context, limit=1)
         self.assertDataRowEqual(data_row_1, row_1[0])
         self.assertDataRowEqual(data_row_2, row_2[0])
 
         # Check that the data can be fetched in transpose format.
-        data_t = self.datavault.get_ex_t(self.context, startOver=True)
+        data_t = self.sync.get_ex_t(self.context, startOver=True)
         expected_x = [[[.1, .5], [.5, .9]], [[.3, .4], [.4, .8]]]
         expected_y = [2, 3]
         expected_z =  [[[.1j, 2j]], [[.3j, 5j]]]
@@ -300,7 +446,7 @@ class DataVaultTest(unittest.TestCase):
         # Extended data format cannot be read as simple data.
         self.assertRaises(
                 errors.DataVersionMismatchError,
-                self.datavault.get,
+                self.sync.get,
                 self.context)
 
     def test_add_extended_data_transpose(self):
@@ -315,26 +461,26 @@ class DataVaultTest(unittest.TestCase):
         x = [[[.1, .5], [.5, .9]], [[.3, .4], [.4, .8]]]
         y = [2, 3]
         z =  [[[.1j, 2j]], [[.3j, 5j]]]
-        self.datavault.add_ex_t(self.context, [x, y, z])
+        self.sync.add_ex_t(self.context, [x, y, z])
 
         # Check that the data is there as non-transposed data.
         data_row_1 = ([[.1, .5], [.5, .9]], 2, [[.1j, 2j]])
         data_row_2 = ([[.3, .4], [.4, .8]], 3, [[.3j, 5j]])
-        data = self.datavault.get_ex(self.context)
+        data = self.sync.get_ex(self.context)
         self.assertDataRowEqual(data_row_1, data[0])
         self.assertDataRowEqual(data_row_2, data[1])
 
-        more_data = self.datavault.get_ex(self.context)
+        more_data = self.sync.get_ex(self.context)
         self.assertArrayEqual([], more_data)
 
         # Check that data can be fetched incrementally.
-        row_1 = self.datavault.get_ex(self.context, limit=1, startOver=True)
-        row_2 = self.datavault.get_ex(self.context, limit=1)
+        row_1 = self.sync.get_ex(self.context, limit=1, startOver=True)
+        row_2 = self.sync.get_ex(self.context, limit=1)
         self.assertDataRowEqual(data_row_1, row_1[0])
         self.assertDataRowEqual(data_row_2, row_2[0])
 
         # Check that the data can be fetched in transpose format.
-        data_t = self.datavault.get_ex_t(self.context, startOver=True)
+        data_t = self.sync.get_ex_t(self.context, startOver=True)
         self.assertArrayEqual(x, data_t[0])
         self.assertArrayEqual(y, data_t[1])
         self.assertArrayEqual(z, data_t[2])
@@ -342,7 +488,7 @@ class DataVaultTest(unittest.TestCase):
         # Extended data format cannot be read as simple data.
         self.assertRaises(
                 errors.DataVersionMismatchError,
-                self.datavault.get,
+                self.sync.get,
                 self.context)
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from datavault import Session, tags, util
+
+
+class ParseLegacyTagsTest(unittest.TestCase):
+    def test_parses_repr_of_sets(self):
+        d = {'00001 - foo': {'trash', 'star'}, '00002 - bar': set()}
+        self.assertEqual(tags.parse_legacy_tags(repr(d)), d)
+        self.assertEqual(tags.parse_legacy_tags('{}'), {})
+
+    def test_rejects_code(self):
+        for text in ["__import__('os').system('true')",
+                     "{'a': open('x')}",
+                     "{'a': {1}}",
+                     "{'a': {'b'}",
+                     "['a']"]:
+            self.assertRaises(ValueError, tags.parse_legacy_tags, text)
+
+
+class TagJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='dvtest_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def reload(self):
+        journal = tags.TagJournal(self.dir)
+        journal.load()
+        return journal
+
+    def test_replays_updates(self):
+        journal = tags.TagJournal(self.dir)
+        journal.record([('sub', ['a'])], [('ds', ['x', 'y'])])
+        journal.record([], [('ds', ['y'])])
+        loaded = self.reload()
+        self.assertEqual(loaded.sessions, {'sub': {'a'}})
+        self.assertEqual(loaded.datasets, {'ds': {'y'}})
+
+    def test_appends_only_changed_entries(self):
+        journal = tags.TagJournal(self.dir)
+        journal.record([], [('ds{}'.format(i), ['x']) for i in range(10)])
+        size = os.path.getsize(journal.filename)
+        journal.record([], [('ds3', [])])
+        added = os.path.getsize(journal.filename) - size
+        self.assertEqual(added, len('["d", "ds3", []]\n'))
+
+    def test_ignores_torn_line(self):
+        journal = tags.TagJournal(self.dir)
+        journal.record([], [('ds', ['x'])])
+        with open(journal.filename, 'a') as f:
+            f.write('["d", "ds", ["y"')
+        self.assertEqual(self.reload().datasets, {'ds': {'x'}})
+
+    def test_compaction(self):
+        journal = tags.TagJournal(self.dir)
+        for i in range(tags.COMPACT_MIN_LINES + 2):
+            journal.datasets['ds'] = {'x'} if i % 2 else set()
+            journal.record([], [('ds', journal.datasets['ds'])])
+        with open(journal.filename) as f:
+            lines = f.readlines()
+        self.assertLess(len(lines), 10)
+        self.assertEqual(self.reload().datasets, journal.datasets)
+
+
+class SessionTagsTest(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest_')
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def session(self):
+        return Session(self.datadir, [''], mock.MagicMock(), mock.MagicMock())
+
+    def test_tags_survive_reload(self):
+        session = self.session()
+        session.updateTags(['trash'], [], ['00001 - foo'])
+        session.updateTags(['star', '-trash'], ['sub'], ['00001 - foo'])
+        session.flush()
+        reloaded = self.session()
+        self.assertEqual(reloaded.getTags(['sub'], ['00001 - foo']),
+                         ([('sub', ['star'])], [('00001 - foo', ['star'])]))
+        S = util.DVSafeConfigParser()
+        S.read(session.infofile)
+        self.assertFalse(S.has_section('Tags'))
+
+    def test_migrates_legacy_tags(self):
+        self.session().flush()
+        infofile = os.path.join(self.datadir, 'session.ini')
+        S = util.DVSafeConfigParser()
+        S.read(infofile)
+        S.add_section('Tags')
+        S.set('Tags', 'sessions', repr({'sub': {'a'}}))
+        S.set('Tags', 'datasets', repr({'00001 - foo': {'trash'}, '00002 - bar': set()}))
+        util.write_config(S, infofile)
+
+        session = self.session()
+        self.assertEqual(session.getTags(['sub'], ['00001 - foo']),
+                         ([('sub', ['a'])], [('00001 - foo', ['trash'])]))
+        self.assertTrue(os.path.exists(os.path.join(self.datadir, tags.JOURNAL_FILE)))
+        # the tags are no longer written to session.ini
+        S = util.DVSafeConfigParser()
+        S.read(infofile)
+        self.assertFalse(S.has_section('Tags'))
+        self.assertEqual(self.session().dataset_tags['00001 - foo'], {'trash'})
@@ -51,6 +51,33 @@ class Testutil(unittest.TestCase):
         self.assertEqual(expected.dtype, actual.dtype, msg='dtype mismatch')
         self.assertTrue(np.array_equal(expected, actual), msg='array mismatch')
 
+    def test_to_float_array(self):
+        data = np.recarray((2, ), dtype=[('f0', '<f8'), ('f1', '<f8')])
+        data[0] = (0, 1)
+        data[1] = (2, 3)
+        actual = util.to_float_array(data)
+        expected = np.array([[0, 1], [2, 3]], dtype=float)
+        self.assertEqual(expected.shape, actual.shape, msg='shape mismatch')
+        self.assertEqual(expected.dtype, actual.dtype, msg='dtype mismatch')
+        self.assertTrue(np.array_equal(expected, actual), msg='array mismatch')
+        self.assertTrue(np.shares_memory(data, actual), msg='array was copied')
+
+    def test_to_float_array_not_packed(self):
+        dtype = np.dtype({'names': ['f0', 'f1'],
+                          'formats': ['<f8', '<f8'],
+                          'offsets': [8, 0]})
+        data = np.zeros((2, ), dtype=dtype)
+        data[0] = (0, 1)
+        data[1] = (2, 3)
+        actual = util.to_float_array(data)
+        expected = np.array([[0, 1], [2, 3]], dtype=float)
+        self.assertTrue(np.array_equal(expected, actual), msg='array mismatch')
+
+    def test_to_float_array_empty(self):
+        data = np.recarray((0, ), dtype=[('f0', '<f8'), ('f1', '<f8')])
+        actual = util.to_float_array(data)
+        self.assertEqual((0, 2), actual.shape)
+
     def test_braced(self):
         actual = util.braced('foo')
         expected = '{' + 'foo' + '}'
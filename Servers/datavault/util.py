@@ -1,4 +1,5 @@
 import configparser as cp
+import os
 
 import numpy as np
 
@@ -28,6 +29,18 @@ class DVSafeConfigParser(cp.SafeConfigParser):
             fp.write(newline)
 
 
+def write_config(parser, filename):
+    """Write a config parser to filename, replacing the old file atomically.
+
+    The new contents are written to a temporary file next to the target and
+    renamed over it, so a crash mid-write never leaves a truncated file.
+    """
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'w') as f:
+        parser.write(f)
+    os.replace(tmpfile, filename)
+
+
 def to_record_array(data):
     """Take a 2-D array of numpy data and return a 1-D array of records."""
     return np.core.records.fromarrays(data.T)
@@ -41,6 +54,24 @@ def from_record_array(data):
     return np.vstack([np.array(tuple(row)) for row in data])
 
 
+def to_float_array(data):
+    """Take a 1-D array of float64 records and return a 2-D float64 array.
+
+    Records that are packed back to back (which is what h5py hands us) are
+    reinterpreted in place, so no per-row Python objects or copies are made
+    and the result can be flattened by LabRAD directly.  Anything else falls
+    back to stacking the columns.
+    """
+    data = np.asarray(data)
+    names = data.dtype.names
+    packed = all(data.dtype.fields[name][0] == np.float64 and
+                 data.dtype.fields[name][1] == 8*idx
+                 for idx, name in enumerate(names))
+    if packed and data.dtype.itemsize == 8*len(names) and data.flags.c_contiguous:
+        return data.view(np.float64).reshape(len(data), len(names))
+    return np.column_stack([data[name] for name in names])
+
+
 def braced(s):
     """Wrap the given string in braces, which is awkward with str.format"""
     return '{' + s + '}'
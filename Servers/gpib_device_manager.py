@@ -46,6 +46,10 @@ timeout = 5
 
 UNKNOWN = '<unknown>'
 
+# registry folder and key keeping the last identification of each device
+CACHE_FOLDER = ['', 'GPIB Device Manager']
+CACHE_KEY = 'Devices'
+
 def parseIDNResponse(s):
     """Parse the response from *IDN? to get mfr and model info."""
     #mfr, model, ver, rev = s.split(',')
@@ -62,7 +66,10 @@ class GPIBDeviceManager(LabradServer):
     The device manager listens for "GPIB Device Connect" and
     "GPIB Device Disconnect" messages coming from GPIB bus servers.
     It attempts to identify the connected devices and forward the
-    messages on to servers interested in particular devices.  For
+    messages on to servers interested in particular devices.  Each
+    identification is kept in the registry; a device seen before at the
+    same address is announced with its last name straight away, and
+    only identified again if its *IDN? response has changed.  For
     devices that cannot be identified by *IDN? in the usual way,
     servers can register an identification setting to be called
     by the device manager to properly identify the device.
@@ -77,6 +84,8 @@ class GPIBDeviceManager(LabradServer):
                                 # each interested server is {'target':<>,'context':<>,'messageID':<>}
         self.identFunctions = {} # maps server to (setting, ctx) for ident
         self.identLock = DeferredLock()
+        self.cache = {} # maps (server, channel) to (name, idn) from earlier runs
+        yield self.loadCache()
 
         # named messages are sent with source ID first, which we ignore
         # connect_func = lambda c, (s, payload): self.gpib_device_connect(*payload)
@@ -116,6 +125,43 @@ class GPIBDeviceManager(LabradServer):
         print('Device Connect:', gpibBusServer, channel)
         if (gpibBusServer, channel) in self.knownDevices:
             return
+        if self.cache.get((gpibBusServer, channel), (UNKNOWN,))[0] != UNKNOWN:
+            # use the last identification now, and check it in the background
+            device, idnResult = self.cache[gpibBusServer, channel]
+            self.addDevice(gpibBusServer, channel, device, idnResult)
+            callLater(0, self.verifyDevice, gpibBusServer, channel)
+            return
+        device, idnResult = yield self.queryDevice(gpibBusServer, channel)
+        if device == UNKNOWN:
+            device = yield self.identifyDevice(gpibBusServer, channel, idnResult)
+        self.addDevice(gpibBusServer, channel, device, idnResult)
+        yield self.saveCache()
+
+    @inlineCallbacks
+    def verifyDevice(self, server, channel):
+        """Identify a device announced from the cache again if its *IDN? changed."""
+        device, idnResult = yield self.queryDevice(server, channel)
+        cached = self.knownDevices.get((server, channel))
+        if cached is None or idnResult == cached[1]:
+            return # disconnected meanwhile, or the same device
+        print('Device at', server, channel, 'has changed')
+        if device == UNKNOWN:
+            device = yield self.identifyDevice(server, channel, idnResult)
+        if (server, channel) not in self.knownDevices:
+            return
+        self.gpib_device_disconnect(server, channel)
+        self.addDevice(server, channel, device, idnResult)
+        yield self.saveCache()
+
+    def addDevice(self, server, channel, device, idnResult):
+        self.knownDevices[server, channel] = (device, idnResult)
+        # forward message if someone cares about this device
+        if device in self.deviceServers:
+            self.notifyServers(device, server, channel, True)
+
+    @inlineCallbacks
+    def queryDevice(self, gpibBusServer, channel):
+        """Look up a device's name and *IDN? response, cleaned of bytes reprs."""
         device, idnResult = yield self.lookupDeviceName(gpibBusServer, channel)
 
         # There is a bytes conversion issue when looking up the name. Device name is read out with
@@ -129,12 +175,30 @@ class GPIBDeviceManager(LabradServer):
             idnResult = idnResult.replace("b'","")
             idnResult = idnResult[:len(idnResult)-1]
             idnResult = idnResult.rstrip()
-        if device == UNKNOWN:
-            device = yield self.identifyDevice(gpibBusServer, channel, idnResult)
-        self.knownDevices[gpibBusServer, channel] = (device, idnResult)
-        # forward message if someone cares about this device
-        if device in self.deviceServers:
-            self.notifyServers(device, gpibBusServer, channel, True)
+        returnValue((device, idnResult))
+
+    @inlineCallbacks
+    def loadCache(self):
+        """Read the identifications saved by earlier runs from the registry."""
+        reg = self.client.registry
+        yield reg.cd(CACHE_FOLDER, True)
+        keys = (yield reg.dir())[1]
+        if CACHE_KEY in keys:
+            entries = yield reg.get(CACHE_KEY)
+            for server, channel, device, idnResult in entries:
+                # a device that did not answer *IDN? is saved with ''
+                self.cache[server, channel] = (device, idnResult or None)
+        print('Cached devices:', len(self.cache))
+
+    def saveCache(self):
+        """Save the identification of every device seen to the registry."""
+        self.cache.update(self.knownDevices)
+        entries = [(server, channel, device, idnResult or '')
+                   for (server, channel), (device, idnResult) in sorted(self.cache.items())]
+        p = self.client.registry.packet()
+        p.cd(CACHE_FOLDER, True)
+        p.set(CACHE_KEY, entries)
+        return p.send()
 
     def gpib_device_disconnect(self, server, channel):
         """Handle messages when devices connect."""
@@ -203,6 +267,7 @@ class GPIBDeviceManager(LabradServer):
                 self.knownDevices[server, channel] = (name, idn)
                 if name in self.deviceServers:
                     self.notifyServers(name, server, channel, True)
+                yield self.saveCache()
         return self.identLock.run(_doServerIdentify)
 
     @inlineCallbacks
@@ -0,0 +1,240 @@
+"""Recording and replaying serial port traffic.
+
+A capture file holds the bytes sent (TX) and received (RX) on one port,
+with the time of each chunk, so that a device's behaviour can be studied
+or replayed without the hardware.  The file starts with MAGIC and the
+capture's start time (a '<d' Unix timestamp), followed by one record per
+chunk: a '<dBI' header (seconds since the start, TX or RX, length) and
+the bytes themselves.
+
+ReplaySerial stands in for a serial.Serial: the serial server opens one
+with 'Open Replay'.  Every write is matched against the next TX record,
+and the RX records that followed it are served with the delays they had
+when recorded, divided by the replay speed.
+
+To list the records in a capture file:
+
+    python serial_capture.py CAPTURE_FILE
+"""
+
+import argparse
+import datetime
+import struct
+import sys
+import threading
+import time
+
+from serial import Serial
+from serial.serialutil import SerialException
+
+MAGIC = b'SERCAP1\n'
+TX = 0
+RX = 1
+
+_START = struct.Struct('<d')
+_RECORD = struct.Struct('<dBI')
+
+
+class CaptureWriter(object):
+    """Appends the traffic of one port to a new capture file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'wb')
+        self._start = time.perf_counter()
+        self._file.write(MAGIC + _START.pack(time.time()))
+        self._file.flush()
+
+    def record(self, direction, data):
+        if not data or self._file is None:
+            return
+        t = time.perf_counter() - self._start
+        self._file.write(_RECORD.pack(t, direction, len(data)) + bytes(data))
+        # records are small and few, so flush each one to survive a crash
+        self._file.flush()
+
+    def tx(self, data):
+        self.record(TX, data)
+
+    def rx(self, data):
+        self.record(RX, data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_capture(filename):
+    """Read a capture file.
+
+    Returns (start time, records), where records is a list of
+    (seconds since start, TX or RX, bytes).  A record cut short by a
+    crash is dropped.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a serial capture file'.format(filename))
+        start, = _START.unpack(f.read(_START.size))
+        records = []
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            t, direction, length = _RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            records.append((t, direction, data))
+    return start, records
+
+
+class ReplaySerial(object):
+    """A serial port that plays back a capture file.
+
+    Writes are compared with the recorded TX bytes; any that differ are
+    counted in mismatches and the replay carries on regardless.  speed
+    divides the recorded delays, and 0 serves every reply at once.  Like
+    a real port, reads may come from another thread than writes.
+    """
+
+    BAUDRATES = Serial.BAUDRATES
+    BYTESIZES = Serial.BYTESIZES
+    PARITIES = Serial.PARITIES
+    STOPBITS = Serial.STOPBITS
+
+    def __init__(self, filename, speed=1.0, clock=time.monotonic):
+        self.filename = filename
+        self.portstr = 'replay:' + filename
+        self.speed = speed
+        self.clock = clock
+        self.baudrate = 9600
+        self.bytesize = 8
+        self.parity = 'N'
+        self.stopbits = 1
+        self.rts = self.dtr = True
+        self.timeout = 0
+        self.mismatches = 0
+        _, self._records = read_capture(filename)
+        self._cond = threading.Condition()
+        self._next = 0 # index of the next record to play
+        self._sent = bytearray()
+        self._due = [] # [time, bytes] in order
+        self._cancelled = False
+        self.is_open = True
+        with self._cond:
+            self._schedule(0.0)
+
+    def open(self):
+        # reopening carries on where the replay was, as the device would
+        with self._cond:
+            self.is_open = True
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    def _schedule(self, since):
+        """Queue the RX records up to the next TX record.
+
+        since is the recorded time that corresponds to now.
+        """
+        now = self.clock()
+        records = self._records
+        while self._next < len(records) and records[self._next][1] == RX:
+            t, _, data = records[self._next]
+            delay = (t - since) / self.speed if self.speed else 0
+            self._due.append([now + max(delay, 0), data])
+            self._next += 1
+        self._cond.notify_all()
+
+    def write(self, data):
+        with self._cond:
+            if not self.is_open:
+                raise SerialException('Attempting to use a port that is not open')
+            self._sent += data
+            records = self._records
+            while self._next < len(records) and records[self._next][1] == TX:
+                t, _, expected = records[self._next]
+                if len(self._sent) < len(expected):
+                    break
+                if self._sent[:len(expected)] != expected:
+                    self.mismatches += 1
+                del self._sent[:len(expected)]
+                self._next += 1
+                self._schedule(t)
+        return len(data)
+
+    def _ready(self):
+        """Number of bytes due by now."""
+        now = self.clock()
+        return sum(len(data) for due, data in self._due if due <= now)
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return self._ready()
+
+    def read(self, size=1):
+        with self._cond:
+            if not self.is_open:
+                raise SerialException('Attempting to use a port that is not open')
+            if self.timeout is None:
+                deadline = None
+            else:
+                deadline = self.clock() + self.timeout
+            while self.is_open and not self._cancelled and not self._ready():
+                wait = None
+                if self._due:
+                    wait = self._due[0][0] - self.clock()
+                if deadline is not None:
+                    left = deadline - self.clock()
+                    if left <= 0:
+                        break
+                    wait = left if wait is None else min(wait, left)
+                self._cond.wait(wait)
+            self._cancelled = False
+            out = bytearray()
+            now = self.clock()
+            while self._due and self._due[0][0] <= now and len(out) < size:
+                entry = self._due[0]
+                take = size - len(out)
+                out += entry[1][:take]
+                if len(entry[1]) > take:
+                    entry[1] = entry[1][take:]
+                else:
+                    self._due.pop(0)
+            return bytes(out)
+
+    def cancel_read(self):
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def reset_input_buffer(self):
+        with self._cond:
+            now = self.clock()
+            self._due = [d for d in self._due if d[0] > now]
+
+    def flushOutput(self):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='List the records in a serial capture file.')
+    parser.add_argument('capture', help='capture file')
+    args = parser.parse_args(argv)
+    start, records = read_capture(args.capture)
+    print('captured {}'.format(datetime.datetime.fromtimestamp(start)))
+    for t, direction, data in records:
+        print('{:12.6f} {} {!r}'.format(t, 'TX' if direction == TX else 'RX', data))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
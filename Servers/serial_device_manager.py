@@ -19,7 +19,18 @@ identification commands. If the port responds, the Serial
 Device Manager will write an entry in the LabRAD registry
 identifying the port as corresponding to a particular
 type of device.
+
+All ports are probed at the same time, each in its own
+thread and serial server context, and the registry is
+written once they have all answered or timed out.
+
+The result for each port is saved in the registry along
+with the fingerprint of its adapter (see the serial
+server's Port Fingerprints). On the next run, ports whose
+fingerprint has not changed keep their entries at once;
+only the others are probed.
 """
+import threading
 import time
 import platform
 import labrad
@@ -41,6 +52,10 @@ global IO_DELAY  ;IO_DELAY   = 0.1 # delay between read and write
 global PORT_DELAY;PORT_DELAY = 2.0 # delay after opening serial port
 
 global TIMEOUT; TIMEOUT = Value(1,'s') # timeout for reading 
+global PROBE_TIMEOUT; PROBE_TIMEOUT = 30.0 # seconds to wait for all ports to be identified
+
+# registry folder keeping the fingerprint and identification of each port, by serial server
+global cacheFolder; cacheFolder = "Serial Device Manager"
 
 # ports that the manager will always ignore.
 global blacklistedPorts
@@ -66,16 +81,36 @@ class serialDeviceManager(object):
         self.reg = self.cxn.registry                       # connect to the registry
 
     def run(self):
-        """Tries to identify any ports found"""
+        """Tries to identify any ports found
+
+        Ports whose adapter has the same fingerprint as when they were last
+        probed keep their last result without being probed again, whether
+        or not they were identified. The rest are identified in the
+        background, by probeThread. To probe every port again, delete the
+        serial server's key in the registry folder cacheFolder.
+        """
         serialPorts = self.ser.list_serial_ports()                                      # all serial ports found
         activePorts = [port for port in serialPorts if (port not in blacklistedPorts)]  # filter out ports present in blacklistedPorts
         print('\n')                                                                     #
         print(("Found %i active serial port(s): %s"%(len(activePorts),str(activePorts)))) # Print out number, names of ports found
         print('\n')                                                                     #
 
+        fingerprints = dict(self.ser.port_fingerprints())
+        cache = self.loadFingerprints()
+        cache = dict((port,cache[port]) for port in activePorts if port in cache) # forget ports that are gone
+
+        found = []
+        changed = []
         for port in activePorts:
-            self.identifyPort(port)
-            print('\n\n\n')
+            fingerprint = fingerprints.get(port,'')
+            if fingerprint and port in cache and cache[port][0] == fingerprint: # Same adapter as last time: use the last result.
+                serverType,deviceName = cache[port][1:]
+                print(("Port %s is unchanged (%s)."%(port,deviceName or 'not identified')))
+                if serverType:
+                    found.append((serverType,deviceName,port))
+            else:
+                changed.append(port)
+        self.regWrite(found)
 
         # Also ensure that the "Servers" folder exists, even if there aren't any devices identified.
         self.reg.cd([''])
@@ -83,6 +118,79 @@ class serialDeviceManager(object):
             self.reg.mkdir("Servers")
             print('Folder "Servers" does not exist in registry. Creating it.')
 
+        print(("Identifying %i new or changed port(s): %s"%(len(changed),str(changed))))
+        self.probeThread = threading.Thread(target=self.reidentify,args=(changed,fingerprints,cache))
+        self.probeThread.start()
+
+    def reidentify(self,ports,fingerprints,cache):
+        """Identifies ports, updating the registry and the fingerprint cache
+
+        Ports that answered as no known device are cached as ('',''), so they
+        are not probed again until their fingerprint changes. Ports whose
+        probe failed or timed out are left out, and probed again next time."""
+        results = self.identifyPorts(ports)
+        self.regWrite([result for result in list(results.values()) if result])
+        for port in ports:
+            if results.get(port) is False or port not in results:
+                cache.pop(port,None)
+                continue
+            serverType,deviceName,_ = results[port] or ('','',port)
+            cache[port] = (fingerprints.get(port,''),serverType,deviceName)
+        self.saveFingerprints(cache)
+
+    def identifyPorts(self,ports):
+        """Probes ports in parallel; returns {port: identifyPort(port)}
+
+        Ports whose probe raised are False. Ports that are not identified
+        within PROBE_TIMEOUT are left out.
+        """
+        results = {}
+        def probe(port):
+            try:
+                results[port] = self.identifyPort(port)
+            except Exception as e:
+                print(("Port %s could not be identified: %s"%(port,e)))
+                results[port] = False
+
+        threads = []
+        for port in ports:
+            thread = threading.Thread(target=probe, args=(port,), name=port)
+            thread.daemon = True # don't keep the manager alive for a hung port
+            thread.start()
+            threads.append(thread)
+
+        deadline = time.time() + PROBE_TIMEOUT
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+
+        for port in ports:
+            if port not in results:
+                print(("Port %s was not identified within %g s; skipping it."%(port,PROBE_TIMEOUT)))
+        print('\n')
+        return dict(results)
+
+    def loadFingerprints(self):
+        """Gets {port: (fingerprint, serverType, deviceName)} as last saved"""
+        self.reg.cd([''])
+        if not (cacheFolder in self.reg.dir()[0]):
+            return {}
+        self.reg.cd(['',cacheFolder])
+        if not (self.serialServerName in self.reg.dir()[1]):
+            return {}
+        return dict((entry[0],tuple(entry[1:])) for entry in self.reg.get(self.serialServerName))
+
+    def saveFingerprints(self,cache):
+        """Saves {port: (fingerprint, serverType, deviceName)} for the next run"""
+        self.reg.cd([''])
+        if not (cacheFolder in self.reg.dir()[0]):
+            self.reg.mkdir(cacheFolder)
+        self.reg.cd(['',cacheFolder])
+        entries = [(port,)+tuple(cache[port]) for port in sorted(cache)]
+        if entries:
+            self.reg.set(self.serialServerName,entries)
+        elif self.serialServerName in self.reg.dir()[1]:
+            self.reg.del_(self.serialServerName)
+
     def getPortDevices(self,port):
         """Gets a list of all registry entries that point to COM port 'port'"""
 
@@ -106,43 +214,63 @@ class serialDeviceManager(object):
         return regEntries
 
 
-    def regWrite(self,serverType,deviceName,port):
-        """Writes an entry in the registry linking 'port' to 'data'"""
+    def regWrite(self,found):
+        """Writes registry entries linking each identified device to its port.
+
+        found is a list of (serverType, deviceName, port). Entries are
+        read and written with one packet per server type.
+        """
 
         # If 'Servers' folder doesn't exist in registry root, make it.
         self.reg.cd([''])
-        if not ('Servers' in self.reg.dir()[0]):
+        if found and not ('Servers' in self.reg.dir()[0]):
             self.reg.mkdir('Servers')
             print('Folder "Servers" does not exist in registry. Creating it.')
 
-        # In folder "Servers," create the folder serverType if it doesn't exist.
-        self.reg.cd(['','Servers'])
-        if not (serverType in self.reg.dir()[0]):
-            self.reg.mkdir(serverType)
-            print(('Folder "%s" does not exist in "Servers." Creating it.'%serverType))
-
-        # In the server specific folder, make sure there is a folder named "Links"
-        self.reg.cd(['','Servers',serverType])
-        if not ('Links' in self.reg.dir()[0]):
-            self.reg.mkdir('Links')
-            print('Folder "Links" missing from server directory. Creating it.')
-
-        self.reg.cd(['','Servers',serverType,'Links']) # Finally, go the the pre-existing or newly created location
-        keys = self.reg.dir()[1]                       # Fetch list of existing keys
-
-        if not (deviceName in keys):                              # If this device (deviceName) doesn't have a key already, make it.
-            self.reg.set(deviceName,(self.serialServerName,port)) # Write the port info.
-            print(("Device %s of type %s not in registry. Adding it (port %s)..."%(deviceName,serverType,port)))
-
-        else:                                          # If this device already has an entry
-            existingPort = self.reg.get(deviceName)[1] # Get the port that supposedly corresponds to this device
-
-            if port == existingPort: # Device already in registry, port number agree.
-                print(("Device %s of type %s is already in the registry with port %s"%(deviceName,serverType,port)))
-
-            else: # Device already in registry, port numbers disagree.
-                print(("Device %s of type %s is already in registry. Ports disagree. (OLD:%s, NEW:%s). Overwriting..."%(deviceName,serverType,existingPort,port)))
-                self.reg.set(deviceName,(self.serialServerName,port)) # Write the port info.
+        byType = {}
+        for serverType,deviceName,port in found:
+            byType.setdefault(serverType,[]).append((deviceName,port))
+
+        for serverType in sorted(byType):
+            devices = byType[serverType]
+
+            # In folder "Servers," create the folder serverType if it doesn't exist.
+            self.reg.cd(['','Servers'])
+            if not (serverType in self.reg.dir()[0]):
+                self.reg.mkdir(serverType)
+                print(('Folder "%s" does not exist in "Servers." Creating it.'%serverType))
+
+            # In the server specific folder, make sure there is a folder named "Links"
+            self.reg.cd(['','Servers',serverType])
+            if not ('Links' in self.reg.dir()[0]):
+                self.reg.mkdir('Links')
+                print('Folder "Links" missing from server directory. Creating it.')
+
+            self.reg.cd(['','Servers',serverType,'Links']) # Finally, go the the pre-existing or newly created location
+            keys = self.reg.dir()[1]                       # Fetch list of existing keys
+
+            existing = {}                                  # Get the ports that the devices already in the registry supposedly correspond to
+            known = [deviceName for deviceName,port in devices if deviceName in keys]
+            if known:
+                p = self.reg.packet()
+                for deviceName in known:
+                    p.get(deviceName,key=deviceName)
+                ans = p.send()
+                existing = dict((deviceName,ans[deviceName][1]) for deviceName in known)
+
+            p = self.reg.packet()
+            for deviceName,port in devices:
+                if not (deviceName in existing):                       # If this device (deviceName) doesn't have a key already, make it.
+                    p.set(deviceName,(self.serialServerName,port))     # Write the port info.
+                    print(("Device %s of type %s not in registry. Adding it (port %s)..."%(deviceName,serverType,port)))
+
+                elif port == existing[deviceName]: # Device already in registry, port number agree.
+                    print(("Device %s of type %s is already in the registry with port %s"%(deviceName,serverType,port)))
+
+                else: # Device already in registry, port numbers disagree.
+                    print(("Device %s of type %s is already in registry. Ports disagree. (OLD:%s, NEW:%s). Overwriting..."%(deviceName,serverType,existing[deviceName],port)))
+                    p.set(deviceName,(self.serialServerName,port)) # Write the port info.
+            p.send()
 
         # [!!!!] ADD THIS FUNCTIONALITY
         # search for other entries linked to the same port (not including this result. This should only happen if a port changes device.)
@@ -150,69 +278,77 @@ class serialDeviceManager(object):
         # If one : prompt user - delete?
         # If many: prompt delete (a/s/n) all / selective / none
 
+    def release(self,ctx):
+        """Closes the port of a probe's serial server context and expires the context"""
+        try:
+            self.ser.close(context=ctx)
+        except Exception as e:
+            print(("Could not close the port of context %s: %s"%(ctx,e)))
+        try:
+            self.cxn.manager.expire_context(ctx)
+        except Exception as e:
+            print(("Could not expire context %s: %s"%(ctx,e)))
+
     def identifyPort(self,port):
-        """Attempts to idenfiy any given port"""
+        """Attempts to idenfiy any given port
 
-        print("")                              # 
+        Returns (serverType, deviceName, port) if it is identified, or None.
+        Uses its own serial server context, so that ports can be identified
+        in parallel.
+        """
+
+        ctx = self.cxn.context()               # this port's serial server context
         print(("Connecting to port %s..."%port)) # 
-        self.ser.open(port)                    # connect to the given port
-        time.sleep(PORT_DELAY)
+        try:
+            self.ser.open(port,context=ctx)        # connect to the given port
+            time.sleep(PORT_DELAY)
         
-        self.ser.bytesize(8)
-        self.ser.parity('N')
-        self.ser.stopbits(1)
-        self.ser.timeout(TIMEOUT)
+            self.ser.bytesize(8,context=ctx)
+            self.ser.parity('N',context=ctx)
+            self.ser.stopbits(1,context=ctx)
+            self.ser.timeout(TIMEOUT,context=ctx)
         
-        #####################
-        ## ACbox and DCbox ##
-        #####################
-        print("\tTrying device type: AC/DC box") # 
-        acdcBoxBaudrates = [115200]      # values of baudrates for this type of device
-        for rate in acdcBoxBaudrates:
-            time.sleep(IO_DELAY)
-            self.ser.baudrate(rate)                # set the baudrate
-            self.ser.write('NOP\r\n')              # 
-            time.sleep(IO_DELAY); self.ser.read_line()  # flush the interface
-            self.ser.write("*IDN?\r\n")            # query identification command
-            time.sleep(IO_DELAY)                   # delay for processing
-            response = self.ser.read_line()        # get response from device
-            if response:
-                print(("\tGot response: <%s>"%response))
-                break # if we got a non-empty response, don't try any more baudrates.
-
-        if response.startswith('DCBOX_DUAL_AD5764'):                         # For a DCBOX, the response to *IDN? will be "DCBOX_DUAL_AD5764(NAME)"
-            print(("\tPort %s identified as a DCBOX_DUAL_AD5764 device."%port))  # Print info that port has been identified
-            self.regWrite(serverNameAD5764_DCBOX,response,port)              # Write a registry entry identifying this port as corresponding to a DCBOX_DUAL_AD5764 device
-            self.ser.close() # close the port
-            return True                                                      # Returning True tells the run() function that the port has been identified.
-
-        elif response.startswith('ACBOX_DUAL_AD5764'):                       # For an ACBOX, the response to *IDN? will be "ACBOX_DUAL_AD5764(NAME)"
-            print(("\tPort %s identified as an ACBOX_DUAL_AD5764 device."%port)) # Print info that port has been identified
-            self.regWrite(serverNameAD5764_ACBOX,response,port)              # Write a registry entry identifying this port as corresponding to an ACBOX_DUAL_AD5764 device.
-            self.ser.close() # close the port
-            return True                                                      #
-
-        elif response.startswith('DCBOX_QUAD_AD5780'):
-            print(('\tPort %s identified as a DCBOX_QUAD_AD5780 device.'%port))
-            self.regWrite(serverNameAD5780_DCBOX,response,port)
-            self.ser.close() # close the port
-            return True
-
-        else:                                                                # no response
-            print(("\tPort %s cannot be identified as an AC/DC box."%port))      # or unrecognized response
-            print(("\tResponded with <%s>"%response))
-
-        time.sleep(1) # sleep 1 second between attempts to identify. This prevents flooding the port with signals too quickly.
+            #####################
+            ## ACbox and DCbox ##
+            #####################
+            print(("\t%s: Trying device type: AC/DC box"%port)) # 
+            acdcBoxBaudrates = [115200]      # values of baudrates for this type of device
+            for rate in acdcBoxBaudrates:
+                time.sleep(IO_DELAY)
+                self.ser.baudrate(rate,context=ctx)                # set the baudrate
+                self.ser.write('NOP\r\n',context=ctx)              # 
+                time.sleep(IO_DELAY); self.ser.read_line(context=ctx)  # flush the interface
+                self.ser.write("*IDN?\r\n",context=ctx)            # query identification command
+                time.sleep(IO_DELAY)                               # delay for processing
+                response = self.ser.read_line(context=ctx)         # get response from device
+                if response:
+                    print(("\t%s: Got response: <%s>"%(port,response)))
+                    break # if we got a non-empty response, don't try any more baudrates.
+
+            for prefix,serverType in [('DCBOX_DUAL_AD5764',serverNameAD5764_DCBOX),  # For a DCBOX, the response to *IDN? will be "DCBOX_DUAL_AD5764(NAME)"
+                                      ('ACBOX_DUAL_AD5764',serverNameAD5764_ACBOX),  # For an ACBOX, the response to *IDN? will be "ACBOX_DUAL_AD5764(NAME)"
+                                      ('DCBOX_QUAD_AD5780',serverNameAD5780_DCBOX)]:
+                if response.startswith(prefix):
+                    print(("\tPort %s identified as a %s device."%(port,prefix)))  # Print info that port has been identified
+                    return (serverType,response,port)                            # run() writes the registry entry identifying this port
+
+            # no response or unrecognized response
+            print(("\tPort %s cannot be identified as an AC/DC box."%port))
+            print(("\t%s: Responded with <%s>"%(port,response)))
         
-        #########################
-        ## next device type(s) ##
-        #########################
-
-        self.ser.close() # close the port       
+            #########################
+            ## next device type(s) ##
+            #########################
+            # (sleep 1 second before each further attempt to identify, so as not to flood the port with signals too quickly)
+
+            return None
+        finally:
+            self.release(ctx) # close the port, even if the probe failed
     
 
 
 if __name__ == '__main__':
     sdm = serialDeviceManager()
     sdm.run()
+    sdm.probeThread.join()
     input("Finished. Press enter to exit.")
\ No newline at end of file
@@ -30,19 +30,23 @@ message = 987654321
 timeout = 20
 ### END NODE INFO
 """
-from labrad import types as T, util
+from labrad import types as T
 from labrad.errors import Error
 from labrad.server import LabradServer, setting
 
-from twisted.internet import threads
+from twisted.internet import defer, reactor, task
 from twisted.internet.defer import inlineCallbacks, returnValue
 
 from serial.tools import list_ports
 from serial import Serial
 from serial.serialutil import SerialException
 
-from time import sleep
+from serial_capture import CaptureWriter, ReplaySerial
+
+import collections
+import os
 import sys
+import threading
 if sys.version_info > (3,):
     long = int
 
@@ -57,15 +61,403 @@ class NoPortsAvailableError(Error):
     code = 3
 
 
+class UnknownPortError(Error):
+    """That port has not been opened since the server started."""
+    code = 5
+
+
+class StaleRequestError(Error):
+    """The request waited for the port for longer than its deadline."""
+    code = 6
+
+
+class CaptureFileError(Error):
+    """A capture file could not be written or replayed."""
+    code = 4
+
+
+EXTRA_PORTS_ENV = 'SERIAL_SERVER_EXTRA_PORTS' # more ports to offer, e.g. simulators
+
+READ_WAIT = 0.1 # how long a reader thread blocks before checking if it should stop
+LATENCY_SAMPLES = 1000 # recent reads whose latency is kept for percentiles
+
+
+def fingerprint(info):
+    """Identifies the adapter behind a port, from its list_ports entry.
+
+    USB adapters give 'VID:PID:serial number', with the USB location
+    instead of a serial number for adapters that have none.  Other ports
+    give their hardware ID.
+    """
+    if getattr(info, 'vid', None) is None:
+        return info[2]
+    return '{:04X}:{:04X}:{}'.format(info.vid, info.pid,
+                                     info.serial_number or info.location)
+
+
+class PortStats(object):
+    """Traffic on one port, kept for the life of the server.
+
+    A transaction is one read, from when it is asked for (for Query, just
+    after the write) until it completes or times out.
+    """
+
+    def __init__(self, reactor=reactor):
+        self.reactor = reactor
+        self.started = reactor.seconds()
+        self.ser = None # the port object opened last, for its baud rate
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.transactions = 0
+        self.timeouts = 0
+        self.opens = 0
+        self.reopens = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def transaction(self, result, start):
+        self.transactions += 1
+        self.latencies.append(self.reactor.seconds() - start)
+        return result
+
+    def stats(self):
+        """(name, value) pairs; latencies are in seconds."""
+        elapsed = max(self.reactor.seconds() - self.started, 1e-9)
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(int(p / 100.0 * len(latencies)), len(latencies) - 1)]
+        # a byte on the wire takes about 10 bit times with start and stop bits
+        baudrate = getattr(self.ser, 'baudrate', 0)
+        busy = 10.0 * (self.bytes_in + self.bytes_out) / baudrate / elapsed if baudrate else 0.0
+        return [
+            ('bytes in', self.bytes_in),
+            ('bytes out', self.bytes_out),
+            ('transactions', self.transactions),
+            ('timeouts', self.timeouts),
+            ('opens', self.opens),
+            ('reopens', self.reopens),
+            ('latency p50', percentile(50)),
+            ('latency p90', percentile(90)),
+            ('latency p99', percentile(99)),
+            ('latency max', latencies[-1] if latencies else 0.0),
+            ('line busy fraction', busy),
+            ('seconds', elapsed),
+        ]
+
+
+CONTROL, COMMAND, TELEMETRY = range(3)
+PRIORITIES = {'control': CONTROL, 'command': COMMAND, 'telemetry': TELEMETRY}
+
+
+class PortQueue(object):
+    """Gives contexts sharing a port turns to use it, by priority.
+
+    A turn is one transaction, such as the write and read of a Query.
+    Waiting requests are served highest priority first, and first in,
+    first out within a priority; there is no separate round robin.
+    LabRAD runs a context's requests one at a time, so a context has at
+    most one request waiting and the FIFO order already takes turns
+    between the contexts of a priority.  A request that waits longer
+    than its deadline fails with StaleRequestError instead.
+    """
+
+    def __init__(self, reactor=reactor):
+        self.reactor = reactor
+        self.busy = False
+        self._waiting = [collections.deque() for _ in PRIORITIES]
+
+    def acquire(self, priority=COMMAND, deadline=0):
+        """Wait for a turn; deadline is in seconds, 0 for none."""
+        if not self.busy:
+            self.busy = True
+            return defer.succeed(None)
+        waiter = [defer.Deferred(), None]
+        if deadline > 0:
+            waiter[1] = self.reactor.callLater(deadline, self._expire, priority, waiter)
+        self._waiting[priority].append(waiter)
+        return waiter[0]
+
+    def release(self):
+        for waiting in self._waiting:
+            if waiting:
+                d, call = waiting.popleft()
+                if call is not None:
+                    call.cancel()
+                d.callback(None)
+                return
+        self.busy = False
+
+    def _expire(self, priority, waiter):
+        self._waiting[priority].remove(waiter)
+        waiter[0].errback(StaleRequestError())
+
+
+class PortReader(object):
+    """Moves bytes from a serial port into a buffer as soon as they arrive.
+
+    A daemon thread blocks in ser.read and hands each chunk over to the
+    reactor thread, which serves reads from the buffer.  A read that is
+    waiting for a delimiter or byte count completes on the chunk that
+    satisfies it, with no polling.  Apart from the thread itself,
+    everything here runs on the reactor thread, which never waits for the
+    thread: each thread has its own stop event, and a thread started by
+    reopen waits for the previous one to exit before it touches the port.
+    Writes and the reopen share a lock, so a write never reaches a port
+    that is being closed and opened again.
+    """
+
+    def __init__(self, ser, stats=None, reactor=reactor):
+        self.ser = ser
+        self.reactor = reactor
+        self.buffer = bytearray()
+        self.capture = None # CaptureWriter recording the port's traffic
+        self.stats = stats if stats is not None else PortStats(reactor)
+        self.stats.ser = ser
+        self.stats.opens += 1
+        self.queue = PortQueue(reactor)
+        self.users = 0 # contexts that have the port open
+        self._waiters = collections.deque() # [deferred, extract, onTimeout, timeoutCall]
+        self._portLock = threading.Lock() # held while writing to or reopening the port
+        self._thread = None
+        self._stopped = None # stop event of the current thread
+        self.ser.timeout = READ_WAIT
+        self.start()
+
+    def start(self, previous=None):
+        """Start a reader thread; if previous is given, reopen the port once it exits."""
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stopped, previous),
+                                        name='Serial reader ' + self.ser.portstr)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Tell the reader thread to stop; it exits within READ_WAIT."""
+        self._stopped.set()
+        if hasattr(self.ser, 'cancel_read'):
+            try:
+                self.ser.cancel_read()
+            except Exception:
+                pass
+
+    def reopen(self):
+        """Close and reopen the port, e.g. after it stopped responding.
+
+        The port is reopened by a new reader thread once the current one
+        has exited, so this returns at once.
+        """
+        self.stats.reopens += 1
+        self.stop()
+        self.start(self._thread)
+
+    def write(self, data):
+        """Write bytes to the port, recording them if capturing."""
+        self.stats.bytes_out += len(data)
+        if self.capture is not None:
+            self.capture.tx(data)
+        with self._portLock:
+            self.ser.write(data)
+
+    def close(self):
+        self.stop()
+        with self._portLock:
+            self.ser.close()
+        self._finishAll()
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    def _run(self, stopped, previous):
+        ser = self.ser
+        if previous is not None:
+            previous.join()
+            try:
+                with self._portLock:
+                    if stopped.is_set():
+                        return
+                    ser.close()
+                    ser.open()
+            except Exception as e:
+                self.reactor.callFromThread(self._failed, stopped, e)
+                return
+        while not stopped.is_set():
+            try:
+                data = ser.read(max(ser.in_waiting, 1))
+            except Exception as e:
+                # closed under us, or the adapter was unplugged
+                if not stopped.is_set():
+                    self.reactor.callFromThread(self._failed, stopped, e)
+                return
+            if data:
+                self.reactor.callFromThread(self._received, data)
+
+    def _received(self, data):
+        self.stats.bytes_in += len(data)
+        if self.capture is not None:
+            self.capture.rx(data)
+        self.buffer += data
+        self._serve()
+
+    def _failed(self, stopped, e):
+        if stopped is not self._stopped:
+            return # an old thread; the port has been reopened since
+        print('Error reading from {}: {}'.format(self.ser.portstr, e))
+        stopped.set()
+        self._finishAll()
+
+    def _serve(self):
+        while self._waiters:
+            d, extract, onTimeout, call = self._waiters[0]
+            result = extract(self.buffer)
+            if result is None:
+                return
+            self._waiters.popleft()
+            call.cancel()
+            d.callback(result)
+
+    def _timedOut(self, waiter):
+        self.stats.timeouts += 1
+        if waiter is not self._waiters[0]:
+            # what is buffered belongs to the reads ahead of this one
+            self._waiters.remove(waiter)
+            waiter[0].callback(waiter[2](bytearray()))
+            return
+        self._waiters.popleft()
+        waiter[0].callback(waiter[2](self.buffer))
+        self._serve()
+
+    def _finishAll(self):
+        """Complete every waiting read with what has been received."""
+        while self._waiters:
+            d, extract, onTimeout, call = self._waiters.popleft()
+            if call.active():
+                call.cancel()
+            d.callback(onTimeout(self.buffer))
+
+    def read(self, extract, onTimeout, timeout):
+        """Wait until extract(buffer) returns something other than None.
+
+        extract removes what it returns from the buffer.  If that has not
+        happened within timeout seconds, fire with onTimeout(buffer)
+        instead.  Reads complete in the order they were made, and only the
+        first one in line takes from the buffer, so a later read that times
+        out gets onTimeout of an empty buffer.
+        """
+        start = self.reactor.seconds()
+        if not self._waiters:
+            result = extract(self.buffer)
+            if result is None and timeout <= 0:
+                result = onTimeout(self.buffer)
+            if result is not None:
+                return defer.succeed(self.stats.transaction(result, start))
+        waiter = [defer.Deferred(), extract, onTimeout, None]
+        waiter[3] = self.reactor.callLater(timeout, self._timedOut, waiter)
+        self._waiters.append(waiter)
+        return waiter[0].addCallback(self.stats.transaction, start)
+
+    def take(self, count=None):
+        """Remove and return up to count buffered bytes (all if None)."""
+        return _take(self.buffer, count)
+
+    def readCount(self, count, timeout):
+        """Read count bytes; on timeout, whatever has arrived."""
+        def extract(buf):
+            return _take(buf, count) if len(buf) >= count else None
+        return self.read(extract, _take, timeout)
+
+    def readUntil(self, delim, timeout):
+        """Read up to and not including delim, which is removed.
+
+        On timeout, return whatever has arrived.
+        """
+        searched = [0] # delim is not in buf[:searched]
+        def extract(buf):
+            end = buf.find(delim, searched[0])
+            if end < 0:
+                searched[0] = max(len(buf) - len(delim) + 1, 0)
+                return None
+            recd = _take(buf, end)
+            del buf[:len(delim)]
+            return recd
+        return self.read(extract, _take, timeout)
+
+    def readThrough(self, delim, extra, timeout):
+        """Read up to and including delim and the extra bytes after it.
+
+        For replies that end in a checksum after a separator.  On timeout,
+        return whatever has arrived.
+        """
+        searched = [0] # delim is not in buf[:searched]
+        def extract(buf):
+            end = buf.find(delim, searched[0])
+            if end < 0:
+                searched[0] = max(len(buf) - len(delim) + 1, 0)
+                return None
+            end += len(delim) + extra
+            return _take(buf, end) if len(buf) >= end else None
+        return self.read(extract, _take, timeout)
+
+    def readFrame(self, sync, offset, adjust, timeout):
+        """Read one length-prefixed frame, including its sync bytes.
+
+        A frame starts with sync, and the byte offset bytes after its start
+        holds the length of the whole frame, less adjust.  Bytes before the
+        sync are dropped.  On timeout, return whatever has arrived.
+        """
+        def extract(buf):
+            while True:
+                start = buf.find(sync)
+                if start < 0:
+                    del buf[:max(len(buf) - len(sync) + 1, 0)]
+                    return None
+                del buf[:start]
+                if len(buf) <= offset:
+                    return None
+                length = buf[offset] + adjust
+                if length > offset:
+                    break
+                del buf[:1] # not a frame; look for the next sync
+            if len(buf) < length:
+                return None
+            return _take(buf, length)
+        return self.read(extract, _take, timeout)
+
+    def clear(self):
+        del self.buffer[:]
+
+
+def _decode(recd):
+    try:
+        return recd.decode("utf-8")
+    except UnicodeDecodeError: # Sometimes there is a non unicode character
+        #recd = recd.decode("utf-8", 'ignore') # ignore the character, will cause problems if anything is caldulated from string length
+        return recd.decode("utf-8", 'replace') # Replace the problem character with an error character
+        #recd = recd.decode("cp1252") # Will decode non-unicode characters which may not interact well with other code.
+
+
+def _take(buf, count=None):
+    if count is None:
+        count = len(buf)
+    recd = bytes(buf[:count])
+    del buf[:count]
+    return recd
+
+
 class SerialServer(LabradServer):
     """Provides access to a computer's serial (COM) ports."""
     name = '%LABRADNODE% Serial Server'
 
     def initServer(self):
+        self.portStats = {} # port name: PortStats
+        self.readers = {} # port name: PortReader, of each open port
+        self.statsLog = None
         print('Searching for COM ports:')
         self.SerialPorts = []
+        self.fingerprints = {} # port name: fingerprint
         ports = list_ports.comports()
-        for name, description, hardware in ports:
+        for info in ports:
+            name, description, hardware = info
             # make sure the discovered ports can be opened
             try:
                 ser = Serial(name, dsrdtr = True) # dsrdtr=True to prevent hardware from pulsing on startup
@@ -73,14 +465,18 @@ class SerialServer(LabradServer):
             except SerialException as e:
                 pass
             else:
+                self.SerialPorts += [name]
+                self.fingerprints[name] = fingerprint(info)
+                print(name)
+        for name in os.environ.get(EXTRA_PORTS_ENV, '').split(os.pathsep):
+            if name:
                 self.SerialPorts += [name]
                 print(name)
         if not len(self.SerialPorts):
             print('  none')
 
     def expireContext(self, c):
-        if 'PortObject' in c:
-            c['PortObject'].close()
+        self.closePort(c)
 
     def getPort(self, c):
         try:
@@ -88,6 +484,57 @@ class SerialServer(LabradServer):
         except Exception as e:
             raise NoPortSelectedError()
 
+    def getReader(self, c):
+        """The PortReader that receives everything on this context's port."""
+        self.getPort(c)
+        return c['PortReader']
+
+    def closePort(self, c):
+        """Leave the context's port, closing it if no other context uses it."""
+        if 'PortObject' in c:
+            ser = c.pop('PortObject')
+            reader = c.pop('PortReader')
+            reader.users -= 1
+            if reader.users > 0:
+                return
+            reader.close()
+            del self.readers[ser.portstr]
+            if getattr(ser, 'mismatches', 0):
+                print('{}: {} writes did not match the capture'.format(
+                      ser.portstr, ser.mismatches))
+
+    @inlineCallbacks
+    def acquire(self, c):
+        """Wait for this context's turn on its port; returns its PortReader.
+
+        Call reader.queue.release() when the transaction is done.
+        """
+        reader = self.getReader(c)
+        yield reader.queue.acquire(c.get('Priority', COMMAND), c.get('Deadline', 0))
+        returnValue(reader)
+
+    def send(self, c, data):
+        """Write bytes to the port, recording them if capturing."""
+        self.getReader(c).write(data)
+
+    def startReader(self, c):
+        ser = c['PortObject']
+        if ser.portstr not in self.portStats:
+            self.portStats[ser.portstr] = PortStats()
+        self.readers[ser.portstr] = PortReader(ser, self.portStats[ser.portstr])
+        self.attach(c, ser.portstr)
+
+    def attach(self, c, port):
+        """Use a port that is already open, sharing it with other contexts."""
+        reader = self.readers[port]
+        reader.users += 1
+        c['PortObject'] = reader.ser
+        c['PortReader'] = reader
+
+    def logStats(self):
+        for port, stats in sorted(self.portStats.items()):
+            print(port + ': ' + ', '.join('{} {:.4g}'.format(k, v) for k, v in stats.stats()))
+
     @setting(1, 'List Serial Ports',
                 returns=['*s: List of serial ports'])
     def list_serial_ports(self, c):
@@ -99,18 +546,36 @@ class SerialServer(LabradServer):
         """
         return self.SerialPorts
 
+    @setting(2, 'Port Fingerprints',
+                returns=['*(ss): (port, fingerprint) for each serial port'])
+    def port_fingerprints(self, c):
+        """Identifies the adapter behind each serial port.
+
+        A fingerprint, such as a USB adapter's VID, PID and serial number,
+        stays the same as long as the same adapter is on the port.  It is
+        empty for ports that cannot be fingerprinted.
+        """
+        return [(port, self.fingerprints.get(port, '')) for port in self.SerialPorts]
+
     @setting(10, 'Open',
                  port=[': Open the first available port',
                        's: Port to open, e.g. COM4'], DTR = 'b',
                  returns=['s: Opened port'])
     def open(self, c, port=0, DTR=None):
-        """Opens a serial port in the current context."""
+        """Opens a serial port in the current context.
+
+        A port that another context already has open is shared with it;
+        see Priority for how the contexts take turns.
+        """
         c['Timeout'] = 0
-        if 'PortObject' in c:
-            c['PortObject'].close()
-            del c['PortObject']
+        self.closePort(c)
+        if port in self.readers:
+            self.attach(c, port)
+            return port
         if port == 0:
             for i in range(len(self.SerialPorts)):
+                if self.SerialPorts[i] in self.readers:
+                    continue
                 try:
                     c['PortObject'] = Serial(self.SerialPorts[i], timeout=0, dsrdtr=DTR) # Be careful setting dsrdtr=True
                     break
@@ -128,20 +593,23 @@ class SerialServer(LabradServer):
                     raise Error(code=1, msg=e.message)
                 else:
                     raise Error(code=2, msg=e.message)
+        self.startReader(c)
         return c['PortObject'].portstr
 
     @setting(11, 'Close', returns=[''])
     def close(self, c):
         """Closes the current serial port."""
-        if 'PortObject' in c:
-            c['PortObject'].close()
-            del c['PortObject']
+        self.closePort(c)
 
     @setting(12, 'flushInput', returns=[''])
     def flushinput(self, c):
         """Flushes the Input Buffer of the current serial port."""
-        ser = self.getPort(c)
-        ser.flushInput()
+        reader = yield self.acquire(c)
+        try:
+            reader.ser.flushInput()
+            reader.clear()
+        finally:
+            reader.queue.release()
 
     @setting(13, 'flushOutput', returns=[''])
     def flushoutput(self, c):
@@ -149,6 +617,27 @@ class SerialServer(LabradServer):
         ser = self.getPort(c)
         ser.flushOutput()
 
+    @setting(14, 'Open Replay', filename='s', speed='v',
+                 returns=['s: Opened port'])
+    def open_replay(self, c, filename, speed=1.0):
+        """Opens a port that plays back a capture file instead of a device.
+
+        Each write is matched against the next bytes sent in the capture,
+        and the bytes that were received after them are served with their
+        recorded delays divided by speed (0: serve them at once).
+        """
+        c['Timeout'] = 0
+        self.closePort(c)
+        if 'replay:' + filename in self.readers:
+            self.attach(c, 'replay:' + filename)
+            return 'replay:' + filename
+        try:
+            c['PortObject'] = ReplaySerial(filename, speed)
+        except (IOError, ValueError) as e:
+            raise CaptureFileError(msg=str(e))
+        self.startReader(c)
+        return c['PortObject'].portstr
+
     @setting(20, 'Baudrate',
                  data=[': Selected baudrate', 'i: Set baudrate'],
                  returns=['i: Selected baudrate'])
@@ -234,70 +723,122 @@ class SerialServer(LabradServer):
         ser.dtr = int(data)
         return data
 
+    @setting(35, 'Capture',
+                 filename=[': Stop capturing',
+                           's: File to record to'],
+                 returns=['s: File being recorded to (empty: none)'])
+    def capture(self, c, filename=None):
+        """Records everything sent and received on the port, with timestamps.
+
+        Starting a capture ends any earlier one in this context.  Open
+        Replay plays the file back; serial_capture.py describes its format.
+        """
+        reader = self.getReader(c)
+        if reader.capture is not None:
+            reader.capture.close()
+            reader.capture = None
+        if filename:
+            try:
+                reader.capture = CaptureWriter(filename)
+            except IOError as e:
+                raise CaptureFileError(msg=str(e))
+        return filename or ''
+
+    @setting(36, 'Statistics',
+                 port=[": This context's port",
+                       's: Port name'],
+                 returns=['*(sv): (name, value) pairs'])
+    def statistics(self, c, port=None):
+        """Returns traffic statistics for a port since the server started.
+
+        Bytes in and out, transactions (reads, including those of Query),
+        timeouts, opens and reopens after a timed-out read; the 50th, 90th
+        and 99th percentile and maximum latency of recent transactions, in
+        seconds; and the fraction of the time the line was busy at its
+        current baud rate.
+        """
+        if port is None:
+            port = self.getPort(c).portstr
+        if port not in self.portStats:
+            raise UnknownPortError()
+        return [(k, float(v)) for k, v in self.portStats[port].stats()]
+
+    @setting(37, 'Log Statistics',
+                 interval=[': Stop logging',
+                           'v[s]: Print statistics of every port this often'],
+                 returns=[''])
+    def log_statistics(self, c, interval=None):
+        """Periodically prints the statistics of every port used so far."""
+        if self.statsLog is not None and self.statsLog.running:
+            self.statsLog.stop()
+        self.statsLog = None
+        if interval is not None and interval['s'] > 0:
+            self.statsLog = task.LoopingCall(self.logStats)
+            self.statsLog.start(interval['s'], now=False)
+
+    @setting(38, 'Priority',
+                 priority=['s: control, command or telemetry'],
+                 deadline=['v[s]: Fail requests that wait longer than this for the port (0: never)'],
+                 returns=['s: Priority of this context'])
+    def priority(self, c, priority, deadline=None):
+        """Sets the priority of this context's requests on a shared port.
+
+        When contexts share a port, waiting control requests go before
+        command requests, which go before telemetry; requests of the same
+        priority are served in the order they arrived.  Contexts are
+        command priority, with no deadline, until this is called.  Giving
+        telemetry a deadline drops stale reads when the port is saturated,
+        rather than letting them queue.
+        """
+        if priority not in PRIORITIES:
+            raise Error(msg='priority must be one of ' + ', '.join(sorted(PRIORITIES)))
+        c['Priority'] = PRIORITIES[priority]
+        if deadline is not None:
+            c['Deadline'] = deadline['s']
+        return priority
+
     @setting(40, 'Write',
                  data=['s: Data to send',
                        '*w: Byte-data to send'],
                  returns=['w: Bytes sent'])
     def write(self, c, data):
         """Sends data over the port."""
-        ser = self.getPort(c)
-        data = data.encode("latin-1")
-        if isinstance(data, list):
-            data = ''.join(chr(x & 255) for x in data)
-        ser.write(data)
-        return long(len(data))
+        reader = yield self.acquire(c)
+        try:
+            data = data.encode("latin-1")
+            if isinstance(data, list):
+                data = ''.join(chr(x & 255) for x in data)
+            self.send(c, data)
+        finally:
+            reader.queue.release()
+        returnValue(long(len(data)))
 
     @setting(41, 'Write Line', data=['s: Data to send'],
              returns=['w: Bytes sent'])
     def write_line(self, c, data):
         """Sends data over the port appending CR LF."""
-        ser = self.getPort(c)
-        data = data.encode("latin-1")
-        ser.write(data + '\r\n')
-        return long(len(data)+2)
-
-    @inlineCallbacks
-    def deferredRead(self, ser, timeout, count=1):
-        killit = False
-
-        def doRead(count):
-            d = b''
-            while not killit:
-                d = ser.read(count)
-                if d:
-                    break
-                sleep(0.010)
-            return d
-        data = threads.deferToThread(doRead, count)
-        r = yield util.maybeTimeout(data, min(timeout, 300), b'')
-        killit = True
-
-        if r == b'':
-            r = ser.read(count)
-
-        returnValue(r)
+        reader = yield self.acquire(c)
+        try:
+            data = data.encode("latin-1")
+            self.send(c, data + b'\r\n')
+        finally:
+            reader.queue.release()
+        returnValue(long(len(data)+2))
 
     @inlineCallbacks
     def readSome(self, c, count=0):
-        ser = self.getPort(c)
-
-        if count == 0:
-            returnValue(ser.read(10000))
-
-        timeout = c['Timeout']
-        if timeout == 0:
-            returnValue(ser.read(count))
-
-        recd = b''
-        while len(recd) < count:
-            r = ser.read(count - len(recd))
-            if r == b'':
-                r = yield self.deferredRead(ser, timeout, count - len(recd))
-                if r == b'':
-                    ser.close()
-                    ser.open()
-                    break
-            recd += r
+        reader = yield self.acquire(c)
+        try:
+            if count == 0:
+                returnValue(reader.take())
+
+            timeout = min(c['Timeout'], 300)
+            recd = yield reader.readCount(count, timeout)
+            if timeout > 0 and len(recd) < count:
+                # timed out; the port may have hung, so reset it
+                reader.reopen()
+        finally:
+            reader.queue.release()
         returnValue(recd)
 
     @setting(50, 'Read', count=[': Read all bytes in buffer',
@@ -330,33 +871,22 @@ class SerialServer(LabradServer):
                  returns=['s: Received data'])
     def read_line(self, c, data=''):
         """Reads data from the port, up to but not including the specified delimiter."""
-        ser = self.getPort(c)
-        timeout = c['Timeout']
+        timeout = min(c['Timeout'], 300)
 
         if data:
-            delim, skip = data, b''
+            delim, skip = data.encode("latin-1"), b''
 
         else:
             delim, skip = b'\n', b'\r'
 
-        recd = b''
-        while True:
-            r = ser.read(1)
-            if r == b'' and timeout > 0:
-                # only try a deferred read if there is a timeout
-                r = yield self.deferredRead(ser, timeout)
-            if r in (b'', delim):
-                break
-            if r != skip:
-                recd += r
-        if not isinstance(recd, str):
-            try:
-                recd = recd.decode("utf-8")
-            except UnicodeDecodeError: # Sometimes there is a non unicode character
-                #recd = recd.decode("utf-8", 'ignore') # ignore the character, will cause problems if anything is caldulated from string length
-                recd = recd.decode("utf-8", 'replace') # Replace the problem character with an error character
-                #recd = recd.decode("cp1252") # Will decode non-unicode characters which may not interact well with other code.
-        returnValue(recd)
+        reader = yield self.acquire(c)
+        try:
+            recd = yield reader.readUntil(delim, timeout)
+        finally:
+            reader.queue.release()
+        if skip:
+            recd = recd.replace(skip, b'')
+        returnValue(_decode(recd))
 
     @setting(53, 'In Waiting',
              returns=['w: Bytes in input buffer'])
@@ -364,7 +894,8 @@ class SerialServer(LabradServer):
         """Returns the number of bytes in the input buffer."""
         ser = self.getPort(c)
         #ans = ser.inWaiting() # Syntax deprecated in v3.0 of pyserial
-        ans = ser.in_waiting
+        # received bytes are moved into the reader's buffer as they arrive
+        ans = ser.in_waiting + len(self.getReader(c).buffer)
         return ans
 
     @setting(54, 'Reset Input Buffer')
@@ -372,8 +903,12 @@ class SerialServer(LabradServer):
         """
         Flush input buffer, discarding all it's contents.
         """
-        ser = self.getPort(c)
-        ser.reset_input_buffer()
+        reader = yield self.acquire(c)
+        try:
+            reader.ser.reset_input_buffer()
+            reader.clear()
+        finally:
+            reader.queue.release()
 
     @setting(55, 'readByte', count=[': Read some number of bytes and return as bytes',
                                 'w: Read this many bytes'],
@@ -386,8 +921,11 @@ class SerialServer(LabradServer):
     @setting(56, 'readBuffer', returns=['?: Received data'])
     def readBuffer(self, c):
         """Reads all the data from the input buffer."""
-        ser = self.getPort(c)
-        recd = ser.read(ser.in_waiting)
+        reader = yield self.acquire(c)
+        try:
+            recd = reader.take()
+        finally:
+            reader.queue.release()
         if not isinstance(recd, str):
             try:
                 recd = recd.decode("utf-8")
@@ -395,7 +933,75 @@ class SerialServer(LabradServer):
                 print("Error: Unicode decoding error: ",recd)
                 print("Byte ignored to not crash the process.")
                 recd = recd.decode("utf-8","ignore")
-        return recd
+        returnValue(recd)
+
+    @setting(60, 'Query',
+                 data=['s: Data to send'],
+                 until=['s: Read until this delimiter (empty: LF, ignoring CRs)',
+                        'w: Read this many bytes',
+                        '(swi): Read one frame: (sync, length offset, length adjust)',
+                        '(sw): Read through this delimiter and this many bytes after it'],
+                 timeout=['v[s]: Time to wait for the reply (max: 5min)'],
+                 returns=['s: Received data'])
+    def query(self, c, data, until='', timeout=None):
+        """Sends data and reads the reply in one request.
+
+        The reply is read as by Read Line, as by Read with a byte count, as
+        one length-prefixed frame, or through a delimiter and a fixed number
+        of bytes after it, such as a checksum.  A frame starts with the sync
+        string, and the byte at the length offset from its start holds the
+        length of the whole frame less the length adjust; bytes before the
+        sync are dropped.  If the reply is not complete within the timeout, which
+        defaults to the one set for this context, returns whatever has
+        arrived.  No other context can use the port between the write and
+        the read.
+        """
+        recd = yield self.queryRaw(c, data, until, timeout)
+        returnValue(_decode(recd))
+
+    @setting(61, 'Query Bytes',
+                 data=['s: Data to send'],
+                 until=['s: Read until this delimiter (empty: LF, ignoring CRs)',
+                        'w: Read this many bytes',
+                        '(swi): Read one frame: (sync, length offset, length adjust)',
+                        '(sw): Read through this delimiter and this many bytes after it'],
+                 timeout=['v[s]: Time to wait for the reply (max: 5min)'],
+                 returns=['y: Received data as bytes'])
+    def query_bytes(self, c, data, until='', timeout=None):
+        """Same as Query, but returns the reply as bytes, without decoding it.
+
+        Use this for binary replies, such as frames with a checksum, where
+        a byte that is not valid utf-8 must not be replaced.
+        """
+        recd = yield self.queryRaw(c, data, until, timeout)
+        returnValue(recd)
+
+    @inlineCallbacks
+    def queryRaw(self, c, data, until, timeout):
+        if timeout is None:
+            timeout = c['Timeout']
+        else:
+            timeout = min(timeout['s'], 300)
+
+        reader = yield self.acquire(c)
+        try:
+            self.send(c, data.encode("latin-1"))
+            if until == '':
+                recd = yield reader.readUntil(b'\n', timeout)
+                recd = recd.replace(b'\r', b'')
+            elif isinstance(until, str):
+                recd = yield reader.readUntil(until.encode("latin-1"), timeout)
+            elif isinstance(until, tuple) and len(until) == 2:
+                delim, extra = until
+                recd = yield reader.readThrough(delim.encode("latin-1"), extra, timeout)
+            elif isinstance(until, tuple):
+                sync, offset, adjust = until
+                recd = yield reader.readFrame(sync.encode("latin-1"), offset, adjust, timeout)
+            else:
+                recd = yield reader.readCount(until, timeout)
+        finally:
+            reader.queue.release()
+        returnValue(recd)
 
 
 __server__ = SerialServer()
@@ -0,0 +1,23 @@
+"""Simulated serial instruments, for running the servers without hardware.
+
+Each simulator answers on a Linux pseudo-terminal in its instrument's own
+protocol, so the whole chain of serial server, device server and
+EquipmentHandler can be run and load tested on one machine:
+
+    python -m simulators ftm tdk rvc relay shutter --latency 0.02 --noise 0.01
+
+This prints the pseudo-terminal of each simulator.  Start the serial
+server with those paths in SERIAL_SERVER_EXTRA_PORTS (separated by
+os.pathsep), and point the device servers' registry links at them.  Use
+--links to get fixed names for the registry, as symlinks to the
+pseudo-terminals.
+"""
+
+from .pty_device import PtyDevice
+from .ftm import FTM2400
+from .tdk import GEN10240
+from .rvc import RVC300
+from .relay import StepperShutter, ValveRelay
+
+SIMULATORS = dict((cls.name, cls) for cls in
+                  (FTM2400, GEN10240, RVC300, ValveRelay, StepperShutter))
@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+import time
+
+from . import SIMULATORS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m simulators',
+        description='Run simulated serial instruments on pseudo-terminals.')
+    parser.add_argument('devices', nargs='+', choices=sorted(SIMULATORS),
+                        help='instruments to simulate')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds each reply takes (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many more seconds per reply (default: 0)')
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help='relative noise on simulated readings (default: 0)')
+    parser.add_argument('--junk', type=float, default=0.0,
+                        help='chance of a stray byte in a reply (default: 0)')
+    parser.add_argument('--corrupt', type=float, default=0.0,
+                        help='chance of a corrupted byte in a reply (default: 0)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed, for repeatable noise')
+    parser.add_argument('--links', default=None,
+                        help='directory in which to symlink each device by name')
+    args = parser.parse_args(argv)
+
+    options = dict(latency=args.latency, jitter=args.jitter, noise=args.noise,
+                   junk=args.junk, corrupt=args.corrupt, seed=args.seed)
+    devices = [SIMULATORS[name](**options).start() for name in args.devices]
+    ports = []
+    for device in devices:
+        port = device.port
+        if args.links:
+            port = os.path.join(args.links, device.name)
+            if os.path.lexists(port):
+                os.remove(port)
+            os.symlink(device.port, port)
+        print('{}: {}'.format(device.name, port))
+        ports.append(port)
+    print('SERIAL_SERVER_EXTRA_PORTS={}'.format(os.pathsep.join(ports)))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for device in devices:
+        device.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
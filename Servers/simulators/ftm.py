@@ -0,0 +1,142 @@
+"""Simulated FTM-2400 deposition monitor.
+
+Requests and replies are frames with a CRC, as built and checked by
+FTM_2400.py.  Depositing at rate A/s while the shutter is open (U1)
+builds up thickness and lowers the crystal frequency.
+"""
+
+import time
+
+from .pty_device import PtyDevice
+
+FREQUENCY = 6.0e6 # Hz, of a fresh crystal
+HZ_PER_KA = 200.0 # frequency drop per kA deposited
+LIFE_KA = 500.0 # thickness at which the crystal is used up
+
+
+def crc(data):
+    """The FTM-2400 CRC of data, as the two characters that follow it."""
+    value = 0x3fff
+    for b in data:
+        value ^= b
+        for _ in range(8):
+            lsb = value & 0x1
+            value >>= 1
+            if lsb:
+                value ^= 0x2001
+        value &= 0x3fff
+    return bytes([(value & 0x7f) + 34, ((value >> 7) & 0x7f) + 34])
+
+
+def frame(status, data=''):
+    """A reply frame: sync, length, status, data and CRC."""
+    body = (chr(len(status + data) + 35) + status + data).encode('latin-1')
+    return b'!' + body + crc(body)
+
+
+class FTM2400(PtyDevice):
+    """FTM-2400 with channels sensors, all seeing the same deposition."""
+
+    name = 'ftm'
+
+    def __init__(self, rate=1.0, channels=2, **kw):
+        PtyDevice.__init__(self, **kw)
+        self.rate = rate
+        self.channels = channels
+        self.deposited = 0.0 # A, over the crystal's life
+        self.reset()
+
+    def reset(self):
+        """Return to the power-up state, as the Z command does."""
+        self.shutter = False
+        self.film = 1
+        self.thickness = 0.0 # A, since the last zero
+        self.zero_time = self.last = time.monotonic()
+
+    def split(self, buf):
+        while True:
+            start = buf.find(b'!')
+            if start < 0:
+                del buf[:]
+                return None
+            del buf[:start]
+            if len(buf) < 2:
+                return None
+            length = buf[1] - 30 # sync, length byte, command and CRC
+            if length >= 4:
+                break
+            del buf[:1] # not a frame; look for the next sync
+        if len(buf) < length:
+            return None
+        request = bytes(buf[:length])
+        del buf[:length]
+        return request
+
+    def _advance(self):
+        now = time.monotonic()
+        if self.shutter:
+            self.thickness += self.rate * (now - self.last)
+            self.deposited += self.rate * (now - self.last)
+        self.last = now
+
+    def handle(self, request):
+        if crc(request[1:-2]) != request[-2:]:
+            return # the real unit ignores frames with a bad CRC
+        command = request[2:-2].decode('latin-1')
+        self._advance()
+        try:
+            reply = self.reply(command)
+        except ValueError:
+            self.send(frame('D')) # problem with the data in the command
+            return
+        if reply is None:
+            self.send(frame('C')) # invalid command
+        else:
+            self.send(frame('A', reply))
+
+    def reply(self, command):
+        """The data answering command, or None if it is not understood."""
+        code, arg = command[:1], command[1:]
+        rate = self.rate if self.shutter else 0.0
+        frequency = FREQUENCY - HZ_PER_KA * self.deposited / 1e3
+        if code == '@':
+            return 'FTM-2400 SIM 1.00'
+        elif code == 'J':
+            return str(self.channels)
+        elif code == 'L':
+            return '%.2f' % self.measure(rate) if rate else '0.00'
+        elif code in ('N', 'O'):
+            return '%.4f' % (self.thickness / 1e3)
+        elif code == 'P':
+            return '%.3f' % frequency
+        elif code == 'R':
+            return '%.1f' % max(0.0, 100 * (1 - self.deposited / 1e3 / LIFE_KA))
+        elif code == 'S':
+            self.thickness = 0.0
+            return ''
+        elif code == 'T':
+            self.zero_time = time.monotonic()
+            return ''
+        elif code == 'U':
+            if arg == '?':
+                return '1' if self.shutter else '0'
+            self.shutter = arg == '1'
+            return ''
+        elif code == 'W':
+            sensor = '%.2f %.4f %.3f' % (rate, self.thickness / 1e3, frequency)
+            return ' '.join([sensor] * self.channels)
+        elif code == 'D':
+            self.film = int(arg or 1)
+            return ''
+        elif code == 'A' and arg.endswith('?'):
+            return 'FILM%s 1.00 100 1.000 0.000 0.000 0 1' % arg[:-1]
+        elif code in ('B', 'C') and arg == '?':
+            return '0 0 0 0 0 0 0'
+        elif code in ('A', 'B', 'C'):
+            return '' # parameters are accepted but not simulated
+        elif code == 'Y':
+            return '0'
+        elif code == 'Z':
+            self.reset()
+            return ''
+        return None
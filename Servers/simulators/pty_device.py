@@ -0,0 +1,117 @@
+"""Base class for instruments simulated on a pseudo-terminal."""
+
+import heapq
+import itertools
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+
+
+class PtyDevice(object):
+    """An instrument answering on the slave end of a pseudo-terminal.
+
+    Open port with the serial server as if it were a COM port.  A thread
+    reads what is written to it, cuts it into requests with split() and
+    passes each one to handle(), which answers with send().  Subclasses
+    implement split() and handle().
+
+    latency is the time every reply takes, plus up to jitter more.  noise
+    is the relative standard deviation of simulated readings (see
+    measure).  Each reply gets a stray byte inserted with probability junk,
+    and one byte corrupted with probability corrupt.
+    """
+
+    name = ''
+
+    def __init__(self, latency=0.0, jitter=0.0, noise=0.0, junk=0.0, corrupt=0.0,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.noise = noise
+        self.junk = junk
+        self.corrupt = corrupt
+        self.random = random.Random(seed)
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._buffer = bytearray()
+        self._replies = [] # heap of (due, seq, bytes)
+        self._seq = itertools.count()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name + ' simulator')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self):
+        while self._running:
+            wait = 0.1
+            if self._replies:
+                wait = min(max(self._replies[0][0] - time.monotonic(), 0), wait)
+            readable, _, _ = select.select([self._master], [], [], wait)
+            if readable:
+                self._buffer += os.read(self._master, 4096)
+                while True:
+                    request = self.split(self._buffer)
+                    if request is None:
+                        break
+                    self.handle(bytes(request))
+            now = time.monotonic()
+            while self._replies and self._replies[0][0] <= now:
+                os.write(self._master, heapq.heappop(self._replies)[2])
+
+    def split(self, buf):
+        """Remove and return the next complete request in buf, or None."""
+        raise NotImplementedError
+
+    def handle(self, request):
+        """Act on one request, answering with send()."""
+        raise NotImplementedError
+
+    def send(self, reply, delay=0.0):
+        """Queue a reply, to go out after the latency plus delay seconds."""
+        reply = bytearray(reply)
+        if reply and self.random.random() < self.corrupt:
+            reply[self.random.randrange(len(reply))] = self.random.randrange(256)
+        if self.random.random() < self.junk:
+            reply.insert(self.random.randrange(len(reply) + 1), self.random.randrange(1, 32))
+        due = time.monotonic() + self.latency + self.jitter * self.random.random() + delay
+        heapq.heappush(self._replies, (due, next(self._seq), bytes(reply)))
+
+    def measure(self, value):
+        """A reading of value, with the configured noise."""
+        return value * (1 + self.random.gauss(0, self.noise))
+
+
+def split_line(buf, terminator):
+    """Remove and return the next request ending in terminator, without it."""
+    end = buf.find(terminator)
+    if end < 0:
+        return None
+    request = bytes(buf[:end])
+    del buf[:end + len(terminator)]
+    return request
+
+
+def split_byte(buf):
+    """Remove and return the next byte, for devices that act on each one."""
+    if not buf:
+        return None
+    request = bytes(buf[:1])
+    del buf[:1]
+    return request
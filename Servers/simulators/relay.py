@@ -0,0 +1,119 @@
+"""Simulated Arduino controllers: the valve and relay box and the shutter steppers.
+
+Both take commands of letters ending in 'r', as sent by
+Valve_Relay_Server.py and Evaporator_Shutter_Control.py, and answer as
+Valve_Controller.ino and stepper_motor_control.ino do.
+"""
+
+import time
+
+from .pty_device import PtyDevice, split_byte, split_line
+
+RELAY_REPLIES = [
+    # (first letter, last letter, reply, state change)
+    ('o', 't', 'Turbo Valve Open', ('turbo valve', True)),
+    ('c', 't', 'Turbo Valve Closed', ('turbo valve', False)),
+    ('o', 'c', 'Chamber Valve Open', ('chamber valve', True)),
+    ('c', 'c', 'Chamber Valve Closed', ('chamber valve', False)),
+    ('o', 'g', 'Gate Valve Open', ('gate valve', True)),
+    ('c', 'g', 'Gate Valve Closed', ('gate valve', False)),
+    ('t', 'p', 'Turbo Turned On', ('turbo pump', True)),
+    ('t', 's', 'Turbo Turned Off', ('turbo pump', False)),
+    ('s', 'p', 'Scroll Pump On', ('scroll pump', True)),
+    ('s', 's', 'Scroll Pump Off', ('scroll pump', False)),
+    ('o', 'a', 'Argon Valve Open', ('argon valve', True)),
+    ('c', 'a', 'Argon Valve Close', ('argon valve', False)),
+]
+
+STEP_TIME = 0.006 # s per motor step
+STEPS_PER_DEGREE = 8 / 1.8
+
+
+class ValveRelay(PtyDevice):
+    """The valve and relay box.  It echoes every character on its own line."""
+
+    name = 'relay'
+
+    def __init__(self, **kw):
+        PtyDevice.__init__(self, **kw)
+        self.state = dict((change[0], False) for _, _, _, change in RELAY_REPLIES)
+        self._command = ''
+
+    def split(self, buf):
+        return split_byte(buf)
+
+    def handle(self, request):
+        char = request.decode('latin-1')
+        self.send((char + '\r\n').encode('latin-1'))
+        if char != 'r':
+            self._command += char
+            return
+        m, self._command = self._command, ''
+        if m.startswith('i'):
+            reply = 'Valve and Relay Control'
+        else:
+            reply = 'Unrecognized Command'
+            for first, last, text, (relay, on) in RELAY_REPLIES:
+                if m.startswith(first) and m.endswith(last):
+                    reply = text
+                    self.state[relay] = on
+                    break
+        self.send((reply + '\r\n').encode('latin-1'))
+
+
+class StepperShutter(PtyDevice):
+    """The shutter stepper controller.
+
+    While a shutter turns it only answers 's', with 'turning', and drops
+    everything else.
+    """
+
+    name = 'shutter'
+
+    def __init__(self, **kw):
+        PtyDevice.__init__(self, **kw)
+        self.effusion_open = False
+        self.degrees = 0.0 # of stepper A, clockwise
+        self._turning_until = 0.0
+
+    def split(self, buf):
+        if time.monotonic() < self._turning_until:
+            return split_byte(buf)
+        return split_line(buf, b'r')
+
+    def handle(self, request):
+        if time.monotonic() < self._turning_until:
+            if request == b's':
+                self.line('turning')
+            return
+        m = request.decode('latin-1').strip()
+        if m.endswith('C') or m.endswith('A'):
+            self.turn(m)
+        elif m == 'i':
+            self.line('Stepper Motor Control')
+        elif m == 's':
+            self.line('stationary')
+        elif m.startswith('eo') or m.startswith('ec'):
+            self.effusion_open = m.startswith('eo')
+            self.line('%s effusion cell shutter' % ('open' if self.effusion_open else 'close'))
+            self.line('m = ')
+        else:
+            self.line('Invalid entry.')
+            self.line('m = ' + m)
+
+    def turn(self, m):
+        degrees = m[1:-1]
+        try:
+            angle = float(degrees)
+        except ValueError:
+            angle = 0.0
+        if m[0] == 'A':
+            self.degrees += angle if m.endswith('C') else -angle
+        duration = angle * STEPS_PER_DEGREE * STEP_TIME
+        self.line('turning evaporator shutter')
+        self._turning_until = time.monotonic() + duration
+        # the firmware prints the angle without a newline before its last line
+        self.send((degrees + 'evaporator has turned\r\n').encode('latin-1'), delay=duration)
+
+    def line(self, text):
+        self.send((text + '\r\n').encode('latin-1'))
@@ -0,0 +1,69 @@
+"""Simulated Pfeiffer RVC 300 pressure controller.
+
+Commands end in CR LF.  'XXX?' reads a parameter as 'XXX=value' and
+'XXX=value' sets it, echoing the new value.  The chamber pressure (PRI?)
+relaxes towards the nominal pressure in pressure mode, or towards a
+pressure set by the nominal flow in flow mode.
+"""
+
+import math
+import time
+
+from .pty_device import PtyDevice, split_line
+
+BASE_PRESSURE = 1e-7 # mbar, with the valve closed
+MBAR_PER_FLOW = 1e-3 # pressure added per unit of nominal flow
+
+
+class RVC300(PtyDevice):
+    """RVC 300 whose pressure settles with time constant tau seconds."""
+
+    name = 'rvc'
+
+    def __init__(self, tau=2.0, **kw):
+        PtyDevice.__init__(self, **kw)
+        self.tau = tau
+        self.pressure = BASE_PRESSURE
+        self.last = time.monotonic()
+        self.settings = {
+            'VER': 'RVC 300 SIM 1.0', 'PRS': '5.01E-09', 'FLO': '000.0',
+            'MOD': 'P', 'TAS': 'E', 'UNT': 'mbar', 'VEN': 'EVR 116',
+            'RAS': '1', 'RSP': '001.0', 'RSD': '000.0', 'RSI': '001.0',
+            'RAR': '0', 'RVA': '1', 'RVD': '1', 'RVI': '1', 'RVO': '1',
+        }
+
+    def split(self, buf):
+        return split_line(buf, b'\n')
+
+    def target(self):
+        try:
+            if self.settings['MOD'] == 'F':
+                return BASE_PRESSURE + MBAR_PER_FLOW * float(self.settings['FLO'])
+            return max(float(self.settings['PRS']), BASE_PRESSURE)
+        except ValueError: # a set point the real unit would have refused
+            return self.pressure
+
+    def _advance(self):
+        now = time.monotonic()
+        # relax exponentially in log(pressure), as a gauge reading would
+        k = math.exp(-(now - self.last) / self.tau)
+        self.pressure = math.exp(k * math.log(self.pressure)
+                                 + (1 - k) * math.log(self.target()))
+        self.last = now
+
+    def handle(self, request):
+        command = request.decode('latin-1').strip()
+        self._advance()
+        name, sep, value = command.partition('=')
+        if command == 'PRI?':
+            self.line('PRI=%.2Embar' % self.measure(self.pressure))
+        elif command.endswith('?') and command[:-1] in self.settings:
+            self.line('%s=%s' % (command[:-1], self.settings[command[:-1]]))
+        elif sep and name in self.settings and name not in ('VER', 'VEN'):
+            self.settings[name] = value
+            self.line(command)
+        else:
+            self.line('?')
+
+    def line(self, text):
+        self.send((text + '\r\n').encode('latin-1'))
@@ -0,0 +1,94 @@
+"""Simulated TDK-Lambda GEN10-240 power supply.
+
+Commands and replies end in CR, and carry a '$' and a two-digit hex
+checksum as TDK_GEN10-240.py sends and checks them.  The output drives a
+resistive load, in constant voltage or constant current as the set
+points require.
+"""
+
+from .pty_device import PtyDevice, split_line
+
+
+def checksum(text):
+    return ('%02X' % (sum(text.encode('latin-1')) % 256))
+
+
+class GEN10240(PtyDevice):
+    """GEN10-240 driving a load of the given resistance in ohms."""
+
+    name = 'tdk'
+    MAX_VOLTS = 10.0
+    MAX_AMPS = 240.0
+
+    def __init__(self, load=0.05, **kw):
+        PtyDevice.__init__(self, **kw)
+        self.load = load
+        self.settings = {
+            'OUT': 'OFF', 'PV': 0.0, 'PC': 0.0, 'RMT': 'REM', 'FLD': 'OFF',
+            'OVP': 11.0, 'UVL': 0.0, 'FBD': 0, 'AST': 'OFF', 'ADR': 6,
+        }
+
+    def split(self, buf):
+        return split_line(buf, b'\r')
+
+    def output(self):
+        """(volts, amps, mode) at the output."""
+        if self.settings['OUT'] != 'ON':
+            return 0.0, 0.0, 'OFF'
+        volts, amps = self.settings['PV'], self.settings['PV'] / self.load
+        if amps <= self.settings['PC']:
+            return volts, amps, 'CV'
+        return self.settings['PC'] * self.load, self.settings['PC'], 'CC'
+
+    def handle(self, request):
+        text = request.decode('latin-1').strip()
+        command, sep, check = text.partition('$')
+        if sep and check != checksum(command):
+            self.reply('C03') # checksum error
+            return
+        try:
+            answer = self.reply_to(command)
+        except ValueError:
+            answer = 'C03'
+        self.reply('C01' if answer is None else answer) # C01: illegal command
+
+    def reply(self, text):
+        self.send((text + '$' + checksum(text) + '\r').encode('latin-1'))
+
+    def reply_to(self, command):
+        """The answer to command, or None if it is not understood."""
+        name, _, arg = command.partition(' ')
+        volts, amps, mode = self.output()
+        if name == 'IDN?':
+            return 'LAMBDA,GEN10-240'
+        elif name == 'MV?':
+            return '%.3f' % self.measure(volts)
+        elif name == 'MC?':
+            return '%.2f' % self.measure(amps)
+        elif name == 'MODE?':
+            return mode
+        elif name in ('PV', 'OVP', 'UVL'):
+            value = float(arg)
+            if not 0 <= value <= self.MAX_VOLTS * 1.1:
+                return 'E04' # out of range
+            self.settings[name] = value
+            return 'OK'
+        elif name == 'PC':
+            value = float(arg)
+            if not 0 <= value <= self.MAX_AMPS:
+                return 'E04'
+            self.settings[name] = value
+            return 'OK'
+        elif name in ('PV?', 'PC?', 'OVP?', 'UVL?'):
+            return '%.3f' % self.settings[name[:-1]]
+        elif name in ('OUT', 'FLD', 'AST'):
+            self.settings[name] = {'1': 'ON', '0': 'OFF'}.get(arg, arg.upper())
+            return 'OK'
+        elif name in ('RMT', 'FBD', 'ADR'):
+            self.settings[name] = arg
+            return 'OK'
+        elif name in ('OUT?', 'FLD?', 'AST?', 'RMT?', 'FBD?'):
+            return str(self.settings[name[:-1]])
+        elif name in ('CLS', 'FBDRST', 'SAV', 'RCL'):
+            return 'OK'
+        return None
@@ -0,0 +1,62 @@
+import unittest
+
+from FTM_2400 import FrameParser, crc, crc_chars
+from simulators import ftm
+
+
+def frame(status, data=''):
+    """A reply frame as FTMWrapper sees it, with one character per byte."""
+    return ftm.frame(status, data).decode('latin-1')
+
+
+class CrcTest(unittest.TestCase):
+
+    def test_matches_the_device(self):
+        for text in ['#@', '$L1?', '*A12.50', '\x88' + 'A' * 100]:
+            self.assertEqual(crc_chars(crc(text)).encode('latin-1'),
+                             ftm.crc(text.encode('latin-1')))
+
+    def test_empty(self):
+        self.assertEqual(crc(''), 0)
+
+    def test_fourteen_bits(self):
+        self.assertLess(crc('x' * 50), 1 << 14)
+
+
+class FrameParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = FrameParser()
+
+    def test_frame(self):
+        reply = frame('A', '12.50')
+        self.parser.feed(reply)
+        self.assertEqual(self.parser.frame(), reply)
+        self.assertIsNone(self.parser.frame())
+
+    def test_frame_in_pieces(self):
+        reply = frame('A', '12.50')
+        self.parser.feed(reply[:4])
+        self.assertIsNone(self.parser.frame())
+        self.parser.feed(reply[4:])
+        self.assertEqual(self.parser.frame(), reply)
+
+    def test_noise_is_dropped(self):
+        reply = frame('A', '0.00')
+        self.parser.feed('x!\x00' + reply + '!')
+        self.assertEqual(self.parser.frame(), reply)
+        self.assertEqual(self.parser.buffer, '!')
+
+    def test_bad_crc_is_rejected(self):
+        reply = frame('A', '12.50')
+        good = frame('A', '3.00')
+        for bad in [reply[:-1] + chr(ord(reply[-1]) ^ 1), reply[:-1] + u'�']:
+            self.parser.feed(bad + good)
+            self.assertEqual(self.parser.frame(), good)
+
+    def test_long_frame(self):
+        # length and CRC bytes above 0x7f
+        reply = frame('A', ' '.join(['1.00 2.0000 5999999.000'] * 4))
+        self.assertGreater(ord(reply[1]), 0x7f)
+        self.parser.feed(reply)
+        self.assertEqual(self.parser.frame(), reply)
@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from serial.serialutil import SerialException
+
+import serial_capture
+from serial_capture import RX, TX, CaptureWriter, ReplaySerial, read_capture
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='captest_')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.filename = os.path.join(self.dir, 'port.cap')
+
+    def test_round_trip(self):
+        writer = CaptureWriter(self.filename)
+        writer.tx(b'IDN?\r')
+        writer.rx(b'')
+        writer.rx(b'LAMBDA\r')
+        writer.close()
+        writer.rx(b'after close')
+        start, records = read_capture(self.filename)
+        self.assertGreater(start, 0)
+        self.assertEqual([(d, data) for t, d, data in records],
+                         [(TX, b'IDN?\r'), (RX, b'LAMBDA\r')])
+        self.assertLessEqual(records[0][0], records[1][0])
+
+    def test_truncated_record_is_dropped(self):
+        writer = CaptureWriter(self.filename)
+        writer.tx(b'abc')
+        writer.rx(b'defgh')
+        writer.close()
+        with open(self.filename, 'rb+') as f:
+            f.truncate(os.path.getsize(self.filename) - 2)
+        _, records = read_capture(self.filename)
+        self.assertEqual([data for _, _, data in records], [b'abc'])
+
+    def test_not_a_capture(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'hello world')
+        self.assertRaises(ValueError, read_capture, self.filename)
+
+    def test_main_lists_records(self):
+        writer = CaptureWriter(self.filename)
+        writer.tx(b'abc')
+        writer.close()
+        self.assertEqual(serial_capture.main([self.filename]), 0)
+
+
+class ReplaySerialTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='captest_')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.filename = os.path.join(self.dir, 'port.cap')
+
+    def capture(self, records):
+        """Write records of (seconds, TX or RX, bytes) as a capture file."""
+        with open(self.filename, 'wb') as f:
+            f.write(serial_capture.MAGIC + serial_capture._START.pack(0.0))
+            for t, direction, data in records:
+                f.write(serial_capture._RECORD.pack(t, direction, len(data)) + data)
+
+    def test_replies_follow_their_write(self):
+        self.capture([(0.0, TX, b'a?'), (0.5, RX, b'1'), (0.7, RX, b'23'),
+                      (1.0, TX, b'b?'), (1.1, RX, b'4')])
+        clock = FakeClock()
+        port = ReplaySerial(self.filename, clock=clock)
+        self.assertEqual(port.in_waiting, 0)
+        port.write(b'a')
+        port.write(b'?') # a write may come in pieces
+        self.assertEqual(port.read(10), b'')
+        clock.now = 0.5
+        self.assertEqual(port.in_waiting, 1)
+        clock.now = 0.7
+        self.assertEqual(port.read(2), b'12')
+        self.assertEqual(port.read(10), b'3')
+        # the reply was 0.1 s after its write
+        port.write(b'b?')
+        clock.now = 0.75
+        self.assertEqual(port.read(10), b'')
+        clock.now = 0.8
+        self.assertEqual(port.read(10), b'4')
+        self.assertEqual(port.mismatches, 0)
+
+    def test_speed(self):
+        self.capture([(0.0, TX, b'a'), (1.0, RX, b'x')])
+        clock = FakeClock()
+        port = ReplaySerial(self.filename, speed=4.0, clock=clock)
+        port.write(b'a')
+        clock.now = 0.25
+        self.assertEqual(port.read(1), b'x')
+
+        port = ReplaySerial(self.filename, speed=0, clock=clock)
+        port.write(b'a')
+        self.assertEqual(port.read(1), b'x')
+
+    def test_mismatch_is_counted(self):
+        self.capture([(0.0, TX, b'a?'), (0.0, RX, b'1')])
+        port = ReplaySerial(self.filename, speed=0)
+        port.write(b'b?')
+        self.assertEqual(port.mismatches, 1)
+        self.assertEqual(port.read(1), b'1')
+
+    def test_read_waits_for_timeout(self):
+        self.capture([(0.0, TX, b'a')])
+        port = ReplaySerial(self.filename)
+        port.timeout = 0.01
+        self.assertEqual(port.read(1), b'')
+
+    def test_cancel_read(self):
+        self.capture([])
+        port = ReplaySerial(self.filename)
+        port.timeout = None
+        port.cancel_read()
+        self.assertEqual(port.read(1), b'')
+
+    def test_closed_port(self):
+        self.capture([(0.0, TX, b'a'), (0.0, RX, b'x')])
+        port = ReplaySerial(self.filename, speed=0)
+        port.close()
+        self.assertRaises(SerialException, port.write, b'a')
+        self.assertRaises(SerialException, port.read, 1)
+        # reopening carries on where the replay was
+        port.open()
+        port.write(b'a')
+        self.assertEqual(port.read(1), b'x')
+
+    def test_reset_input_buffer(self):
+        self.capture([(0.0, TX, b'a'), (0.0, RX, b'x')])
+        port = ReplaySerial(self.filename, speed=0)
+        port.write(b'a')
+        port.reset_input_buffer()
+        self.assertEqual(port.in_waiting, 0)
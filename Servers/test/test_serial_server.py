@@ -0,0 +1,264 @@
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from twisted.internet import reactor, task
+from twisted.python import failure
+
+import serial_server
+from serial_capture import CaptureWriter, ReplaySerial
+from serial_server import (COMMAND, CONTROL, TELEMETRY, PortQueue, PortReader,
+                           StaleRequestError)
+from simulators import ftm, tdk
+
+
+def _wait(d, timeout=10):
+    """Turn the reactor by hand until the Deferred d has fired."""
+    result = []
+    d.addBoth(result.append)
+    end = time.time() + timeout
+    while not result:
+        if time.time() > end:
+            raise AssertionError('Deferred did not fire in {} s'.format(timeout))
+        reactor.iterate(0.001)
+    if isinstance(result[0], failure.Failure):
+        result[0].raiseException()
+    return result[0]
+
+
+class PortQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.queue = PortQueue(self.clock)
+
+    def test_idle_port_is_granted_at_once(self):
+        d = self.queue.acquire()
+        self.assertTrue(d.called)
+        self.assertTrue(self.queue.busy)
+        self.queue.release()
+        self.assertFalse(self.queue.busy)
+
+    def test_priority_then_fifo(self):
+        self.queue.acquire()
+        order = []
+        for name, priority in [('t1', TELEMETRY), ('c1', COMMAND), ('t2', TELEMETRY),
+                               ('x1', CONTROL), ('c2', COMMAND)]:
+            self.queue.acquire(priority).addCallback(lambda _, name=name: order.append(name))
+        for _ in range(5):
+            self.queue.release()
+        self.assertEqual(order, ['x1', 'c1', 'c2', 't1', 't2'])
+        self.assertTrue(self.queue.busy)
+        self.queue.release()
+        self.assertFalse(self.queue.busy)
+
+    def test_deadline(self):
+        self.queue.acquire()
+        stale = self.queue.acquire(TELEMETRY, deadline=1.0)
+        patient = self.queue.acquire(TELEMETRY)
+        errors = []
+        stale.addErrback(errors.append)
+        self.clock.advance(1.5)
+        self.assertEqual(len(errors), 1)
+        errors[0].trap(StaleRequestError)
+        self.queue.release()
+        self.assertTrue(patient.called)
+
+    def test_served_in_time_cancels_deadline(self):
+        self.queue.acquire()
+        d = self.queue.acquire(TELEMETRY, deadline=1.0)
+        self.queue.release()
+        self.assertTrue(d.called)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class Port(object):
+    """A serial port fed by the test."""
+
+    portstr = 'TEST'
+
+    def __init__(self):
+        self.pending = bytearray()
+        self.cond = threading.Condition()
+        self.timeout = None
+        self.is_open = True
+        self.opens = 0
+        self.error = None # raised by the next read
+        self.written = bytearray()
+
+    def feed(self, data):
+        with self.cond:
+            self.pending += data
+            self.cond.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self.pending)
+
+    def write(self, data):
+        if not self.is_open:
+            raise IOError('port is closed')
+        self.written += data
+
+    def read(self, size=1):
+        with self.cond:
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+            if not self.pending:
+                self.cond.wait(self.timeout)
+            data = bytes(self.pending[:size])
+            del self.pending[:size]
+            return data
+
+    def cancel_read(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def close(self):
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+        self.opens += 1
+
+
+class PortReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.port = Port()
+        self.reader = PortReader(self.port)
+        self.addCleanup(self.reader.close)
+
+    def test_read_until(self):
+        reactor.callLater(0.01, self.port.feed, b'abc\r')
+        reactor.callLater(0.02, self.port.feed, b'\nde')
+        self.assertEqual(_wait(self.reader.readUntil(b'\r\n', 5)), b'abc')
+        self.assertEqual(_wait(self.reader.readCount(2, 5)), b'de')
+
+    def test_timeout_returns_what_arrived(self):
+        self.port.feed(b'ab')
+        self.assertEqual(_wait(self.reader.readCount(5, 0.05)), b'ab')
+        self.assertEqual(self.reader.stats.timeouts, 1)
+
+    def test_reads_complete_in_order(self):
+        self.port.feed(b'x;y;')
+        first = self.reader.readUntil(b';', 5)
+        second = self.reader.readUntil(b';', 5)
+        self.assertEqual((_wait(first), _wait(second)), (b'x', b'y'))
+
+    def test_later_timeout_leaves_the_buffer(self):
+        self.port.feed(b'ab')
+        first = self.reader.readUntil(b';', 5)
+        second = self.reader.readCount(5, 0.01)
+        self.assertEqual(_wait(second), b'')
+        self.port.feed(b'c;')
+        self.assertEqual(_wait(first), b'abc')
+
+    def test_read_frame(self):
+        reply = ftm.frame('A', '1.25')
+        self.port.feed(b'noise' + reply)
+        self.assertEqual(_wait(self.reader.readFrame(b'!', 1, -31, 5)), reply)
+
+    def test_read_through(self):
+        self.port.feed(b'\rO\rK$9A\rnext')
+        self.assertEqual(_wait(self.reader.readThrough(b'$', 2, 5)), b'\rO\rK$9A')
+        self.assertEqual(bytes(self.reader.buffer), b'\rnext')
+
+    def test_reopen_does_not_wait_for_the_thread(self):
+        old = self.reader._thread
+        start = time.time()
+        self.reader.reopen()
+        self.assertLess(time.time() - start, serial_server.READ_WAIT)
+        old.join(5)
+        end = time.time() + 5
+        while not self.port.opens and time.time() < end:
+            time.sleep(0.001) # the new thread reopens the port
+        self.assertEqual(self.port.opens, 1)
+        self.port.feed(b'ok\n')
+        self.assertEqual(_wait(self.reader.readUntil(b'\n', 5)), b'ok')
+
+    def test_write_waits_for_reopen(self):
+        self.reader._portLock.acquire() # a reopen in progress
+        self.port.is_open = False
+        writer = threading.Thread(target=self.reader.write, args=(b'x',))
+        writer.start()
+        time.sleep(0.05)
+        self.assertEqual(self.port.written, b'')
+        self.port.is_open = True
+        self.reader._portLock.release()
+        writer.join(5)
+        self.assertEqual(self.port.written, b'x')
+        self.assertEqual(self.reader.stats.bytes_out, 1)
+
+    def test_old_thread_cannot_stop_the_new_one(self):
+        stopped = self.reader._stopped
+        self.reader.reopen()
+        # a failure reported late by the old thread is ignored
+        self.reader._failed(stopped, IOError('closed'))
+        self.port.feed(b'ok\n')
+        self.assertEqual(_wait(self.reader.readUntil(b'\n', 5)), b'ok')
+
+    def test_read_error_finishes_waiting_reads(self):
+        self.port.feed(b'ab')
+        self.assertEqual(_wait(self.reader.readCount(2, 5)), b'ab')
+        d = self.reader.readCount(5, 30)
+        with self.port.cond:
+            self.port.error = IOError('unplugged')
+            self.port.cond.notify_all()
+        self.assertEqual(_wait(d), b'')
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_usb_adapter(self):
+        Info = collections.namedtuple('Info', 'device description hwid vid pid serial_number location')
+        info = Info('COM3', 'USB Serial', 'USB VID:PID=0403:6001', 0x403, 0x6001, 'A1B2', '1-2')
+        self.assertEqual(serial_server.fingerprint(info), '0403:6001:A1B2')
+        info = info._replace(serial_number=None)
+        self.assertEqual(serial_server.fingerprint(info), '0403:6001:1-2')
+
+    def test_other_port(self):
+        self.assertEqual(serial_server.fingerprint(('COM1', 'Serial', 'ACPI\\PNP0501')),
+                         'ACPI\\PNP0501')
+
+
+class ReplayTest(unittest.TestCase):
+    """Captured exchanges replayed through a PortReader, as Open Replay does."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='captest_')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.filename = os.path.join(self.dir, 'port.cap')
+
+    def replay(self, exchange):
+        writer = CaptureWriter(self.filename)
+        for request, reply in exchange:
+            writer.tx(request)
+            writer.rx(reply)
+        writer.close()
+        port = ReplaySerial(self.filename, speed=0)
+        reader = PortReader(port)
+        self.addCleanup(reader.close)
+        return port, reader
+
+    def test_tdk(self):
+        # the supply put a stray CR in the middle of its reply
+        port, reader = self.replay([(b'MV?$' + tdk.checksum('MV?').encode() + b'\r',
+                                     b'\r5.0\r00$' + tdk.checksum('5.000').encode() + b'\r')])
+        port.write(b'MV?$' + tdk.checksum('MV?').encode() + b'\r')
+        reply = _wait(reader.readThrough(b'$', 2, 5)).decode('latin-1')
+        text = ''.join(char for char in reply if ' ' <= char < '\x7f')
+        self.assertEqual(text, '5.000$' + tdk.checksum('5.000'))
+        self.assertEqual(port.mismatches, 0)
+
+    def test_ftm(self):
+        request = b'!#L1?'
+        reply = ftm.frame('A', '12.50')
+        port, reader = self.replay([(request, b'\x00' + reply)])
+        port.write(request)
+        self.assertEqual(_wait(reader.readFrame(b'!', 1, -31, 5)), reply)
@@ -0,0 +1,99 @@
+import os
+import select
+import time
+import unittest
+
+from simulators import SIMULATORS, ftm, tdk
+from simulators.pty_device import split_byte, split_line
+
+
+def exchange(device, request, complete, timeout=5):
+    """Write request to device's port and read until complete(reply) is true."""
+    fd = os.open(device.port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        os.write(fd, request)
+        reply = b''
+        deadline = time.time() + timeout
+        while not complete(reply):
+            left = deadline - time.time()
+            if left <= 0:
+                raise AssertionError('no reply to {!r}; got {!r}'.format(request, reply))
+            if select.select([fd], [], [], left)[0]:
+                reply += os.read(fd, 4096)
+        return reply
+    finally:
+        os.close(fd)
+
+
+def _line(reply):
+    return reply.endswith(b'\r')
+
+
+def _frame(reply):
+    return len(reply) >= 2 and len(reply) >= reply[1] - 31
+
+
+class SplitTest(unittest.TestCase):
+
+    def test_split_line(self):
+        buf = bytearray(b'a\rb\rc')
+        self.assertEqual(split_line(buf, b'\r'), b'a')
+        self.assertEqual(split_line(buf, b'\r'), b'b')
+        self.assertIsNone(split_line(buf, b'\r'))
+        self.assertEqual(buf, b'c')
+
+    def test_split_byte(self):
+        buf = bytearray(b'ab')
+        self.assertEqual(split_byte(buf), b'a')
+        self.assertEqual(split_byte(buf), b'b')
+        self.assertIsNone(split_byte(buf))
+
+    def test_registry(self):
+        self.assertEqual(sorted(SIMULATORS), ['ftm', 'relay', 'rvc', 'shutter', 'tdk'])
+
+
+class TDKTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = tdk.GEN10240(load=0.05, seed=1).start()
+        self.addCleanup(self.device.stop)
+
+    def command(self, text):
+        request = (text + '$' + tdk.checksum(text) + '\r').encode('latin-1')
+        return exchange(self.device, request, _line).decode('latin-1')
+
+    def test_identify(self):
+        self.assertEqual(self.command('IDN?'),
+                         'LAMBDA,GEN10-240$' + tdk.checksum('LAMBDA,GEN10-240') + '\r')
+
+    def test_output(self):
+        self.assertTrue(self.command('PV 1.0').startswith('OK$'))
+        self.assertTrue(self.command('PC 10').startswith('OK$'))
+        self.assertTrue(self.command('OUT 1').startswith('OK$'))
+        # 1 V over 0.05 ohm would be 20 A, so the supply limits the current
+        self.assertTrue(self.command('MODE?').startswith('CC$'))
+
+    def test_bad_checksum(self):
+        reply = exchange(self.device, b'IDN?$00\r', _line).decode('latin-1')
+        self.assertTrue(reply.startswith('C03$'))
+
+
+class FTMTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = ftm.FTM2400(rate=2.0, seed=1).start()
+        self.addCleanup(self.device.stop)
+
+    def command(self, text):
+        body = (chr(len(text) + 34) + text).encode('latin-1')
+        return exchange(self.device, b'!' + body + ftm.crc(body), _frame)
+
+    def test_identify(self):
+        self.assertEqual(self.command('@'), ftm.frame('A', 'FTM-2400 SIM 1.00'))
+
+    def test_invalid_command(self):
+        self.assertEqual(self.command('Q'), ftm.frame('C'))
+
+    def test_shutter(self):
+        self.assertEqual(self.command('U1'), ftm.frame('A'))
+        self.assertEqual(self.command('U?'), ftm.frame('A', '1'))
@@ -4,6 +4,8 @@ the LabRAD servers in an intelligent and thread safe manner without blocking the
 thread.
 '''
 import labrad
+from labrad.types import Error
+from labrad.units import Value
 from PyQt5.QtCore import QThread, pyqtSignal
 
 from datetime import datetime
@@ -263,6 +265,30 @@ class PIDFeedbackController():
             print("Error closing feedback loop, hardware maybe unstable.")
 #
 
+# Tracked FTM readings that are taken from one get_snapshot call, so that the rate and
+# thickness tracked together cost one read of the FTM instead of one each. Maps the
+# accessor a recipe asks for to its index in the snapshot. The snapshot is reused for less
+# than one update period, so every update still gets fresh readings.
+FTM_SNAPSHOT = {'get_sensor_rate':0, 'get_sensor_thickness':1}
+FTM_SNAPSHOT_AGE = Value(0.1,'s')
+
+def snapshotReading(server, index):
+    '''
+    Returns an accessor for one reading of the FTM snapshot, the readings taken in one
+    update of the handler share a snapshot.
+
+    Args:
+        server : The FTM server
+        index (int) : The index of the reading in the snapshot
+    '''
+    def read():
+        try:
+            return server.get_snapshot(FTM_SNAPSHOT_AGE)[index]
+        except Error:
+            return "Timeout"
+    return read
+#
+
 class EquipmentHandler(QThread):
     '''
     Handels communication with the labRAD servers that run the equipment in an intelligent
@@ -436,26 +462,29 @@ class EquipmentHandler(QThread):
             server (str) : The name of the LabRAD server to get the value from
             accessor (str): The accessor function (in the namespace of that server, i.e.
                 getattr(server, accessor) gives the function) to get the value must return
-                one floating point number.
+                one floating point number. The FTM rate and thickness are read together
+                through get_snapshot, see FTM_SNAPSHOT.
             units (str) : The units of the tracked varaible (for display purposes only).
         '''
         try:
             if server in self.servers:
                 if name in self.trackedVarsAccess: # If it already exists, ignore this signal
                     return
-                if hasattr(self.servers[server], accessor):
+                if server == 'ftm_server' and accessor in FTM_SNAPSHOT:
+                    self.trackedVarsAccess[name] = snapshotReading(self.servers[server], FTM_SNAPSHOT[accessor])
+                elif hasattr(self.servers[server], accessor):
                     self.trackedVarsAccess[name] = getattr(self.servers[server], accessor)
-
-                    try: # Try to get a starting value
-                        val = self.trackedVarsAccess[name]()
-                        self.info[name] = float(val)
-                    except:
-                        print("Warning: Couldn't get starting value of " + str(name) + ", starting from zero.")
-                        self.info[name] = 0.0
-
-                    self.guiTrackedVarSignal.emit(True, name, units)
                 else:
                     raise ValueError("Server " + str(server) + " does not have " + str(accessor))
+
+                try: # Try to get a starting value
+                    val = self.trackedVarsAccess[name]()
+                    self.info[name] = float(val)
+                except:
+                    print("Warning: Couldn't get starting value of " + str(name) + ", starting from zero.")
+                    self.info[name] = 0.0
+
+                self.guiTrackedVarSignal.emit(True, name, units)
             else:
                 raise ValueError("Server " + str(server) + " not found")
         except: